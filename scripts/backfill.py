@@ -1,19 +1,53 @@
 #!/usr/bin/env python3
-"""Backfill Q&A index from Lark channel history. Run from repo root with env set."""
+"""Backfill Q&A index from Lark channel history. Run from repo root with env set.
+
+Runs as a staged pipeline:
+  1. fetch   - up to BACKFILL_CHAT_WORKERS chats at once stream their history page by page (oldest first)
+  2. detect  - each page's thread roots go through question detection; only question threads are kept
+               and assembled. A thread is complete once the history has moved BACKFILL_THREAD_SETTLE_HOURS
+               past its last message.
+  3. write   - complete threads go to store.add_qa_many BACKFILL_BATCH_SIZE at a time (batched embedding,
+               chunked writes under each thread's stable record id). Roots already indexed are skipped.
+
+With THREAD_SUMMARY_ENABLED, long threads without an answer_summary (this run's and older ones) are then
+summarized; --summaries-only runs just that pass.
+
+After each page the chat's checkpoint (BACKFILL_CHECKPOINT_PATH) is saved, once every thread completed
+before it has been written. A rerun therefore resumes where the last run stopped: from the saved page,
+or from the oldest thread that was still open.
+"""
+import argparse
 import json
 import logging
+import os
+import queue
 import sys
-from collections import defaultdict
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from pathlib import Path
 
 # Add project root so we can import src
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from src.config import ANSWERED_ONCE_CHAT_IDS, LARK_APP_ID
-from src.lark_client import list_messages
+from src.config import (
+    ANSWERED_ONCE_CHAT_IDS,
+    BACKFILL_BATCH_SIZE,
+    BACKFILL_CHAT_WORKERS,
+    BACKFILL_CHECKPOINT_PATH,
+    BACKFILL_LARK_RATE_LIMIT_BURST,
+    BACKFILL_LARK_RATE_LIMIT_PER_SECOND,
+    BACKFILL_THREAD_SETTLE_HOURS,
+    LARK_APP_ID,
+    THREAD_SUMMARY_ENABLED,
+)
+from src.lark_client import iter_message_pages, set_rate_limit
+from src.lark_http import LarkAPIError
+from src.pipeline import summarize_missing_threads
 from src.question_detector import is_question
-from src.store import THREAD_REPLY_DELIMITER, add_qa
+from src.store import THREAD_REPLY_DELIMITER, QARecord, add_qa_many
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -27,78 +61,326 @@ def _parse_content(content: str) -> str:
         return ""
 
 
-def backfill_chat(chat_id: str) -> int:
-    """Index Q&A from one chat. Returns number of Q&A pairs indexed."""
-    messages = list_messages(chat_id, page_size=50)
-    if not messages:
-        logger.warning("No messages in chat %s", chat_id)
+def _ms(create_time) -> int:
+    try:
+        return int(create_time or 0)
+    except (TypeError, ValueError):
         return 0
-    # Group by root_id: roots have root_id empty; replies have root_id set
-    by_root: dict[str, list[dict]] = defaultdict(list)
-    roots: dict[str, dict] = {}
-    for m in messages:
-        root_id = (m.get("root_id") or "").strip()
-        if not root_id:
-            roots[m.get("message_id") or ""] = m
+
+
+@dataclass
+class Thread:
+    chat_id: str
+    root_id: str
+    question: str
+    root_time: int  # ms
+    last_time: int  # ms, newest message in the thread
+    replies: list[dict] = field(default_factory=list)
+
+
+class ThreadAssembler:
+    """Collects question threads of one chat from pages in create_time order.
+
+    Only question roots (and their replies) are kept. A thread is emitted once its newest message is
+    settle_ms older than the newest message seen. Replies to roots before the window, or to roots that
+    are not questions, are dropped.
+    """
+
+    def __init__(self, chat_id: str, settle_ms: int) -> None:
+        self.chat_id = chat_id
+        self.settle_ms = settle_ms
+        self.open: dict[str, Thread] = {}
+        self.newest = 0
+
+    def add_page(self, items: list[dict]) -> list[Thread]:
+        """Add one page of messages; returns the threads it completed."""
+        roots = [m for m in items if not (m.get("root_id") or "").strip() and m.get("message_id")]
+        texts = {m["message_id"]: _parse_content(m.get("content") or "{}") for m in roots}
+        for m in roots:
+            if is_question(texts[m["message_id"]]):
+                t = _ms(m.get("create_time"))
+                self.open[m["message_id"]] = Thread(self.chat_id, m["message_id"], texts[m["message_id"]], t, t)
+        for m in items:
+            t = _ms(m.get("create_time"))
+            self.newest = max(self.newest, t)
+            thread = self.open.get((m.get("root_id") or "").strip())
+            if thread is None:
+                continue
+            text = _parse_content(m.get("content") or "{}")
+            if text:
+                thread.replies.append({"text": text, "sender_id": m.get("sender_id") or "", "create_time": t})
+                thread.last_time = max(thread.last_time, t)
+        return self.complete(self.newest - self.settle_ms)
+
+    def complete(self, before_ms: int) -> list[Thread]:
+        """Remove and return threads whose newest message is older than before_ms (those with replies)."""
+        done = [t for t in self.open.values() if t.last_time < before_ms]
+        for t in done:
+            del self.open[t.root_id]
+        return [t for t in done if t.replies]
+
+    def resume_time(self) -> int:
+        """Unix seconds a rerun must start from to see every still-open thread from its root."""
+        oldest = min((t.root_time for t in self.open.values()), default=self.newest)
+        return oldest // 1000
+
+
+class Checkpoints:
+    """Per-chat resume points, saved as one JSON file (replaced atomically on every save)."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._state: dict[str, dict] = {}
+        if self.path.exists():
+            try:
+                self._state = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning("Ignoring unreadable checkpoint file %s: %s", self.path, e)
+
+    def get(self, chat_id: str) -> dict:
+        with self._lock:
+            return dict(self._state.get(chat_id) or {})
+
+    def reset(self, chat_id: str) -> None:
+        with self._lock:
+            self._state.pop(chat_id, None)
+
+    def save(self, updates: dict[str, dict]) -> None:
+        if not updates:
+            return
+        with self._lock:
+            for chat_id, state in updates.items():
+                self._state[chat_id] = {**state, "updated_at": datetime.now(timezone.utc).isoformat()}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp.write_text(json.dumps(self._state, indent=2, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self.path)
+
+
+def _pages(chat_id: str, state: dict, end_time: int):
+    """History pages after the checkpoint: from the saved page token, else from its resume time."""
+    token = state.get("page_token")
+    if token and not state.get("complete"):
+        # A page token only continues the query it came from, so finish that walk first
+        window = state.get("start_time"), state.get("end_time")
+        pages = iter_message_pages(chat_id, start_time=window[0], end_time=window[1], page_token=token)
+        try:
+            first = next(pages)
+        except StopIteration:
+            return
+        except LarkAPIError as e:
+            logger.warning("Chat %s: saved page token rejected (%s); resuming by time", chat_id, e)
         else:
-            by_root[root_id].append(m)
-    # Sort replies by create_time; merge all replies into one answer per thread
-    for root_id in by_root:
-        by_root[root_id].sort(key=lambda x: int(x.get("create_time") or 0))
-    count = 0
-    for root_msg_id, root in roots.items():
-        if not root_msg_id:
-            continue
-        content = _parse_content(root.get("content") or "{}")
-        if not is_question(content):
-            continue
-        replies = by_root.get(root_msg_id, [])
-        if not replies:
-            continue
-        reply_texts = []
-        for r in replies:
-            t = _parse_content(r.get("content") or "{}")
-            if t:
-                reply_texts.append(t)
-        if not reply_texts:
+            yield window, first
+            for page in pages:
+                yield window, page
+            return
+    window = state.get("resume_time"), end_time
+    for page in iter_message_pages(chat_id, start_time=window[0], end_time=window[1]):
+        yield window, page
+
+
+class BackfillStopped(Exception):
+    """The writer stage failed; producers stop instead of waiting on a queue nobody drains."""
+
+
+def _put(out: queue.Queue, item: tuple, stop: threading.Event | None) -> None:
+    while True:
+        if stop is not None and stop.is_set():
+            raise BackfillStopped()
+        try:
+            out.put(item, timeout=0.5)
+            return
+        except queue.Full:
             continue
-        answer_text = THREAD_REPLY_DELIMITER.join(reply_texts)
-        last_reply = replies[-1]
-        sender_id = last_reply.get("sender_id") or "unknown"
-        create_time = last_reply.get("create_time") or ""
+
+
+def fetch_chat(
+    chat_id: str,
+    state: dict,
+    out: queue.Queue,
+    *,
+    settle_ms: int,
+    end_time: int,
+    stop: threading.Event | None = None,
+) -> None:
+    """Stages 1-2 for one chat: stream pages, assemble question threads, queue complete ones and checkpoints.
+
+    Raises BackfillStopped once `stop` is set.
+    """
+    assembler = ThreadAssembler(chat_id, settle_ms)
+    pages = state.get("pages", 0)
+    for (start_time, walk_end), (items, next_token) in _pages(chat_id, state, end_time):
+        for thread in assembler.add_page(items):
+            _put(out, ("thread", thread), stop)
+        if next_token is None:
+            # History walked to end_time: threads quiet for settle_ms by then are complete; newer ones
+            # stay open for the next run.
+            for thread in assembler.complete((walk_end or end_time) * 1000 - settle_ms):
+                _put(out, ("thread", thread), stop)
+        pages += 1
+        _put(out, (
+            "checkpoint",
+            chat_id,
+            {
+                "start_time": start_time,
+                "end_time": walk_end,
+                # Resuming from a page token would skip the roots of open threads
+                "page_token": next_token if not assembler.open else None,
+                "resume_time": assembler.resume_time() if assembler.newest else state.get("resume_time"),
+                "pages": pages,
+                "complete": next_token is None,
+            },
+        ), stop)
+
+
+def _reply_time(create_time: int) -> datetime:
+    if create_time:
+        return datetime.fromtimestamp(create_time / 1000, timezone.utc)
+    return datetime.now(timezone.utc)
+
+
+def _to_record(t: Thread) -> QARecord:
+    last = t.replies[-1]
+    sender_id = last["sender_id"] or "unknown"
+    answerer_name = f"User ({sender_id[:12]}...)" if len(sender_id) > 12 else f"User ({sender_id})"
+    return QARecord(
+        question_text=t.question,
+        answer_text=THREAD_REPLY_DELIMITER.join(r["text"] for r in t.replies),
+        answerer_name=answerer_name,
+        answer_time=_reply_time(last["create_time"]),
+        chat_id=t.chat_id,
+        root_message_id=t.root_id,
+        thread_id=t.root_id,
+        answerer_open_id=sender_id if sender_id != "unknown" else None,
+    )
+
+
+def write_threads(threads: list[Thread]) -> dict[str, int]:
+    """Stage 3: index threads whose root is not indexed yet (store.add_qa_many). Returns the number written per chat."""
+    written: dict[str, int] = {}
+    for rec in add_qa_many([_to_record(t) for t in threads]):
+        written[rec.chat_id] = written.get(rec.chat_id, 0) + 1
+    return written
+
+
+def run(
+    chat_ids: list[str],
+    checkpoints: Checkpoints,
+    *,
+    workers: int = BACKFILL_CHAT_WORKERS,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    settle_hours: float = BACKFILL_THREAD_SETTLE_HOURS,
+    end_time: int | None = None,
+) -> dict[str, int]:
+    """Backfill the chats concurrently; returns Q&A pairs indexed per chat.
+
+    If the write stage raises, producers are stopped and the error propagates (checkpoints stay at
+    the last fully written point, so a rerun resumes there).
+    """
+    end_time = int(end_time if end_time is not None else time.time())
+    settle_ms = int(settle_hours * 3600 * 1000)
+    out: queue.Queue = queue.Queue(maxsize=max(batch_size * 4, 16))
+    indexed = dict.fromkeys(chat_ids, 0)
+    stop = threading.Event()
+
+    def produce(chat_id: str) -> None:
+        try:
+            fetch_chat(chat_id, checkpoints.get(chat_id), out, settle_ms=settle_ms, end_time=end_time, stop=stop)
+        except BackfillStopped:
+            return
+        except Exception as e:
+            logger.error("Backfill of chat %s failed (rerun resumes from its last checkpoint): %s", chat_id, e)
         try:
-            ts = datetime.utcfromtimestamp(int(create_time) / 1000) if create_time else datetime.utcnow()
-        except Exception:
-            ts = datetime.utcnow()
-        answerer_name = f"User ({sender_id[:12]}...)" if len(str(sender_id)) > 12 else f"User ({sender_id})"
-        add_qa(
-            question_text=content,
-            answer_text=answer_text,
-            answerer_name=answerer_name,
-            answer_time=ts,
-            chat_id=chat_id,
-            root_message_id=root_msg_id,
-            thread_id=root_msg_id,
-            answerer_open_id=sender_id if sender_id != "unknown" else None,
-        )
-        count += 1
-        logger.info("Indexed Q&A (thread with %d replies): %s", len(reply_texts), content[:50])
-    return count
+            _put(out, ("done", chat_id), stop)
+        except BackfillStopped:
+            pass
+
+    batch: list[Thread] = []
+    pending: dict[str, dict] = {}
+
+    def flush() -> None:
+        if batch:
+            written = write_threads(batch)
+            for chat_id, n in written.items():
+                indexed[chat_id] += n
+            logger.info("Indexed %d of %d complete thread(s) (rest already indexed)", sum(written.values()), len(batch))
+            batch.clear()
+        checkpoints.save(pending)
+        pending.clear()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backfill")
+    try:
+        for chat_id in chat_ids:
+            pool.submit(produce, chat_id)
+        remaining = len(chat_ids)
+        while remaining:
+            try:
+                item = out.get(timeout=1.0)
+            except queue.Empty:
+                flush()
+                continue
+            kind = item[0]
+            if kind == "thread":
+                batch.append(item[1])
+                if len(batch) >= batch_size:
+                    flush()
+            elif kind == "checkpoint":
+                pending[item[1]] = item[2]
+                if not batch:
+                    flush()
+            else:
+                remaining -= 1
+        flush()
+    except BaseException:
+        logger.error("Backfill write stage failed; stopping fetchers")
+        stop.set()
+        raise
+    finally:
+        # Producers see `stop` within one put timeout; chats not started yet are cancelled
+        pool.shutdown(wait=True, cancel_futures=True)
+    return indexed
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("chat_ids", nargs="*", help="chats to backfill (default: ANSWERED_ONCE_CHAT_IDS)")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints for these chats")
+    parser.add_argument("--workers", type=int, default=BACKFILL_CHAT_WORKERS, help="chats fetched at once")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="threads per embed/write")
+    parser.add_argument(
+        "--summaries-only", action="store_true", help="only summarize stored long threads that have no summary yet"
+    )
+    args = parser.parse_args()
+    if args.summaries_only:
+        if not THREAD_SUMMARY_ENABLED:
+            logger.error("Set THREAD_SUMMARY_ENABLED=true (and an LLM key) to summarize threads")
+            sys.exit(1)
+        logger.info("Stored %d thread summaries", summarize_missing_threads())
+        return
     if not LARK_APP_ID:
         logger.error("Set LARK_APP_ID (and LARK_APP_SECRET) in env")
         sys.exit(1)
-    chat_ids = ANSWERED_ONCE_CHAT_IDS
+    chat_ids = args.chat_ids or ANSWERED_ONCE_CHAT_IDS
     if not chat_ids:
         logger.error("Set ANSWERED_ONCE_CHAT_IDS (comma-separated chat IDs) in env to backfill")
         sys.exit(1)
-    total = 0
+    # The server's buckets live in its own process; stay within the backfill's share of the quota.
+    set_rate_limit(BACKFILL_LARK_RATE_LIMIT_PER_SECOND, BACKFILL_LARK_RATE_LIMIT_BURST)
+    checkpoints = Checkpoints(BACKFILL_CHECKPOINT_PATH)
     for cid in chat_ids:
-        logger.info("Backfilling chat %s", cid)
-        total += backfill_chat(cid)
-    logger.info("Backfill done: %d Q&A pairs indexed", total)
+        if args.restart:
+            checkpoints.reset(cid)
+        state = checkpoints.get(cid)
+        if state:
+            logger.info("Chat %s: resuming from %s", cid, "page token" if state.get("page_token") else state.get("resume_time"))
+    indexed = run(chat_ids, checkpoints, workers=args.workers, batch_size=max(1, args.batch_size))
+    for cid, n in indexed.items():
+        logger.info("Chat %s: %d Q&A pairs indexed", cid, n)
+    logger.info("Backfill done: %d Q&A pairs indexed", sum(indexed.values()))
+    if THREAD_SUMMARY_ENABLED:
+        logger.info("Stored %d thread summaries", summarize_missing_threads())
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 """Seed the Q&A index from a curated JSON file. Run from repo root."""
+import hashlib
 import json
 import logging
 import sys
@@ -8,13 +9,16 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from src.store import add_qa
+from src.config import THREAD_SUMMARY_ENABLED
+from src.pipeline import summarize_missing_threads
+from src.store import QARecord, add_qa_many
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
 
 # Expected format: list of { "question": "", "answer": "", "answerer_name": "", "date": "YYYY-MM-DD", "chat_id": "", "root_message_id": "", "thread_id": "" }
-# chat_id/root_message_id/thread_id can be placeholders if not from Lark.
+# chat_id/root_message_id/thread_id can be placeholders if not from Lark. Entries without a root_message_id
+# get one derived from the question, so reseeding the same file does not add duplicates.
 
 
 def load_and_seed(faq_path: str | Path) -> int:
@@ -25,7 +29,7 @@ def load_and_seed(faq_path: str | Path) -> int:
     with open(path, encoding="utf-8") as f:
         data = json.load(f)
     items = data if isinstance(data, list) else data.get("items", data.get("faq", []))
-    count = 0
+    records = []
     for item in items:
         q = (item.get("question") or "").strip()
         a = (item.get("answer") or "").strip()
@@ -38,9 +42,11 @@ def load_and_seed(faq_path: str | Path) -> int:
         except ValueError:
             ts = datetime.utcnow()
         chat_id = (item.get("chat_id") or "seed").strip()
-        root_id = (item.get("root_message_id") or item.get("thread_id") or "seed").strip()
+        root_id = (item.get("root_message_id") or item.get("thread_id") or "").strip()
+        if not root_id:
+            root_id = "seed:" + hashlib.sha1(f"{chat_id}\n{q}".encode("utf-8")).hexdigest()[:16]
         thread_id = (item.get("thread_id") or root_id).strip()
-        add_qa(
+        records.append(QARecord(
             question_text=q,
             answer_text=a,
             answerer_name=name,
@@ -48,16 +54,18 @@ def load_and_seed(faq_path: str | Path) -> int:
             chat_id=chat_id,
             root_message_id=root_id,
             thread_id=thread_id,
-        )
-        count += 1
-        logger.info("Seeded: %s", q[:50])
-    return count
+        ))
+    added = add_qa_many(records, progress=lambda done, total: logger.info("Seeded %d/%d", done, total))
+    return len(added)
 
 
 def main() -> None:
     path = sys.argv[1] if len(sys.argv) > 1 else Path(__file__).parent.parent / "data" / "faq_seed.json"
     n = load_and_seed(path)
-    logger.info("Seeded %d Q&A pairs", n)
+    logger.info("Seeded %d new Q&A pairs", n)
+    if THREAD_SUMMARY_ENABLED:
+        # Bulk writes bypass the quiet-thread scheduler: summarize long answers here
+        logger.info("Stored %d thread summaries", summarize_missing_threads())
 
 
 if __name__ == "__main__":
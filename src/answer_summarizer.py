@@ -1,8 +1,12 @@
 """LLM-based summarization of multiple Q&A candidates into one answer."""
+import asyncio
 import logging
-from .config import LLM_BASE_URL, LLM_MODEL, OPENAI_API_KEY
-from openai import OpenAI
+from typing import AsyncIterator, Iterator
+from .config import LLM_BASE_URL, LLM_DUPLICATE_THRESHOLD, LLM_MODEL, LLM_PROMPT_TOKEN_BUDGET, OPENAI_API_KEY
+from openai import AsyncOpenAI, OpenAI
+from .prompt_budget import count_tokens, fit_candidates
 from .store import QARecord
+from . import summary_cache
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +17,25 @@ Write in a clear, direct style. Keep the summary brief (a few sentences or a sho
 The "Answer" for a pair may be a long thread with multiple replies (e.g. acknowledgments, updates, and a final resolution). Summarize the key outcome or resolution rather than repeating early replies."""
 
 
-def _build_user_prompt(user_question: str, candidates: list[tuple["QARecord", float]]) -> str:
+THREAD_SUMMARY_PROMPT = """You condense a finished discussion thread into a short reference answer.
+Given the question that started the thread and all replies, state the resolution or answer in a few sentences.
+Keep concrete details (commands, links, names, numbers). Drop greetings, acknowledgments and superseded replies.
+Use only information present in the thread. Do not invent or add information."""
+
+
+def _build_user_prompt(
+    user_question: str,
+    candidates: list[tuple["QARecord", float]],
+    token_budget: int = LLM_PROMPT_TOKEN_BUDGET,
+) -> str:
+    """Prompt with the candidates fitted into token_budget (see prompt_budget.fit_candidates)."""
+    fitted, dropped = fit_candidates(user_question, candidates, token_budget, LLM_DUPLICATE_THRESHOLD)
+    if dropped:
+        logger.info("Prompt: dropped %d near-duplicate candidate(s)", dropped)
     parts = [f"User asked: {user_question}", "", "Relevant Q&A pairs from past discussions:"]
-    for i, (rec, _score) in enumerate(candidates, 1):
-        parts.append(f"[{i}] Question: {rec.question_text}")
-        parts.append(f"    Answer: {rec.answer_text}")
+    for i, (question, answer) in enumerate(fitted, 1):
+        parts.append(f"[{i}] Question: {question}")
+        parts.append(f"    Answer: {answer}")
         parts.append("")
     parts.append(
         "Provide a concise summary answer that best addresses the user's question based only on the above. Do not invent information."
@@ -25,37 +43,225 @@ def _build_user_prompt(user_question: str, candidates: list[tuple["QARecord", fl
     return "\n".join(parts)
 
 
+def _client_kwargs() -> dict:
+    client_kwargs: dict = {"api_key": OPENAI_API_KEY}
+    if LLM_BASE_URL:
+        client_kwargs["base_url"] = LLM_BASE_URL
+    return client_kwargs
+
+
+def _client() -> OpenAI:
+    return OpenAI(**_client_kwargs())
+
+
+_async_client_instance: AsyncOpenAI | None = None
+
+
+def _async_client() -> AsyncOpenAI:
+    """One AsyncOpenAI client per process, so its connection pool is reused across requests."""
+    global _async_client_instance
+    if _async_client_instance is None:
+        _async_client_instance = AsyncOpenAI(**_client_kwargs())
+    return _async_client_instance
+
+
+def _summary_messages(user_question: str, candidates: list[tuple["QARecord", float]]) -> tuple[list[dict], int]:
+    """Chat messages for a summary request and their estimated prompt tokens."""
+    user_prompt = _build_user_prompt(user_question, candidates)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    return messages, count_tokens(SYSTEM_PROMPT) + count_tokens(user_prompt)
+
+
+def _cached_summary(
+    candidates: list[tuple["QARecord", float]], query_embedding: list[float] | None
+) -> tuple["summary_cache.SummaryCache | None", str | None]:
+    """(cache to store a new summary in, cached summary for these candidates) — either may be None."""
+    cache = summary_cache.get_cache() if query_embedding is not None else None
+    cached = cache.get(query_embedding, candidates) if cache is not None and candidates else None
+    if cached is not None:
+        logger.info("Summary cache hit (%d candidates)", len(candidates))
+    return cache, cached
+
+
+def _log_usage(response, prompt_tokens: int, n_candidates: int) -> None:
+    usage = getattr(response, "usage", None)
+    logger.info(
+        "LLM summary: prompt_tokens=%s (estimated %d) completion_tokens=%s candidates=%d",
+        getattr(usage, "prompt_tokens", None),
+        prompt_tokens,
+        getattr(usage, "completion_tokens", None),
+        n_candidates,
+    )
+
+
 def summarize_answer(
     user_question: str,
     candidates: list[tuple["QARecord", float]],
+    query_embedding: list[float] | None = None,
 ) -> str:
     """
     Call the LLM to produce a summarized answer from the user's question and the given Q&A candidates.
     Returns the model's reply text. Raises or returns a fallback message on missing key or API errors.
+    With query_embedding, a cached summary for the same candidates and a near-duplicate question is
+    returned without calling the LLM (see summary_cache).
     """
     if not OPENAI_API_KEY:
         logger.warning("OPENAI_API_KEY not set; cannot summarize")
         raise ValueError("OPENAI_API_KEY is required for llm_summarize mode")
     if not candidates:
         return ""
+    cache, cached = _cached_summary(candidates, query_embedding)
+    if cached is not None:
+        return cached
 
-    client_kwargs: dict = {"api_key": OPENAI_API_KEY}
-    if LLM_BASE_URL:
-        client_kwargs["base_url"] = LLM_BASE_URL
-    client = OpenAI(**client_kwargs)
+    client = _client()
+    messages, prompt_tokens = _summary_messages(user_question, candidates)
+    try:
+        response = client.chat.completions.create(model=LLM_MODEL, messages=messages, max_tokens=1024)
+        content = response.choices[0].message.content
+    except Exception as e:
+        logger.exception("LLM summarization failed: %s", e)
+        raise
+    _log_usage(response, prompt_tokens, len(candidates))
+    summary = (content or "").strip()
+    if cache is not None and summary:
+        cache.put(query_embedding, candidates, summary)
+    return summary
 
-    user_prompt = _build_user_prompt(user_question, candidates)
+
+def summarize_answer_stream(
+    user_question: str,
+    candidates: list[tuple["QARecord", float]],
+    query_embedding: list[float] | None = None,
+) -> Iterator[str]:
+    """Like summarize_answer, but yields the summary as text chunks while the LLM generates it.
+
+    Configuration errors (missing key) raise here, before any chunk; API errors raise while iterating.
+    A summary cache hit yields the cached text as one chunk; a completed stream is cached.
+    """
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY not set; cannot summarize")
+        raise ValueError("OPENAI_API_KEY is required for llm_summarize mode")
+    cache, cached = _cached_summary(candidates, query_embedding)
+    return _stream(user_question, candidates, query_embedding, cache, cached)
+
+
+def _stream(
+    user_question: str,
+    candidates: list[tuple["QARecord", float]],
+    query_embedding: list[float] | None,
+    cache: "summary_cache.SummaryCache | None",
+    cached: str | None,
+) -> Iterator[str]:
+    if not candidates:
+        return
+    if cached is not None:
+        yield cached
+        return
+    messages, prompt_tokens = _summary_messages(user_question, candidates)
+    stream = _client().chat.completions.create(model=LLM_MODEL, messages=messages, max_tokens=1024, stream=True)
+    chunks: list[str] = []
+    for event in stream:
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta.content
+        if delta:
+            chunks.append(delta)
+            yield delta
+    summary = "".join(chunks).strip()
+    logger.info("LLM summary (streamed): estimated prompt_tokens=%d candidates=%d", prompt_tokens, len(candidates))
+    if cache is not None and summary:
+        cache.put(query_embedding, candidates, summary)
+
+
+async def asummarize_answer(
+    user_question: str,
+    candidates: list[tuple["QARecord", float]],
+    query_embedding: list[float] | None = None,
+) -> str:
+    """Async summarize_answer on the shared AsyncOpenAI client (same cache, errors and logging).
+
+    The SQLite summary cache and token counting run in a worker thread, off the event loop.
+    """
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY not set; cannot summarize")
+        raise ValueError("OPENAI_API_KEY is required for llm_summarize mode")
+    if not candidates:
+        return ""
+    cache, cached = await asyncio.to_thread(_cached_summary, candidates, query_embedding)
+    if cached is not None:
+        return cached
+    messages, prompt_tokens = await asyncio.to_thread(_summary_messages, user_question, candidates)
     try:
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=1024,
-        )
+        response = await _async_client().chat.completions.create(model=LLM_MODEL, messages=messages, max_tokens=1024)
         content = response.choices[0].message.content
-        return (content or "").strip()
     except Exception as e:
         logger.exception("LLM summarization failed: %s", e)
         raise
+    _log_usage(response, prompt_tokens, len(candidates))
+    summary = (content or "").strip()
+    if cache is not None and summary:
+        await asyncio.to_thread(cache.put, query_embedding, candidates, summary)
+    return summary
+
+
+def asummarize_answer_stream(
+    user_question: str,
+    candidates: list[tuple["QARecord", float]],
+    query_embedding: list[float] | None = None,
+) -> AsyncIterator[str]:
+    """Async summarize_answer_stream: raises ValueError here on a missing key, API errors while iterating.
+
+    The summary cache lookup happens on first iteration, in a worker thread like the other blocking steps.
+    """
+    if not OPENAI_API_KEY:
+        logger.warning("OPENAI_API_KEY not set; cannot summarize")
+        raise ValueError("OPENAI_API_KEY is required for llm_summarize mode")
+    return _astream(user_question, candidates, query_embedding)
+
+
+async def _astream(
+    user_question: str,
+    candidates: list[tuple["QARecord", float]],
+    query_embedding: list[float] | None,
+) -> AsyncIterator[str]:
+    if not candidates:
+        return
+    cache, cached = await asyncio.to_thread(_cached_summary, candidates, query_embedding)
+    if cached is not None:
+        yield cached
+        return
+    messages, prompt_tokens = await asyncio.to_thread(_summary_messages, user_question, candidates)
+    stream = await _async_client().chat.completions.create(
+        model=LLM_MODEL, messages=messages, max_tokens=1024, stream=True
+    )
+    chunks: list[str] = []
+    async for event in stream:
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta.content
+        if delta:
+            chunks.append(delta)
+            yield delta
+    summary = "".join(chunks).strip()
+    logger.info("LLM summary (streamed): estimated prompt_tokens=%d candidates=%d", prompt_tokens, len(candidates))
+    if cache is not None and summary:
+        await asyncio.to_thread(cache.put, query_embedding, candidates, summary)
+
+
+def summarize_thread(question_text: str, answer_text: str) -> str:
+    """Condense one stored thread (question + joined replies) into a short answer_summary."""
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY is required for thread summaries")
+    response = _client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": THREAD_SUMMARY_PROMPT},
+            {"role": "user", "content": f"Question: {question_text}\n\nThread replies:\n{answer_text}"},
+        ],
+        max_tokens=300,
+    )
+    return (response.choices[0].message.content or "").strip()
@@ -0,0 +1,152 @@
+"""Async variant of pipeline.handle_message: Lark and OpenAI calls are awaited on the event loop;
+embedding and vector search run on a bounded thread pool so they never block it."""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from . import embeddings
+from . import formatter
+from . import lark_client
+from . import store
+from .config import (
+    ANSWER_MODE,
+    ASYNC_CPU_WORKERS,
+    BEST_ANSWER_POLICY,
+    LLM_STREAM_MAX_EDITS,
+    LLM_STREAM_UPDATE_MS,
+    LLM_STREAMING,
+)
+from .pipeline import (
+    DONT_KNOW_REPLY,
+    STREAM_PLACEHOLDER,
+    find_candidates,
+    find_match,
+    llm_reply_content,
+    record_reply_content,
+    should_answer,
+)
+
+logger = logging.getLogger(__name__)
+
+# Embedding and search are CPU-bound; at most ASYNC_CPU_WORKERS run at once, the rest wait their turn.
+_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="answer-cpu")
+
+
+async def _offload(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn on the CPU pool and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+async def handle_message(
+    chat_id: str,
+    message_id: str,
+    message_text: str,
+    sender_id: str,
+) -> None:
+    """Same behaviour as pipeline.handle_message, without holding a thread while waiting on the network."""
+    if not should_answer(chat_id, message_id, message_text):
+        return
+    query_embedding = await _offload(embeddings.embed, message_text)
+
+    if ANSWER_MODE == "llm_summarize":
+        sent_id = await _handle_message_llm_summarize(chat_id, message_id, message_text, query_embedding)
+    else:
+        sent_id = await _handle_message_top_1(chat_id, message_id, message_text, query_embedding)
+    if sent_id:
+        logger.info("Replied to message_id=%s sent_id=%s", message_id, sent_id)
+    else:
+        logger.warning("Failed to send reply for message_id=%s", message_id)
+
+
+async def _handle_message_top_1(
+    chat_id: str, message_id: str, message_text: str, query_embedding: list[float]
+) -> str | None:
+    match = await _offload(find_match, chat_id, message_text, query_embedding)
+    if not match:
+        return await lark_client.asend_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+    reply_text, post_content = record_reply_content(match, max_chars=2000)
+    return await lark_client.asend_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+
+
+async def _handle_message_llm_summarize(
+    chat_id: str, message_id: str, message_text: str, query_embedding: list[float]
+) -> str | None:
+    from . import answer_summarizer
+
+    candidates = await _offload(find_candidates, chat_id, message_text, query_embedding)
+    if not candidates:
+        return await lark_client.asend_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+    if LLM_STREAMING:
+        return await _reply_llm_streaming(chat_id, message_id, message_text, query_embedding, candidates)
+    try:
+        summary = await answer_summarizer.asummarize_answer(message_text, candidates, query_embedding=query_embedding)
+    except (ValueError, ImportError) as e:
+        logger.warning("LLM summarization skipped (%s), falling back to top-1", e)
+        return await _reply_best_candidate(chat_id, message_id, candidates)
+    except Exception as e:
+        logger.exception("LLM summarization failed: %s", e)
+        return await lark_client.asend_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+    reply_text, post_content = llm_reply_content(summary, candidates)
+    return await lark_client.asend_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+
+
+async def _reply_best_candidate(chat_id: str, message_id: str, candidates: list) -> str | None:
+    best = store.pick_best_candidate(candidates, policy=BEST_ANSWER_POLICY)
+    if not best:
+        return await lark_client.asend_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+    reply_text, post_content = record_reply_content(best, max_chars=500)
+    return await lark_client.asend_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+
+
+async def _reply_llm_streaming(
+    chat_id: str,
+    message_id: str,
+    message_text: str,
+    query_embedding: list[float],
+    candidates: list,
+) -> str | None:
+    """Placeholder reply edited in place as the summary streams (same throttle and cap as the sync pipeline)."""
+    from . import answer_summarizer
+
+    try:
+        chunks = answer_summarizer.asummarize_answer_stream(message_text, candidates, query_embedding=query_embedding)
+    except (ValueError, ImportError) as e:
+        logger.warning("LLM summarization skipped (%s), falling back to top-1", e)
+        return await _reply_best_candidate(chat_id, message_id, candidates)
+
+    reply_text, post_content = llm_reply_content(STREAM_PLACEHOLDER, candidates)
+    sent_id = await lark_client.asend_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+    interval = LLM_STREAM_UPDATE_MS / 1000.0
+    text = ""
+    shown = reply_text  # what the message says now; the reply is cut to 500 chars, so late chunks may not change it
+    edits = 0
+    last_edit = float("-inf")
+    try:
+        async for chunk in chunks:
+            text += chunk
+            now = time.monotonic()
+            if sent_id and edits < LLM_STREAM_MAX_EDITS - 1 and now - last_edit >= interval:
+                reply_text, post_content = llm_reply_content(text + " …", candidates)
+                last_edit = now
+                if reply_text != shown:
+                    await lark_client.aupdate_message(sent_id, reply_text, post_content=post_content)
+                    shown = reply_text
+                    edits += 1
+    except Exception as e:
+        # A cut-off summary must not stay posted as if it were the answer: replace it like a failed call
+        logger.exception("LLM summarization failed after %d chars: %s", len(text), e)
+        if not sent_id:
+            return await lark_client.asend_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+        await lark_client.aupdate_message(sent_id, DONT_KNOW_REPLY, post_content=formatter.build_plain_post(DONT_KNOW_REPLY))
+        return sent_id
+    reply_text, post_content = llm_reply_content(text.strip(), candidates)
+    if not sent_id:
+        return await lark_client.asend_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+    if reply_text != shown:
+        await lark_client.aupdate_message(sent_id, reply_text, post_content=post_content)
+        edits += 1
+    logger.info("Streamed summary for message_id=%s with %d edit(s)", message_id, edits)
+    return sent_id
@@ -0,0 +1,293 @@
+"""Incremental in-memory BM25 index over question texts, persisted as an append-only JSONL log.
+
+Complements the embedding search for short, jargon-heavy questions (error codes, hostnames,
+command names) whose MiniLM vectors are dominated by the surrounding words.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: no cross-process lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# ASCII words keep internal . - : / _ so "db-01.prod", "E1234" and "kube-proxy" stay whole
+# (their parts are indexed too). CJK text has no spaces: index characters and character bigrams.
+_WORD_RE = re.compile(r"[a-z0-9_]+(?:[.\-:/][a-z0-9_]+)*")
+_PART_RE = re.compile(r"[a-z0-9_]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+_STOPWORDS = frozenset(
+    "a an and are can do does for from how i in is it me my of on or the to we what when where which who why "
+    "with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased terms of text (stopwords dropped); compound tokens also yield their parts."""
+    text = (text or "").lower()
+    terms: list[str] = []
+    for word in _WORD_RE.findall(text):
+        if word in _STOPWORDS:
+            continue
+        terms.append(word)
+        parts = _PART_RE.findall(word)
+        if len(parts) > 1:
+            terms.extend(p for p in parts if p not in _STOPWORDS)
+    for run in _CJK_RE.findall(text):
+        terms.extend(run)
+        terms.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over documents keyed by id, each tagged with chat_id and root_message_id.
+
+    put/delete are O(document length) and are appended to the log at path (if any); the log is
+    replayed on open and compacted once it holds mostly superseded entries. Several processes (server
+    and backfill) may append to one log: appends and compaction take a file lock, and compaction
+    rebuilds from the log on disk, so no process drops another's entries. Each process tails the log
+    (when its size or inode changed) before a search or write, so it sees the others' entries.
+    """
+
+    def __init__(self, path: Path | str | None = None, k1: float = 1.2, b: float = 0.75) -> None:
+        self.path = Path(path) if path is not None else None
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._reset()
+        if self.path is not None:
+            self._load()
+
+    def _reset(self) -> None:
+        self._docs: dict[str, tuple[str, str, str]] = {}  # id -> (text, chat_id, root_message_id)
+        self._tf: dict[str, dict[str, int]] = {}  # id -> term -> count
+        self._len: dict[str, int] = {}
+        self._postings: dict[str, set[str]] = {}  # term -> ids
+        self._total_len = 0
+        self._ids_by_chat: dict[str, set[str]] = {}
+        self._ids_by_root: dict[str, set[str]] = {}
+        self._log_entries = 0
+        self._log_offset = 0  # bytes of the log applied so far
+        self._log_ino: int | None = None  # inode of that log; compaction replaces the file
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    # --- persistence -------------------------------------------------------
+
+    @property
+    def log_exists(self) -> bool:
+        return self.path is not None and self.path.exists()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on <path>.lock, shared by every process using this log."""
+        if self.path is None or fcntl is None:
+            yield
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(self.path.suffix + ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        self._replay()
+        logger.info("Loaded BM25 index %s (%d docs)", self.path, len(self._docs))
+
+    def _replay(self) -> None:
+        """Apply the log past the bytes already applied (all of it after _reset)."""
+        with open(self.path, "rb") as f:
+            self._log_ino = os.fstat(f.fileno()).st_ino
+            f.seek(self._log_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a line another process is still writing is read next time
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("BM25 log %s: skipping unreadable line", self.path)
+                continue
+            self._log_entries += 1
+            self._apply(entry)
+        self._log_offset += end
+
+    def refresh(self) -> None:
+        """Apply entries other processes appended since the last read, or reload a log they compacted."""
+        if self.path is None:
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if st.st_ino != self._log_ino or st.st_size < self._log_offset:
+                self._reset()
+                self._replay()
+            elif st.st_size > self._log_offset:
+                self._replay()
+
+    def _apply(self, entry: dict) -> None:
+        if entry.get("op") == "put":
+            self._put(entry["id"], entry["text"], entry["chat_id"], entry["root"])
+        elif entry.get("op") == "del":
+            self._delete_root(entry["root"])
+
+    def _commit(self, *entries: dict) -> None:
+        """Apply entries in memory and append them to the log (after any entries other processes added)."""
+        if not entries:
+            return
+        if self.path is None:
+            for entry in entries:
+                self._apply(entry)
+            return
+        with self._file_lock():
+            self.refresh()
+            for entry in entries:
+                self._apply(entry)
+            with open(self.path, "ab") as f:
+                f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8"))
+                self._log_offset = f.tell()
+                self._log_ino = os.fstat(f.fileno()).st_ino
+        self._log_entries += len(entries)
+        if self._log_entries > 2 * len(self._docs) + 1000:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the log with one put per live document.
+
+        The live set is rebuilt from the log on disk (which holds every process's appends), and the
+        index in memory is refreshed from it too.
+        """
+        if self.path is None:
+            return
+        with self._lock, self._file_lock():
+            if self.path.exists():
+                self._reset()
+                self._replay()
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for doc_id, (text, chat_id, root) in self._docs.items():
+                    entry = {"op": "put", "id": doc_id, "text": text, "chat_id": chat_id, "root": root}
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            st = os.stat(self.path)
+            self._log_entries = len(self._docs)
+            self._log_offset = st.st_size
+            self._log_ino = st.st_ino
+
+    # --- writes --------------------------------------------------------------
+
+    def put(self, doc_id: str, text: str, chat_id: str, root_message_id: str) -> None:
+        """Index (or re-index) one document; a no-op when it is already indexed unchanged."""
+        with self._lock:
+            if self._docs.get(doc_id) == (text, chat_id, root_message_id):
+                return
+            self._commit({"op": "put", "id": doc_id, "text": text, "chat_id": chat_id, "root": root_message_id})
+
+    def put_many(self, docs: list[tuple[str, str, str, str]]) -> None:
+        """put() for (doc_id, text, chat_id, root_message_id) tuples, appended to the log in one write."""
+        with self._lock:
+            self._commit(*(
+                {"op": "put", "id": doc_id, "text": text, "chat_id": chat_id, "root": root}
+                for doc_id, text, chat_id, root in docs
+                if self._docs.get(doc_id) != (text, chat_id, root)
+            ))
+
+    def delete_by_root(self, root_message_id: str) -> None:
+        with self._lock:
+            if root_message_id not in self._ids_by_root:
+                return
+            self._commit({"op": "del", "root": root_message_id})
+
+    def _put(self, doc_id: str, text: str, chat_id: str, root: str) -> None:
+        self._remove(doc_id)
+        tf: dict[str, int] = {}
+        for term in tokenize(text):
+            tf[term] = tf.get(term, 0) + 1
+        self._docs[doc_id] = (text, chat_id, root)
+        self._tf[doc_id] = tf
+        self._len[doc_id] = sum(tf.values())
+        self._total_len += self._len[doc_id]
+        for term in tf:
+            self._postings.setdefault(term, set()).add(doc_id)
+        self._ids_by_chat.setdefault(chat_id, set()).add(doc_id)
+        self._ids_by_root.setdefault(root, set()).add(doc_id)
+
+    def _delete_root(self, root: str) -> None:
+        for doc_id in list(self._ids_by_root.get(root, ())):
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        old = self._docs.pop(doc_id, None)
+        if old is None:
+            return
+        _text, chat_id, root = old
+        tf = self._tf.pop(doc_id)
+        self._total_len -= self._len.pop(doc_id)
+        for term in tf:
+            ids = self._postings[term]
+            ids.discard(doc_id)
+            if not ids:
+                del self._postings[term]
+        for index, key in ((self._ids_by_chat, chat_id), (self._ids_by_root, root)):
+            ids = index[key]
+            ids.discard(doc_id)
+            if not ids:
+                del index[key]
+
+    # --- reads ---------------------------------------------------------------
+
+    def search(
+        self, text: str, top_k: int, chat_id: str | None = None, min_coverage: float = 0.0
+    ) -> list[tuple[str, str, float]]:
+        """Top-k (doc_id, root_message_id, bm25 score), best first.
+
+        Scope matches VectorStore.search: chat_id's documents when it has any, else all documents.
+        min_coverage drops documents matching less than that share of the query's IDF weight, so a
+        single common word does not count as a lexical match. Entries other processes appended to the
+        log are picked up first.
+        """
+        query = list(dict.fromkeys(tokenize(text)))
+        self.refresh()
+        with self._lock:
+            n = len(self._docs)
+            if not query or n == 0 or top_k <= 0:
+                return []
+            scope = self._ids_by_chat.get(chat_id) if chat_id is not None else None
+            avg_len = self._total_len / n
+            idf = {}
+            for term in query:
+                df = len(self._postings.get(term, ()))
+                idf[term] = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            total_idf = sum(idf.values())
+            scores: dict[str, float] = {}
+            matched: dict[str, float] = {}
+            for term in query:
+                for doc_id in self._postings.get(term, ()):
+                    if scope is not None and doc_id not in scope:
+                        continue
+                    f = self._tf[doc_id][term]
+                    denom = f + self.k1 * (1.0 - self.b + self.b * self._len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * f * (self.k1 + 1.0) / denom
+                    matched[doc_id] = matched.get(doc_id, 0.0) + idf[term]
+            ranked = sorted(
+                (d for d in scores if total_idf <= 0 or matched[d] / total_idf >= min_coverage),
+                key=lambda d: (-scores[d], d),
+            )[:top_k]
+            return [(d, self._docs[d][2], scores[d]) for d in ranked]
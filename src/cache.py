@@ -0,0 +1,63 @@
+"""Small in-process caches shared by the bot's hot paths."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """Thread-safe mapping bounded to maxsize entries; least recently used entries are evicted first.
+
+    With ttl_seconds set, entries also expire that long after they were stored.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float | None = None) -> None:
+        self.maxsize = max(0, maxsize)
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: Hashable) -> bool:
+        """True if key is present and not expired (drops it if expired). Caller holds the lock."""
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if self.ttl_seconds is not None and item[0] <= time.monotonic():
+            del self._data[key]
+            return False
+        return True
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if not self._live(key):
+                return default
+            self._data.move_to_end(key)
+            return self._data[key][1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        expires = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else 0.0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if not self._live(key):
+                return default
+            return self._data.pop(key)[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._live(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
@@ -20,6 +20,13 @@ def _float(value: str | None, default: float) -> float:
         return default
 
 
+def _bool(value: str | None, default: bool) -> bool:
+    v = (value or "").strip().lower()
+    if not v:
+        return default
+    return v in ("1", "true", "yes", "on")
+
+
 def _int(value: str | None, default: int) -> int:
     try:
         return int((value or "").strip()) if value else default
@@ -34,11 +41,58 @@ LARK_BASE_URL = _str(os.getenv("LARK_BASE_URL")) or "https://open.larksuite.com"
 # When set: only answer when the message @mentions the bot (use with "all messages" permission).
 # Get it from a message event where the bot is mentioned: message.mentions[].id.open_id for the bot.
 LARK_BOT_OPEN_ID = _str(os.getenv("LARK_BOT_OPEN_ID"))
+# Lark HTTP transport: keep-alive connection pool to LARK_BASE_URL (idle connections are kept
+# LARK_HTTP_KEEPALIVE_SECONDS) and a cached tenant token, refreshed in the background once less than
+# LARK_TOKEN_REFRESH_MARGIN_SECONDS of its lifetime is left (Lark re-issues tokens in the last 30 minutes)
+LARK_HTTP_MAX_CONNECTIONS = max(1, _int(os.getenv("LARK_HTTP_MAX_CONNECTIONS"), 100))
+LARK_HTTP_MAX_KEEPALIVE = max(1, _int(os.getenv("LARK_HTTP_MAX_KEEPALIVE"), 20))
+LARK_HTTP_KEEPALIVE_SECONDS = max(1.0, _float(os.getenv("LARK_HTTP_KEEPALIVE_SECONDS"), 120.0))
+LARK_HTTP_TIMEOUT_SECONDS = max(0.1, _float(os.getenv("LARK_HTTP_TIMEOUT_SECONDS"), 10.0))
+LARK_TOKEN_REFRESH_MARGIN_SECONDS = max(60.0, _float(os.getenv("LARK_TOKEN_REFRESH_MARGIN_SECONDS"), 1500.0))
+# Client-side rate limit per endpoint (token bucket; Lark's usual app quota is 1000/min with bursts of 50/s).
+# LARK_RATE_LIMITS overrides single endpoints: "PUT /open-apis/im/v1/messages/:id=5/10,..." (rate/burst).
+# Backfill may not use the last LARK_RATE_LIMIT_RESERVE share of a burst, keeping it for live replies.
+LARK_RATE_LIMIT_PER_SECOND = max(0.1, _float(os.getenv("LARK_RATE_LIMIT_PER_SECOND"), 16.0))
+LARK_RATE_LIMIT_BURST = max(1.0, _float(os.getenv("LARK_RATE_LIMIT_BURST"), 50.0))
+LARK_RATE_LIMITS = _str(os.getenv("LARK_RATE_LIMITS"))
+LARK_RATE_LIMIT_RESERVE = min(0.9, max(0.0, _float(os.getenv("LARK_RATE_LIMIT_RESERVE"), 0.2)))
+# Throttled (429 / frequency limit), 5xx and connection errors are retried with jittered exponential
+# backoff (or after Retry-After)
+LARK_MAX_RETRIES = max(0, _int(os.getenv("LARK_MAX_RETRIES"), 4))
+LARK_RETRY_BASE_SECONDS = max(0.0, _float(os.getenv("LARK_RETRY_BASE_SECONDS"), 0.5))
+LARK_RETRY_MAX_SECONDS = max(0.0, _float(os.getenv("LARK_RETRY_MAX_SECONDS"), 30.0))
 
 # Optional: limit to specific chats (comma-separated)
 _chat_ids = _str(os.getenv("ANSWERED_ONCE_CHAT_IDS"))
 ANSWERED_ONCE_CHAT_IDS: list[str] = [x.strip() for x in _chat_ids.split(",") if x.strip()]
 
+# Preload model, vector store and Lark client at server startup (off by default); /ready reports 503 until done
+WARMUP_ON_STARTUP = _bool(os.getenv("WARMUP_ON_STARTUP"), False)
+
+# Thread replies for the same root arriving within this window are indexed as one store update.
+# At most REPLY_COALESCE_MAX_ROOTS threads wait at once; replies for further threads get a 503 (Lark redelivers).
+REPLY_COALESCE_WINDOW_MS = max(0.0, _float(os.getenv("REPLY_COALESCE_WINDOW_MS"), 500.0))
+REPLY_COALESCE_MAX_ROOTS = max(1, _int(os.getenv("REPLY_COALESCE_MAX_ROOTS"), 10000))
+
+# Answer questions on the event loop: async Lark + OpenAI calls, embedding and vector search on a
+# bounded pool of ASYNC_CPU_WORKERS threads (off = the sync pipeline in FastAPI background tasks)
+ASYNC_PIPELINE = _bool(os.getenv("ASYNC_PIPELINE"), False)
+ASYNC_CPU_WORKERS = max(1, _int(os.getenv("ASYNC_CPU_WORKERS"), 4))
+
+# Webhook work queue: WORK_QUEUE_WORKERS threads run answers ahead of reply indexing; at most
+# WORK_QUEUE_MAX_SIZE jobs wait. Indexing only fills WORK_QUEUE_INDEX_SHARE of it; refused or shed index
+# batches are retried after WORK_QUEUE_DEFER_SECONDS, up to WORK_QUEUE_MAX_DEFERRALS times, then dropped.
+# ASYNC_PIPELINE answers skip the queue and run on the event loop, at most WORK_QUEUE_MAX_SIZE at once.
+WORK_QUEUE_WORKERS = max(1, _int(os.getenv("WORK_QUEUE_WORKERS"), 4))
+WORK_QUEUE_MAX_SIZE = max(1, _int(os.getenv("WORK_QUEUE_MAX_SIZE"), 200))
+WORK_QUEUE_INDEX_SHARE = min(1.0, max(0.0, _float(os.getenv("WORK_QUEUE_INDEX_SHARE"), 0.8)))
+WORK_QUEUE_DEFER_SECONDS = max(0.0, _float(os.getenv("WORK_QUEUE_DEFER_SECONDS"), 5.0))
+WORK_QUEUE_MAX_DEFERRALS = max(0, _int(os.getenv("WORK_QUEUE_MAX_DEFERRALS"), 6))
+
+# Cache of thread root text + is-question verdict used when indexing replies
+ROOT_CACHE_SIZE = max(0, _int(os.getenv("ROOT_CACHE_SIZE"), 5000))
+ROOT_CACHE_TTL_SECONDS = max(0.0, _float(os.getenv("ROOT_CACHE_TTL_SECONDS"), 3600.0))
+
 # Similarity
 SIMILARITY_THRESHOLD = _float(os.getenv("SIMILARITY_THRESHOLD"), 0.78)
 
@@ -47,10 +101,105 @@ ANSWER_MODE = _str(os.getenv("ANSWER_MODE")) or "top_1"
 TOP_K_CANDIDATES = max(1, _int(os.getenv("TOP_K_CANDIDATES"), 5))
 BEST_ANSWER_POLICY = _str(os.getenv("BEST_ANSWER_POLICY")) or "similarity"  # similarity | recency | longest
 
+# Optional cross-encoder rerank of the top RERANK_CANDIDATES hits; keeps the best RERANK_TOP_K.
+# Falls back to vector order when scoring (including waiting for one of RERANK_WORKERS threads) takes
+# longer than RERANK_BUDGET_MS.
+RERANK_ENABLED = _bool(os.getenv("RERANK_ENABLED"), False)
+RERANK_MODEL = _str(os.getenv("RERANK_MODEL")) or "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = max(1, _int(os.getenv("RERANK_CANDIDATES"), 20))
+RERANK_TOP_K = max(1, _int(os.getenv("RERANK_TOP_K"), 3))
+RERANK_BUDGET_MS = max(0.0, _float(os.getenv("RERANK_BUDGET_MS"), 150.0))
+RERANK_CACHE_SIZE = max(0, _int(os.getenv("RERANK_CACHE_SIZE"), 10000))
+RERANK_WORKERS = max(1, _int(os.getenv("RERANK_WORKERS"), 2))
+
+# Chroma
+CHROMA_PERSIST_DIR = Path(_str(os.getenv("CHROMA_PERSIST_DIR")) or "./data/chroma")
+
 # LLM (for llm_summarize mode)
 OPENAI_API_KEY = _str(os.getenv("OPENAI_API_KEY")) or _str(os.getenv("LLM_API_KEY"))
 LLM_MODEL = _str(os.getenv("LLM_MODEL")) or "gpt-4o-mini"
 LLM_BASE_URL = _str(os.getenv("LLM_BASE_URL"))  # optional, for non-OpenAI endpoints
+# Prompt budget: tokens of candidate Q&A text sent to the LLM (shared by similarity score);
+# candidates whose question+answer terms overlap >= LLM_DUPLICATE_THRESHOLD (Jaccard) are sent once.
+LLM_PROMPT_TOKEN_BUDGET = max(100, _int(os.getenv("LLM_PROMPT_TOKEN_BUDGET"), 3000))
+LLM_DUPLICATE_THRESHOLD = _float(os.getenv("LLM_DUPLICATE_THRESHOLD"), 0.8)
+# Streaming (off by default): post a placeholder reply at once and edit it as the summary streams in
+# (at most one edit per LLM_STREAM_UPDATE_MS, LLM_STREAM_MAX_EDITS in total; Lark allows 20 edits per message)
+LLM_STREAMING = _bool(os.getenv("LLM_STREAMING"), False)
+LLM_STREAM_UPDATE_MS = max(0.0, _float(os.getenv("LLM_STREAM_UPDATE_MS"), 700.0))
+LLM_STREAM_MAX_EDITS = min(20, max(1, _int(os.getenv("LLM_STREAM_MAX_EDITS"), 15)))
 
-# Chroma
-CHROMA_PERSIST_DIR = Path(_str(os.getenv("CHROMA_PERSIST_DIR")) or "./data/chroma")
+# LLM summary cache (off by default): reuse a summary when the same candidate records (same content) come back for a
+# question at least SUMMARY_CACHE_SIMILARITY cosine to a cached one. Path defaults under CHROMA_PERSIST_DIR.
+SUMMARY_CACHE_ENABLED = _bool(os.getenv("SUMMARY_CACHE_ENABLED"), False)
+SUMMARY_CACHE_TTL_SECONDS = max(0.0, _float(os.getenv("SUMMARY_CACHE_TTL_SECONDS"), 604800.0))
+SUMMARY_CACHE_MAX_ITEMS = max(1, _int(os.getenv("SUMMARY_CACHE_MAX_ITEMS"), 5000))
+SUMMARY_CACHE_SIMILARITY = _float(os.getenv("SUMMARY_CACHE_SIMILARITY"), 0.92)
+SUMMARY_CACHE_PATH = Path(_str(os.getenv("SUMMARY_CACHE_PATH")) or CHROMA_PERSIST_DIR / "summary_cache.sqlite3")
+
+# Per-thread summaries: once a thread has had no new reply for THREAD_SUMMARY_QUIET_SECONDS, threads with
+# at least THREAD_SUMMARY_MIN_CHARS of answer get a compact answer_summary (off by default: one LLM call per thread;
+# needs an LLM key). At most THREAD_SUMMARY_MAX_PENDING threads wait to go quiet at once.
+THREAD_SUMMARY_ENABLED = _bool(os.getenv("THREAD_SUMMARY_ENABLED"), False) and bool(OPENAI_API_KEY)
+THREAD_SUMMARY_QUIET_SECONDS = max(0.0, _float(os.getenv("THREAD_SUMMARY_QUIET_SECONDS"), 600.0))
+THREAD_SUMMARY_MIN_CHARS = max(0, _int(os.getenv("THREAD_SUMMARY_MIN_CHARS"), 600))
+THREAD_SUMMARY_MAX_CONCURRENCY = max(1, _int(os.getenv("THREAD_SUMMARY_MAX_CONCURRENCY"), 2))
+THREAD_SUMMARY_MAX_PENDING = max(1, _int(os.getenv("THREAD_SUMMARY_MAX_PENDING"), 10000))
+
+# Embeddings: model and backend (torch | onnx | onnx_int8). onnx backends need `optimum[onnxruntime]`.
+EMBEDDING_MODEL = _str(os.getenv("EMBEDDING_MODEL")) or "all-MiniLM-L6-v2"
+EMBEDDING_BACKEND = (_str(os.getenv("EMBEDDING_BACKEND")) or "torch").lower()
+# Optional ONNX file inside the model repo, e.g. onnx/model_qint8_avx512.onnx (default: picked for this CPU)
+EMBEDDING_ONNX_FILE = _str(os.getenv("EMBEDDING_ONNX_FILE"))
+# Concurrent embed() calls are collected for this many ms and encoded as one batch (0 = off)
+EMBED_BATCH_WINDOW_MS = max(0.0, _float(os.getenv("EMBED_BATCH_WINDOW_MS"), 5.0))
+EMBED_BATCH_MAX_SIZE = max(1, _int(os.getenv("EMBED_BATCH_MAX_SIZE"), 64))
+
+# Vector store backend: chroma (default) | numpy (in-process brute-force matrix, persisted as .npy + .json snapshot
+# plus a .log journal of later writes; safe to share between the server and scripts)
+# | memory (same matrix, not persisted; for benchmarks and tests)
+STORE_BACKEND = (_str(os.getenv("STORE_BACKEND")) or "chroma").lower()
+NUMPY_STORE_PATH = Path(_str(os.getenv("NUMPY_STORE_PATH")) or CHROMA_PERSIST_DIR / "numpy_index")
+# Partitioning: none (one index) | chat (one index per chat, loaded lazily; numpy partitions are LRU-evicted over
+# the memory budget). Rows of an existing unpartitioned index are copied into the partitions on first start.
+# STORE_GLOBAL_INDEX keeps an all-chats index as well, for chats with no records yet.
+STORE_PARTITIONING = (_str(os.getenv("STORE_PARTITIONING")) or "none").lower()
+STORE_PARTITION_MEMORY_MB = max(0.0, _float(os.getenv("STORE_PARTITION_MEMORY_MB"), 512.0))
+STORE_GLOBAL_INDEX = _bool(os.getenv("STORE_GLOBAL_INDEX"), True)
+# Bulk indexing (store.add_qa_many: seed and backfill scripts): questions per embedding call, rows per store write
+STORE_BULK_EMBED_BATCH = max(1, _int(os.getenv("STORE_BULK_EMBED_BATCH"), 256))
+STORE_BULK_WRITE_CHUNK = max(1, _int(os.getenv("STORE_BULK_WRITE_CHUNK"), 1000))
+
+# Hybrid retrieval (off by default): BM25 over question texts fused with vector hits by reciprocal-rank fusion.
+# Lexical hits count when they cover HYBRID_MIN_TERM_COVERAGE of the query's IDF weight, and a thread found
+# only through BM25 still needs a cosine of min(SIMILARITY_THRESHOLD, HYBRID_LEXICAL_MIN_SCORE).
+HYBRID_SEARCH = _bool(os.getenv("HYBRID_SEARCH"), False)
+HYBRID_CANDIDATE_MULTIPLIER = max(1, _int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER"), 4))
+HYBRID_RRF_K = max(1, _int(os.getenv("HYBRID_RRF_K"), 60))
+HYBRID_MIN_TERM_COVERAGE = min(1.0, max(0.0, _float(os.getenv("HYBRID_MIN_TERM_COVERAGE"), 0.5)))
+HYBRID_LEXICAL_MIN_SCORE = _float(os.getenv("HYBRID_LEXICAL_MIN_SCORE"), 0.5)
+BM25_INDEX_PATH = Path(_str(os.getenv("BM25_INDEX_PATH")) or CHROMA_PERSIST_DIR / "bm25.jsonl")
+
+# Webhook dedupe: drop Lark redeliveries (same event_id or message_id) seen within the window.
+# memory = per process; sqlite = shared file for multi-worker deployments
+WEBHOOK_DEDUPE_BACKEND = (_str(os.getenv("WEBHOOK_DEDUPE_BACKEND")) or "memory").lower()
+WEBHOOK_DEDUPE_WINDOW_SECONDS = max(0.0, _float(os.getenv("WEBHOOK_DEDUPE_WINDOW_SECONDS"), 25200.0))
+WEBHOOK_DEDUPE_MAX_EVENTS = max(1, _int(os.getenv("WEBHOOK_DEDUPE_MAX_EVENTS"), 100000))
+WEBHOOK_DEDUPE_PATH = Path(_str(os.getenv("WEBHOOK_DEDUPE_PATH")) or CHROMA_PERSIST_DIR / "webhook_dedupe.sqlite3")
+
+# Embedding cache: memory LRU + SQLite tier keyed by hash(model, normalized text). 0 items disables a tier.
+EMBED_CACHE_ENABLED = _bool(os.getenv("EMBED_CACHE_ENABLED"), True)
+EMBED_CACHE_MEMORY_ITEMS = max(0, _int(os.getenv("EMBED_CACHE_MEMORY_ITEMS"), 10000))
+EMBED_CACHE_DISK_ITEMS = max(0, _int(os.getenv("EMBED_CACHE_DISK_ITEMS"), 200000))
+EMBED_CACHE_PATH = Path(_str(os.getenv("EMBED_CACHE_PATH")) or CHROMA_PERSIST_DIR / "embedding_cache.sqlite3")
+
+# Backfill (scripts/backfill.py): chats fetched at once, threads per embedding batch / store write,
+# how long a thread must be quiet before it is indexed, and where per-chat resume points are kept
+BACKFILL_CHAT_WORKERS = max(1, _int(os.getenv("BACKFILL_CHAT_WORKERS"), 4))
+BACKFILL_BATCH_SIZE = max(1, _int(os.getenv("BACKFILL_BATCH_SIZE"), 64))
+BACKFILL_THREAD_SETTLE_HOURS = max(0.0, _float(os.getenv("BACKFILL_THREAD_SETTLE_HOURS"), 24.0))
+BACKFILL_CHECKPOINT_PATH = Path(_str(os.getenv("BACKFILL_CHECKPOINT_PATH")) or CHROMA_PERSIST_DIR / "backfill_checkpoints.json")
+# Rate limit buckets are per process: the backfill script gets its own, smaller Lark budget (per endpoint)
+# so that it plus the server's LARK_RATE_LIMIT_* stay within the app's quota.
+BACKFILL_LARK_RATE_LIMIT_PER_SECOND = max(0.1, _float(os.getenv("BACKFILL_LARK_RATE_LIMIT_PER_SECOND"), 4.0))
+BACKFILL_LARK_RATE_LIMIT_BURST = max(1.0, _float(os.getenv("BACKFILL_LARK_RATE_LIMIT_BURST"), 8.0))
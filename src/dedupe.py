@@ -0,0 +1,108 @@
+"""Webhook idempotency: remember event/message keys for a time window so Lark redeliveries are dropped."""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduper:
+    """In-process dedupe: keys are remembered for window_seconds, at most max_items at a time."""
+
+    def __init__(self, window_seconds: float, max_items: int = 100000) -> None:
+        self._seen = LRUCache(max_items, ttl_seconds=window_seconds)
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, keys: list[str]) -> bool:
+        """True if any key was seen within the window; otherwise records all keys and returns False."""
+        keys = [k for k in keys if k]
+        with self._lock:
+            if any(k in self._seen for k in keys):
+                return True
+            for k in keys:
+                self._seen.put(k, True)
+        return False
+
+    def forget(self, keys: list[str]) -> None:
+        """Unmark keys (the delivery was not accepted), so a redelivery is processed."""
+        for k in keys:
+            if k:
+                self._seen.pop(k)
+
+
+class SqliteEventDeduper:
+    """Dedupe shared by several worker processes through one SQLite file (check + mark in one transaction)."""
+
+    _PURGE_EVERY = 500
+
+    def __init__(self, path: Path, window_seconds: float) -> None:
+        self._window = window_seconds
+        self._lock = threading.Lock()
+        self._calls = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen_events (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+
+    def is_duplicate(self, keys: list[str]) -> bool:
+        keys = [k for k in keys if k]
+        if not keys:
+            return False
+        now = time.time()
+        marks = ",".join("?" * len(keys))
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                row = self._conn.execute(
+                    f"SELECT 1 FROM seen_events WHERE key IN ({marks}) AND seen_at > ? LIMIT 1",
+                    [*keys, now - self._window],
+                ).fetchone()
+                if row is None:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO seen_events (key, seen_at) VALUES (?, ?)", [(k, now) for k in keys]
+                    )
+                self._calls += 1
+                if self._calls % self._PURGE_EVERY == 0:
+                    self._conn.execute("DELETE FROM seen_events WHERE seen_at <= ?", (now - self._window,))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                # Fail open: a missed dedupe costs a duplicate reply, a false positive loses a question.
+                logger.warning("Webhook dedupe check failed: %s", e)
+                try:
+                    self._conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                return False
+        return row is not None
+
+    def forget(self, keys: list[str]) -> None:
+        """Unmark keys (the delivery was not accepted), so a redelivery is processed."""
+        keys = [k for k in keys if k]
+        if not keys:
+            return
+        with self._lock:
+            try:
+                self._conn.executemany("DELETE FROM seen_events WHERE key = ?", [(k,) for k in keys])
+            except sqlite3.Error as e:
+                logger.warning("Webhook dedupe unmark failed: %s", e)
+
+
+def dedupe_keys(event_id: str | None, message_id: str | None) -> list[str]:
+    """Keys for one webhook delivery: Lark's header.event_id and the message_id it carries."""
+    keys = []
+    if event_id:
+        keys.append(f"event:{event_id}")
+    if message_id:
+        keys.append(f"message:{message_id}")
+    return keys
+
+
+def create_deduper(backend: str, window_seconds: float, max_items: int, path: Path):
+    """EventDeduper for backend "memory", SqliteEventDeduper for "sqlite" (multi-worker deployments)."""
+    if backend == "sqlite":
+        return SqliteEventDeduper(path, window_seconds)
+    return EventDeduper(window_seconds, max_items)
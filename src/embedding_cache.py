@@ -0,0 +1,165 @@
+"""Content-addressed embedding cache: in-memory LRU tier backed by an optional SQLite tier."""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """Hash of model name and normalized text; the same text embeds the same way under one model."""
+    normalized = " ".join((text or "").split())
+    return hashlib.sha256(f"{model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier cache of embedding vectors keyed by cache_key().
+
+    Lookups hit the memory LRU first, then SQLite (promoting hits into memory).
+    Both tiers are size-bounded; the disk tier evicts least recently used rows, sizing itself with
+    COUNT(*) so rows other processes (server and backfill) add to the same file count too.
+    Vectors are held as float32 arrays (4 bytes per dimension, not a list of Python floats)
+    and handed out as lists.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        memory_items: int = 10000,
+        disk_path: Path | None = None,
+        disk_items: int = 200000,
+    ) -> None:
+        self.model_name = model_name
+        self._memory = LRUCache(memory_items)
+        self._disk_items = max(0, disk_items)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._disk_count = 0  # rows in the disk tier at the last write (or open)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path is not None and self._disk_items > 0:
+            self._open_disk(Path(disk_path))
+
+    def _open_disk(self, path: Path) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            conn.commit()
+            self._disk_count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache: disk tier disabled (%s): %s", path, e)
+            self._conn = None
+
+    def get_many(self, texts: list[str]) -> dict[str, list[float]]:
+        """Return {text: vector} for the texts that are cached; counts one hit or miss per text."""
+        found: dict[str, list[float]] = {}
+        disk_lookup: dict[str, str] = {}
+        for text in texts:
+            key = cache_key(self.model_name, text)
+            vec = self._memory.get(key)
+            if vec is not None:
+                found[text] = vec.tolist()
+            else:
+                disk_lookup[key] = text
+        memory_hits = len(found)
+        if disk_lookup and self._conn is not None:
+            rows = self._disk_get(list(disk_lookup))
+            for key, vec in rows.items():
+                found[disk_lookup.pop(key)] = vec.tolist()
+                self._memory.put(key, vec)
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += len(found) - memory_hits
+            self.misses += len(disk_lookup)
+        return found
+
+    def get(self, text: str) -> list[float] | None:
+        return self.get_many([text]).get(text)
+
+    def put_many(self, items: dict[str, list[float] | np.ndarray]) -> None:
+        """Store {text: vector} in both tiers."""
+        if not items:
+            return
+        keyed = {cache_key(self.model_name, text): np.asarray(vec, dtype=np.float32) for text, vec in items.items()}
+        for key, vec in keyed.items():
+            self._memory.put(key, vec)
+        if self._conn is not None:
+            self._disk_put(keyed)
+
+    def _disk_get(self, keys: list[str]) -> dict[str, np.ndarray]:
+        out: dict[str, np.ndarray] = {}
+        with self._lock:
+            try:
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start : start + 500]
+                    marks = ",".join("?" * len(chunk))
+                    for key, blob in self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk
+                    ):
+                        out[key] = np.frombuffer(blob, dtype=np.float32)
+                if out:
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in out]
+                    )
+                    self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Embedding cache read failed: %s", e)
+        return out
+
+    def _disk_put(self, keyed: dict[str, np.ndarray]) -> None:
+        now = time.time()
+        rows = [(key, vec.tobytes(), now) for key, vec in keyed.items()]
+        with self._lock:
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+                )
+                if self._conn.total_changes > before:
+                    # Counted, not tracked: other processes write to the same file
+                    count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                    overflow = count - self._disk_items
+                    if overflow > 0:
+                        self._conn.execute(
+                            "DELETE FROM embeddings WHERE key IN "
+                            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                            (overflow,),
+                        )
+                        count -= overflow
+                    self._disk_count = count
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Embedding cache write failed: %s", e)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "disk_items": self._disk_count,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,28 +1,247 @@
 """Embedding model: same model for indexing and querying."""
 import logging
-from typing import Any
+import platform
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from .config import (
+    EMBED_BATCH_MAX_SIZE,
+    EMBED_BATCH_WINDOW_MS,
+    EMBED_CACHE_DISK_ITEMS,
+    EMBED_CACHE_ENABLED,
+    EMBED_CACHE_MEMORY_ITEMS,
+    EMBED_CACHE_PATH,
+    EMBEDDING_BACKEND,
+    EMBEDDING_MODEL,
+    EMBEDDING_ONNX_FILE,
+)
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
 _model: Any = None
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def _cpu_flags() -> set[str]:
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def _int8_onnx_file() -> str:
+    """Pick the pre-quantized ONNX file published with sentence-transformers models for this CPU."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    flags = _cpu_flags()
+    if "avx512_vnni" in flags:
+        return "onnx/model_qint8_avx512_vnni.onnx"
+    if "avx512f" in flags:
+        return "onnx/model_qint8_avx512.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+def _load_torch(model_name: str) -> Any:
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def _load_onnx(model_name: str) -> Any:
+    from sentence_transformers import SentenceTransformer
+    model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else None
+    return SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+
+
+def _load_onnx_int8(model_name: str) -> Any:
+    from sentence_transformers import SentenceTransformer
+    file_name = EMBEDDING_ONNX_FILE or _int8_onnx_file()
+    return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+# Embedding backends by EMBEDDING_BACKEND name. A loader takes the model name and returns
+# an object with a sentence-transformers style encode(texts, batch_size=, normalize_embeddings=).
+BACKENDS: dict[str, Callable[[str], Any]] = {
+    "torch": _load_torch,
+    "onnx": _load_onnx,
+    "onnx_int8": _load_onnx_int8,
+}
+
+
+def load_backend(backend: str, model_name: str = EMBEDDING_MODEL) -> Any:
+    """Load model_name with the named backend (see BACKENDS)."""
+    loader = BACKENDS.get(backend)
+    if loader is None:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected one of {sorted(BACKENDS)}")
+    return loader(model_name)
+
+
+def model_id() -> str:
+    """Identity of the configured model + backend; vectors from different ids are not interchangeable."""
+    if EMBEDDING_BACKEND == "torch":
+        return EMBEDDING_MODEL
+    if EMBEDDING_BACKEND == "onnx_int8":
+        return f"{EMBEDDING_MODEL}|onnx_int8|{EMBEDDING_ONNX_FILE or _int8_onnx_file()}"
+    return f"{EMBEDDING_MODEL}|{EMBEDDING_BACKEND}|{EMBEDDING_ONNX_FILE}"
 
 
 def get_model():
-    """Lazy-load sentence-transformers model."""
+    """Lazy-load the embedding model with the configured backend."""
     global _model
     if _model is None:
         try:
-            from sentence_transformers import SentenceTransformer
-            _model = SentenceTransformer("all-MiniLM-L6-v2")
-            logger.info("Loaded embedding model all-MiniLM-L6-v2")
+            _model = load_backend(EMBEDDING_BACKEND)
+            logger.info("Loaded embedding model %s (backend=%s)", EMBEDDING_MODEL, EMBEDDING_BACKEND)
         except Exception as e:
             logger.exception("Failed to load embedding model: %s", e)
             raise
     return _model
 
 
+def warmup() -> list[float]:
+    """Load the model and run one dummy encode (bypassing the cache); returns the vector."""
+    vectors = get_model().encode(["Is the embedding model warm?"], normalize_embeddings=True)
+    return vectors[0].tolist()
+
+
+def get_cache() -> EmbeddingCache | None:
+    """Lazy-open the embedding cache (None when EMBED_CACHE_ENABLED is off)."""
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    model_id(),
+                    memory_items=EMBED_CACHE_MEMORY_ITEMS,
+                    disk_path=EMBED_CACHE_PATH if EMBED_CACHE_DISK_ITEMS > 0 else None,
+                    disk_items=EMBED_CACHE_DISK_ITEMS,
+                )
+    return _cache
+
+
+def cache_stats() -> dict[str, int]:
+    """Hit/miss counters and tier sizes of the embedding cache (empty when disabled)."""
+    cache = get_cache()
+    return cache.stats() if cache is not None else {}
+
+
+def _clean(text: str) -> str:
+    """Normalize whitespace; the cache keys on the same normalization."""
+    cleaned = " ".join((text or "").split())
+    return cleaned or " "
+
+
+def _encode(texts: list[str]) -> list[list[float]]:
+    """Encode cleaned texts in one batch (duplicates encoded once) and fill the cache."""
+    unique = list(dict.fromkeys(texts))
+    vectors = get_model().encode(
+        unique,
+        batch_size=max(EMBED_BATCH_MAX_SIZE, 1),
+        normalize_embeddings=True,
+    )
+    cache = get_cache()
+    if cache is not None:
+        cache.put_many(dict(zip(unique, vectors)))
+    by_text = {t: v.tolist() for t, v in zip(unique, vectors)}
+    return [by_text[t] for t in texts]
+
+
+def embed_many(texts: list[str]) -> list[list[float]]:
+    """Return embedding vectors for texts (same order); cache misses are encoded in one batch."""
+    if not texts:
+        return []
+    cleaned = [_clean(t) for t in texts]
+    cache = get_cache()
+    found = cache.get_many(cleaned) if cache is not None else {}
+    missing = [t for t in cleaned if t not in found]
+    if missing:
+        found.update(zip(missing, _encode(missing)))
+    return [found[t] for t in cleaned]
+
+
+class _MicroBatcher:
+    """Collect embed() calls from concurrent threads for a short window and encode them together."""
+
+    def __init__(self, window_seconds: float, max_size: int) -> None:
+        self._window = window_seconds
+        self._max_size = max(1, max_size)
+        self._cond = threading.Condition()
+        self._pending: list[tuple[str, Future]] = []
+        self._thread: threading.Thread | None = None
+
+    def submit(self, text: str) -> list[float]:
+        fut: Future = Future()
+        with self._cond:
+            self._pending.append((text, fut))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return fut.result()
+
+    def _next_batch(self) -> list[tuple[str, Future]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self._window
+            while len(self._pending) < self._max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[: self._max_size]
+            del self._pending[: self._max_size]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                vectors = _encode([text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            if len(batch) > 1:
+                logger.debug("Embedded micro-batch of %d texts", len(batch))
+            for (_, fut), vec in zip(batch, vectors):
+                fut.set_result(vec)
+
+
+_batcher: _MicroBatcher | None = None
+_batcher_lock = threading.Lock()
+
+
+def _get_batcher() -> _MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = _MicroBatcher(EMBED_BATCH_WINDOW_MS / 1000.0, EMBED_BATCH_MAX_SIZE)
+    return _batcher
+
+
 def embed(text: str) -> list[float]:
-    """Return embedding vector for text. Same model for index and query."""
-    if not text or not text.strip():
-        return get_model().encode(" ", normalize_embeddings=True).tolist()
-    return get_model().encode(text.strip(), normalize_embeddings=True).tolist()
+    """Return embedding vector for text. Same model for index and query.
+
+    Cached texts return immediately; otherwise concurrent callers are micro-batched
+    into one encode (see EMBED_BATCH_WINDOW_MS). A window of 0 encodes on the calling thread.
+    """
+    cleaned = _clean(text)
+    cache = get_cache()
+    if cache is not None:
+        hit = cache.get(cleaned)
+        if hit is not None:
+            return hit
+    if EMBED_BATCH_WINDOW_MS <= 0:
+        return _encode([cleaned])[0]
+    return _get_batcher().submit(cleaned)
@@ -64,3 +64,9 @@ def build_post_content(
         content.append([{"tag": "text", "text": ""}])
         content.append(source_line)
     return {"zh_cn": {"content": content, "title": ""}, "en_us": {"content": content, "title": ""}}
+
+
+def build_plain_post(text: str) -> dict:
+    """Post content with just text (used to edit a post message into a plain reply)."""
+    content = [[{"tag": "text", "text": text}]]
+    return {"zh_cn": {"content": content, "title": ""}, "en_us": {"content": content, "title": ""}}
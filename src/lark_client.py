@@ -1,42 +1,144 @@
-"""Lark API client: tenant token and send message."""
+"""Lark API client: send, edit, list (or stream) and fetch messages over the pooled transport in lark_http."""
+import asyncio
+import json
 import logging
-import lark_oapi as lark
-from lark_oapi.api.im.v1 import (
-    CreateMessageRequest,
-    CreateMessageRequestBody,
-    GetMessageRequest,
-    ListMessageRequest,
-    ReplyMessageRequest,
-    ReplyMessageRequestBody,
-)
-from lark_oapi.core.const import FEISHU_DOMAIN, LARK_DOMAIN
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
 
-from .config import LARK_APP_ID, LARK_APP_SECRET, LARK_BASE_URL
+from .config import (
+    LARK_APP_ID,
+    LARK_APP_SECRET,
+    LARK_BASE_URL,
+    LARK_HTTP_KEEPALIVE_SECONDS,
+    LARK_HTTP_MAX_CONNECTIONS,
+    LARK_HTTP_MAX_KEEPALIVE,
+    LARK_HTTP_TIMEOUT_SECONDS,
+    LARK_MAX_RETRIES,
+    LARK_RATE_LIMIT_BURST,
+    LARK_RATE_LIMIT_PER_SECOND,
+    LARK_RATE_LIMIT_RESERVE,
+    LARK_RATE_LIMITS,
+    LARK_RETRY_BASE_SECONDS,
+    LARK_RETRY_MAX_SECONDS,
+    LARK_TOKEN_REFRESH_MARGIN_SECONDS,
+)
+from .lark_http import AsyncLarkHTTP, LarkHTTP, LatencyRegistry
+from .rate_limit import PRIORITY_BACKFILL, PRIORITY_LIVE, RateLimiter, parse_limits
 
 logger = logging.getLogger(__name__)
 
+MESSAGES_PATH = "/open-apis/im/v1/messages"
 
-def _domain() -> str:
-    if "feishu.cn" in LARK_BASE_URL:
-        return FEISHU_DOMAIN
-    return LARK_DOMAIN
+# Per-endpoint latency and rate limit buckets of every Lark call, sync and async
+_latency = LatencyRegistry()
+_limiter = RateLimiter(
+    parse_limits(LARK_RATE_LIMITS),
+    (LARK_RATE_LIMIT_PER_SECOND, LARK_RATE_LIMIT_BURST),
+    reserve_share=LARK_RATE_LIMIT_RESERVE,
+)
 
 
-_client: lark.Client | None = None
+def set_rate_limit(rate: float, burst: float) -> None:
+    """Limit every endpoint of this process to rate/burst (scripts running next to the server).
 
+    Call before the first Lark request; clients already created keep the old limiter.
+    """
+    global _limiter
+    _limiter = RateLimiter(None, (rate, burst), reserve_share=0.0)
 
-def get_client() -> lark.Client:
-    global _client
-    if _client is None:
-        _client = (
-            lark.Client.builder()
-            .app_id(LARK_APP_ID)
-            .app_secret(LARK_APP_SECRET)
-            .domain(_domain())
-            .log_level(lark.LogLevel.WARNING)
-            .build()
-        )
-    return _client
+
+def _transport_kwargs() -> dict:
+    return {
+        "max_connections": LARK_HTTP_MAX_CONNECTIONS,
+        "max_keepalive": LARK_HTTP_MAX_KEEPALIVE,
+        "keepalive_expiry": LARK_HTTP_KEEPALIVE_SECONDS,
+        "timeout": LARK_HTTP_TIMEOUT_SECONDS,
+        "refresh_margin": LARK_TOKEN_REFRESH_MARGIN_SECONDS,
+        "latency": _latency,
+        "limiter": _limiter,
+        "max_retries": LARK_MAX_RETRIES,
+        "retry_base": LARK_RETRY_BASE_SECONDS,
+        "retry_max": LARK_RETRY_MAX_SECONDS,
+    }
+
+
+_http: LarkHTTP | None = None
+_http_lock = threading.Lock()
+
+
+def get_http() -> LarkHTTP:
+    """Shared blocking transport (one connection pool and tenant token per process)."""
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                _http = LarkHTTP(LARK_BASE_URL, LARK_APP_ID, LARK_APP_SECRET, **_transport_kwargs())
+    return _http
+
+
+def warmup() -> None:
+    """Fetch the tenant token, opening the first pooled connection to Lark."""
+    get_http().token()
+
+
+def metrics() -> dict:
+    """Per-endpoint latency histograms and rate limit waits; token fetch and retry counts."""
+    out = {"endpoints": _latency.snapshot(), "rate_limits": _limiter.stats()}
+    if _http is not None:
+        out["sync"] = _http.stats()
+    if _async_http is not None:
+        out["async"] = _async_http.stats()
+    return out
+
+
+def _message_body(text: str, post_content: dict | None) -> tuple[str, str]:
+    """(content JSON, msg_type) of a text message, or of a post when post_content is set."""
+    if post_content is not None:
+        return json.dumps(post_content, ensure_ascii=False), "post"
+    return json.dumps({"text": text}, ensure_ascii=False), "text"
+
+
+def _send_request(
+    chat_id: str, text: str, root_id: str | None, post_content: dict | None
+) -> tuple[str, str, dict, dict | None]:
+    """(method, path, json body, query params) that send a message, in a thread when root_id is set.
+
+    The body carries a uuid so Lark drops a duplicate when a retried send had in fact gone through.
+    """
+    content, msg_type = _message_body(text, post_content)
+    if root_id:
+        body = {"content": content, "msg_type": msg_type, "reply_in_thread": True, "uuid": str(uuid.uuid4())}
+        return "POST", f"{MESSAGES_PATH}/{root_id}/reply", body, None
+    body = {"receive_id": chat_id, "content": content, "msg_type": msg_type, "uuid": str(uuid.uuid4())}
+    return "POST", MESSAGES_PATH, body, {"receive_id_type": "chat_id"}
+
+
+def _list_item(msg: dict) -> dict:
+    sender = msg.get("sender") or {}
+    return {
+        "message_id": msg.get("message_id") or "",
+        "root_id": msg.get("root_id") or "",
+        "parent_id": msg.get("parent_id") or "",
+        "content": (msg.get("body") or {}).get("content") or "",
+        "sender_id": sender.get("id") or sender.get("open_id") or "",
+        "create_time": msg.get("create_time") or "",
+    }
+
+
+def _get_message_result(data: dict) -> dict | None:
+    items = data.get("items") or []
+    if not items:
+        return None
+    msg = items[0]
+    sender = msg.get("sender") or {}
+    return {
+        "content": (msg.get("body") or {}).get("content") or "",
+        "create_time": msg.get("create_time"),
+        "sender_id": sender.get("open_id") or sender.get("id") or "",
+        "chat_id": msg.get("chat_id") or "",
+    }
 
 
 def send_text_message(
@@ -45,113 +147,181 @@ def send_text_message(
     *,
     root_id: str | None = None,
     post_content: dict | None = None,
+    priority: int = PRIORITY_LIVE,
 ) -> str | None:
     """Send a text or post message. If post_content is set, sends rich post with @mention/link."""
-    if post_content is not None:
-        content = lark.JSON.marshal(post_content)
-        msg_type = "post"
-    else:
-        content = lark.JSON.marshal({"text": text})
-        msg_type = "text"
-    client = get_client()
+    method, path, body, params = _send_request(chat_id, text, root_id, post_content)
     try:
-        if root_id:
-            body = (
-                ReplyMessageRequestBody.builder()
-                .content(content)
-                .msg_type(msg_type)
-                .reply_in_thread(True)
-                .build()
-            )
-            request = ReplyMessageRequest.builder().message_id(root_id).request_body(body).build()
-            response = client.im.v1.message.reply(request)
-        else:
-            body_builder = (
-                CreateMessageRequestBody.builder()
-                .receive_id(chat_id)
-                .msg_type(msg_type)
-                .content(content)
-            )
-            request = (
-                CreateMessageRequest.builder()
-                .receive_id_type("chat_id")
-                .request_body(body_builder.build())
-                .build()
-            )
-            if hasattr(client.im.v1, "message") and hasattr(client.im.v1.message, "create"):
-                response = client.im.v1.message.create(request)
-            else:
-                response = client.im.v1.chat.create(request)
-        if not response.success():
-            logger.error("Lark send message failed: code=%s msg=%s", response.code, response.msg)
-            return None
-        return response.data.message_id
+        return get_http().request(method, path, json=body, params=params, priority=priority).get("message_id")
     except Exception as e:
-        logger.exception("Lark send message error: %s", e)
+        logger.error("Lark send message failed: %s", e)
         return None
 
 
-def list_messages(chat_id: str, *, page_size: int = 50) -> list[dict]:
-    """List messages in a chat (paginated)."""
-    out: list[dict] = []
-    page_token: str | None = None
-    while True:
-        req_builder = (
-            ListMessageRequest.builder()
-            .container_id_type("chat")
-            .container_id(chat_id)
-            .page_size(page_size)
-        )
-        if page_token:
-            req_builder = req_builder.page_token(page_token)
-        request = req_builder.build()
-        try:
-            response = get_client().im.v1.message.list(request)
-        except Exception as e:
-            logger.exception("List messages error: %s", e)
-            break
-        if not response.success():
-            logger.error("List messages failed: code=%s msg=%s", response.code, response.msg)
-            break
-        items = response.data.items or []
-        for i in items:
-            body = getattr(i, "body", None) or {}
-            content = getattr(body, "content", None) or ""
-            sender = getattr(i, "sender", None) or {}
-            sender_id = getattr(sender, "id", None) or getattr(sender, "open_id", None) or ""
-            out.append({
-                "message_id": getattr(i, "message_id", None) or "",
-                "root_id": getattr(i, "root_id", None) or "",
-                "parent_id": getattr(i, "parent_id", None) or "",
-                "content": content,
-                "sender_id": sender_id,
-                "create_time": getattr(i, "create_time", None) or "",
-            })
-        page_token = getattr(response.data, "page_token", None) if response.data else None
-        if not page_token or len(items) < page_size:
-            break
-    return out
+def update_message(
+    message_id: str,
+    text: str,
+    *,
+    post_content: dict | None = None,
+) -> bool:
+    """Edit a message the bot sent (text or post, same type as sent). Lark allows ~20 edits per message."""
+    content, msg_type = _message_body(text, post_content)
+    try:
+        get_http().request("PUT", f"{MESSAGES_PATH}/{message_id}", json={"content": content, "msg_type": msg_type})
+        return True
+    except Exception as e:
+        logger.error("Lark update message failed: %s", e)
+        return False
+
+
+def _fetch_page(chat_id: str, params: dict, priority: int) -> tuple[list[dict], str | None]:
+    try:
+        data = get_http().request("GET", MESSAGES_PATH, params=params, priority=priority)
+    except Exception as e:
+        logger.error("List messages failed for chat_id=%s: %s", chat_id, e)
+        raise
+    items = data.get("items") or []
+    # Lark may return short (even empty) pages mid-history; only has_more / page_token end the walk
+    page_token = data.get("page_token") if data.get("has_more", True) else None
+    return [_list_item(i) for i in items], page_token or None
+
+
+def iter_message_pages(
+    chat_id: str,
+    *,
+    page_size: int = 50,
+    start_time: int | None = None,
+    end_time: int | None = None,
+    page_token: str | None = None,
+    priority: int = PRIORITY_BACKFILL,
+) -> Iterator[tuple[list[dict], str | None]]:
+    """Yield (messages, next page_token) per page of a chat's history, oldest first; token is None on the last page.
+
+    start_time / end_time bound create_time (Unix seconds, inclusive); page_token resumes a previous
+    walk. The next page is fetched in the background while the caller processes the current one.
+    Like list_messages, a page that still fails after the transport's retries raises.
+    """
+    base = {"container_id_type": "chat", "container_id": chat_id, "page_size": page_size}
+    if start_time is not None:
+        base["start_time"] = str(int(start_time))
+    if end_time is not None:
+        base["end_time"] = str(int(end_time))
+    prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lark-prefetch")
+
+    def fetch(token: str | None) -> Future:
+        params = {**base, "page_token": token} if token else base
+        return prefetcher.submit(_fetch_page, chat_id, params, priority)
+
+    try:
+        pending = fetch(page_token)
+        while pending is not None:
+            items, page_token = pending.result()
+            pending = fetch(page_token) if page_token else None
+            yield items, page_token
+    finally:
+        prefetcher.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_messages(chat_id: str, **kwargs) -> Iterator[dict]:
+    """Yield a chat's messages one by one as pages arrive (same keyword arguments as iter_message_pages)."""
+    for items, _ in iter_message_pages(chat_id, **kwargs):
+        yield from items
+
+
+def list_messages(
+    chat_id: str,
+    *,
+    page_size: int = 50,
+    start_time: int | None = None,
+    end_time: int | None = None,
+    priority: int = PRIORITY_BACKFILL,
+) -> list[dict]:
+    """List messages in a chat (paginated), at backfill priority by default.
 
+    Throttled pages are retried by the transport; a page that still fails raises (LarkAPIError or an
+    httpx error) rather than returning a silently truncated history. For long histories prefer
+    iter_messages / iter_message_pages, which do not hold the whole chat in memory.
+    """
+    return list(
+        iter_messages(chat_id, page_size=page_size, start_time=start_time, end_time=end_time, priority=priority)
+    )
 
-def get_message(message_id: str) -> dict | None:
+
+def get_message(message_id: str, *, priority: int = PRIORITY_LIVE) -> dict | None:
     """Fetch a message by ID. Returns dict with content, create_time, sender_id, chat_id, or None."""
     try:
-        request = GetMessageRequest.builder().message_id(message_id).build()
-        response = get_client().im.v1.message.get(request)
-        if not response.success() or not response.data:
-            return None
-        msg = response.data
-        if hasattr(msg, "items") and msg.items:
-            msg = msg.items[0]
-        content = getattr(getattr(msg, "body", None), "content", None) or ""
-        create_time = getattr(msg, "create_time", None)
-        sender = getattr(msg, "sender", None)
-        sender_id = getattr(sender, "open_id", None) or getattr(sender, "id", None) or "" if sender else ""
-        chat_id = getattr(msg, "chat_id", None) or ""
-        return {"content": content, "create_time": create_time, "sender_id": sender_id, "chat_id": chat_id}
+        data = get_http().request("GET", f"{MESSAGES_PATH}/{message_id}", priority=priority)
+    except Exception as e:
+        logger.error("Get message failed: %s", e)
+        return None
+    return _get_message_result(data)
+
+
+_async_http: AsyncLarkHTTP | None = None
+_async_http_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_async_http() -> AsyncLarkHTTP:
+    """Pooled async transport for the running event loop (created on first use)."""
+    global _async_http, _async_http_loop
+    loop = asyncio.get_running_loop()
+    if _async_http is None or _async_http_loop is not loop:
+        _async_http = AsyncLarkHTTP(LARK_BASE_URL, LARK_APP_ID, LARK_APP_SECRET, **_transport_kwargs())
+        _async_http_loop = loop
+    return _async_http
+
+
+async def aclose() -> None:
+    """Close the async transport's connections (on shutdown)."""
+    global _async_http, _async_http_loop
+    if _async_http is not None:
+        await _async_http.aclose()
+    _async_http = None
+    _async_http_loop = None
+
+
+async def asend_text_message(
+    chat_id: str,
+    text: str,
+    *,
+    root_id: str | None = None,
+    post_content: dict | None = None,
+) -> str | None:
+    """Async send_text_message: returns the sent message_id, or None on failure."""
+    method, path, body, params = _send_request(chat_id, text, root_id, post_content)
+    try:
+        return (await get_async_http().request(method, path, json=body, params=params)).get("message_id")
+    except Exception as e:
+        logger.error("Lark send message failed: %s", e)
+        return None
+
+
+async def aupdate_message(
+    message_id: str,
+    text: str,
+    *,
+    post_content: dict | None = None,
+) -> bool:
+    """Async update_message."""
+    content, msg_type = _message_body(text, post_content)
+    try:
+        await get_async_http().request(
+            "PUT", f"{MESSAGES_PATH}/{message_id}", json={"content": content, "msg_type": msg_type}
+        )
+        return True
+    except Exception as e:
+        logger.error("Lark update message failed: %s", e)
+        return False
+
+
+async def aget_message(message_id: str) -> dict | None:
+    """Async get_message: dict with content, create_time, sender_id, chat_id, or None."""
+    try:
+        data = await get_async_http().request("GET", f"{MESSAGES_PATH}/{message_id}")
     except Exception as e:
-        logger.exception("Get message error: %s", e)
+        logger.error("Get message failed: %s", e)
         return None
+    return _get_message_result(data)
 
 
 def build_thread_link(chat_id: str, message_id: str) -> str:
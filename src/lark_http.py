@@ -0,0 +1,475 @@
+"""Lark Open API transport: pooled keep-alive httpx clients, cached tenant token, rate limiting and
+retries, per-endpoint latency."""
+import asyncio
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any
+
+import httpx
+
+from .rate_limit import PRIORITY_LIVE, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATH = "/open-apis/auth/v3/tenant_access_token/internal"
+# Lark codes for an expired / invalid tenant token; the request is retried once with a fresh token
+INVALID_TOKEN_CODES = frozenset({99991661, 99991663, 99991668})
+# Lark "request trigger frequency limit"; retried like HTTP 429
+RATE_LIMIT_CODES = frozenset({99991400})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Never use a token this close to its stated expiry (refresh blocks instead)
+TOKEN_HARD_MARGIN_SECONDS = 30.0
+# Histogram bucket upper bounds, milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_ID_SEGMENT_RE = re.compile(r"/(?:om|oc|ou|on|omt)_[^/]+")
+
+
+class LarkAPIError(Exception):
+    """Lark returned a non-zero code (or a non-JSON error response)."""
+
+    def __init__(self, code: int, msg: str) -> None:
+        super().__init__(f"code={code} msg={msg}")
+        self.code = code
+        self.msg = msg
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """Histogram label for a request: message/chat/user ids in the path become :id."""
+    return f"{method.upper()} {_ID_SEGMENT_RE.sub('/:id', path.split('?', 1)[0])}"
+
+
+class LatencyHistogram:
+    """Latency counts over LATENCY_BUCKETS_MS (plus an overflow bucket)."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        ms = seconds * 1000.0
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.errors += int(error)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound (ms) of the bucket holding the q-quantile; inf when it falls in the overflow bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip((*LATENCY_BUCKETS_MS, float("inf")), self.counts):
+            seen += n
+            if seen >= rank:
+                return float(bound)
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": {
+                **{f"le_{b}": n for b, n in zip(LATENCY_BUCKETS_MS, self.counts)},
+                "inf": self.counts[-1],
+            },
+        }
+
+
+class LatencyRegistry:
+    """Per-endpoint latency histograms, shared by the sync and async transports."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: dict[str, LatencyHistogram] = {}
+
+    def observe(self, endpoint: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            hist = self._histograms.get(endpoint)
+            if hist is None:
+                hist = self._histograms[endpoint] = LatencyHistogram()
+            hist.observe(seconds, error)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: h.snapshot() for name, h in sorted(self._histograms.items())}
+
+
+class _TokenState:
+    """Tenant token and its deadlines. Past refresh_at a request starts a background refresh and keeps
+    using the current token; past hard_expiry requests wait for a new one."""
+
+    def __init__(self, refresh_margin: float) -> None:
+        self.refresh_margin = refresh_margin
+        self.token: str | None = None
+        self.refresh_at = 0.0
+        self.hard_expiry = 0.0
+        self.fetches = 0
+        self.refreshing = False
+
+    def set(self, body: dict) -> None:
+        if body.get("code", 0) != 0 or not body.get("tenant_access_token"):
+            raise LarkAPIError(body.get("code", -1), body.get("msg", "tenant token request failed"))
+        expire = float(body.get("expire") or 7200)
+        now = time.monotonic()
+        self.token = body["tenant_access_token"]
+        self.hard_expiry = now + max(expire - TOKEN_HARD_MARGIN_SECONDS, expire / 2)
+        self.refresh_at = now + max(expire - self.refresh_margin, 0.0)
+        self.fetches += 1
+
+    def usable(self, stale: str | None) -> bool:
+        return self.token is not None and self.token != stale and time.monotonic() < self.hard_expiry
+
+    def due(self) -> bool:
+        return not self.refreshing and time.monotonic() >= self.refresh_at
+
+
+def _limits(max_connections: int, max_keepalive: int | None, keepalive_expiry: float) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections if max_keepalive is None else max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+
+def _json(response: httpx.Response) -> dict:
+    """Response body; a non-JSON body (e.g. a gateway error page) becomes code = -HTTP status."""
+    try:
+        return response.json()
+    except ValueError:
+        return {"code": -response.status_code, "msg": response.text[:200]}
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    """Seconds the server asked us to wait (Retry-After, or Lark's x-ogw-ratelimit-reset), if any."""
+    for header in ("Retry-After", "x-ogw-ratelimit-reset"):
+        value = response.headers.get(header)
+        if not value:
+            continue
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0.0, min(cap, base * 2**attempt))
+
+
+def retry_delay(
+    response: httpx.Response, body: dict, attempt: int, base: float, cap: float
+) -> tuple[float, bool] | None:
+    """(seconds to wait, whether we were throttled) if the call should be retried, else None."""
+    throttled = response.status_code == 429 or body.get("code") in RATE_LIMIT_CODES
+    if not throttled and response.status_code not in RETRY_STATUSES:
+        return None
+    hinted = retry_after(response)
+    if hinted is not None:
+        return hinted + random.uniform(0.0, base), throttled
+    return backoff(attempt, base, cap), throttled
+
+
+def _data(body: dict) -> dict:
+    if body.get("code", 0) != 0:
+        raise LarkAPIError(body.get("code"), body.get("msg", ""))
+    return body.get("data") or {}
+
+
+class LarkHTTP:
+    """Blocking Lark Open API calls over one keep-alive connection pool.
+
+    The tenant token is fetched once and reused; within refresh_margin seconds of its expiry the next
+    request starts a background refresh, so in steady state no request waits on a token.
+    (Lark only issues a new token once the current one has less than 30 minutes left.)
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        app_id: str,
+        app_secret: str,
+        *,
+        max_connections: int = 100,
+        max_keepalive: int | None = None,
+        keepalive_expiry: float = 120.0,
+        timeout: float = 10.0,
+        refresh_margin: float = 1500.0,
+        latency: LatencyRegistry | None = None,
+        limiter: RateLimiter | None = None,
+        max_retries: int = 4,
+        retry_base: float = 0.5,
+        retry_max: float = 30.0,
+        transport: httpx.BaseTransport | None = None,
+        verify: Any = True,
+    ) -> None:
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.latency = latency or LatencyRegistry()
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max(0, max_retries)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retries = 0
+        self._client = httpx.Client(
+            base_url=base_url,
+            timeout=timeout,
+            limits=_limits(max_connections, max_keepalive, keepalive_expiry),
+            transport=transport,
+            verify=verify,
+        )
+        self._token = _TokenState(refresh_margin)
+        self._token_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _timed(self, method: str, path: str, **kwargs: Any) -> tuple[httpx.Response, dict]:
+        start = time.perf_counter()
+        error = True
+        try:
+            response = self._client.request(method, path, **kwargs)
+            body = _json(response)
+            error = body.get("code", 0) != 0
+            return response, body
+        finally:
+            self.latency.observe(endpoint_name(method, path), time.perf_counter() - start, error)
+
+    def _request_token(self) -> dict:
+        _, body = self._timed("POST", TOKEN_PATH, json={"app_id": self.app_id, "app_secret": self.app_secret})
+        return body
+
+    def _background_refresh(self) -> None:
+        # The fetch runs outside _token_lock: requests keep using the current token until the swap.
+        try:
+            body = self._request_token()
+            with self._token_lock:
+                self._token.set(body)
+        except Exception as e:
+            logger.warning("Lark tenant token refresh failed (will retry): %s", e)
+        finally:
+            self._token.refreshing = False
+
+    def token(self, *, stale: str | None = None) -> str:
+        """Current tenant token; waits for a fetch only when there is none, it expired, or it equals `stale`."""
+        if self._token.usable(stale):
+            # Held only to claim the refresh, never during a fetch
+            with self._refresh_lock:
+                start = self._token.due()
+                if start:
+                    self._token.refreshing = True
+            if start:
+                threading.Thread(target=self._background_refresh, name="lark-token", daemon=True).start()
+            return self._token.token
+        with self._token_lock:
+            if not self._token.usable(stale):
+                self._token.set(self._request_token())
+            return self._token.token
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: dict | None = None,
+        params: dict | None = None,
+        priority: int = PRIORITY_LIVE,
+    ) -> dict:
+        """Send an authorized request; returns the response's `data` object. Raises LarkAPIError on code != 0.
+
+        Each attempt takes a token from the endpoint's rate limit bucket (at `priority`). Throttling,
+        5xx and connection errors are retried up to max_retries times with jittered exponential backoff,
+        or after the server's Retry-After; a throttled endpoint's bucket is paused for that long.
+        """
+        endpoint = endpoint_name(method, path)
+        token = self.token()
+        refreshed = False
+        attempt = 0
+        while True:
+            self.limiter.acquire(endpoint, priority)
+            try:
+                response, body = self._send(method, path, token, json, params)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff(attempt, self.retry_base, self.retry_max)
+                logger.warning("Lark %s failed (%s); retry %d in %.1fs", endpoint, e, attempt + 1, delay)
+            else:
+                if body.get("code") in INVALID_TOKEN_CODES and not refreshed:
+                    logger.info("Lark tenant token rejected (code=%s); refreshing", body.get("code"))
+                    token = self.token(stale=token)
+                    refreshed = True
+                    continue
+                retry = retry_delay(response, body, attempt, self.retry_base, self.retry_max)
+                if retry is None or attempt >= self.max_retries:
+                    return _data(body)
+                delay, throttled = retry
+                if throttled:
+                    self.limiter.pause(endpoint, delay)
+                logger.warning(
+                    "Lark %s: HTTP %s code=%s; retry %d in %.1fs",
+                    endpoint, response.status_code, body.get("code"), attempt + 1, delay,
+                )
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def _send(
+        self, method: str, path: str, token: str, json: dict | None, params: dict | None
+    ) -> tuple[httpx.Response, dict]:
+        return self._timed(method, path, json=json, params=params, headers={"Authorization": f"Bearer {token}"})
+
+    def stats(self) -> dict:
+        return {"token_fetches": self._token.fetches, "retries": self.retries}
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class AsyncLarkHTTP:
+    """LarkHTTP for the event loop: the same token caching (refreshed in a task) over an httpx.AsyncClient."""
+
+    def __init__(
+        self,
+        base_url: str,
+        app_id: str,
+        app_secret: str,
+        *,
+        max_connections: int = 100,
+        max_keepalive: int | None = None,
+        keepalive_expiry: float = 120.0,
+        timeout: float = 10.0,
+        refresh_margin: float = 1500.0,
+        latency: LatencyRegistry | None = None,
+        limiter: RateLimiter | None = None,
+        max_retries: int = 4,
+        retry_base: float = 0.5,
+        retry_max: float = 30.0,
+        transport: httpx.AsyncBaseTransport | None = None,
+        verify: Any = True,
+    ) -> None:
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.latency = latency or LatencyRegistry()
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max(0, max_retries)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retries = 0
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=_limits(max_connections, max_keepalive, keepalive_expiry),
+            transport=transport,
+            verify=verify,
+        )
+        self._token = _TokenState(refresh_margin)
+        self._token_lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    async def _timed(self, method: str, path: str, **kwargs: Any) -> tuple[httpx.Response, dict]:
+        start = time.perf_counter()
+        error = True
+        try:
+            response = await self._client.request(method, path, **kwargs)
+            body = _json(response)
+            error = body.get("code", 0) != 0
+            return response, body
+        finally:
+            self.latency.observe(endpoint_name(method, path), time.perf_counter() - start, error)
+
+    async def _request_token(self) -> dict:
+        _, body = await self._timed("POST", TOKEN_PATH, json={"app_id": self.app_id, "app_secret": self.app_secret})
+        return body
+
+    async def _background_refresh(self) -> None:
+        try:
+            self._token.set(await self._request_token())
+        except Exception as e:
+            logger.warning("Lark tenant token refresh failed (will retry): %s", e)
+        finally:
+            self._token.refreshing = False
+
+    async def token(self, *, stale: str | None = None) -> str:
+        """Current tenant token; waits for a fetch only when there is none, it expired, or it equals `stale`."""
+        if self._token.usable(stale):
+            if self._token.due():
+                self._token.refreshing = True
+                self._refresh_task = asyncio.create_task(self._background_refresh())
+            return self._token.token
+        async with self._token_lock:
+            if not self._token.usable(stale):
+                self._token.set(await self._request_token())
+            return self._token.token
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: dict | None = None,
+        params: dict | None = None,
+        priority: int = PRIORITY_LIVE,
+    ) -> dict:
+        """LarkHTTP.request on the event loop (same rate limiting and retries)."""
+        endpoint = endpoint_name(method, path)
+        token = await self.token()
+        refreshed = False
+        attempt = 0
+        while True:
+            await self.limiter.aacquire(endpoint, priority)
+            try:
+                response, body = await self._send(method, path, token, json, params)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff(attempt, self.retry_base, self.retry_max)
+                logger.warning("Lark %s failed (%s); retry %d in %.1fs", endpoint, e, attempt + 1, delay)
+            else:
+                if body.get("code") in INVALID_TOKEN_CODES and not refreshed:
+                    logger.info("Lark tenant token rejected (code=%s); refreshing", body.get("code"))
+                    token = await self.token(stale=token)
+                    refreshed = True
+                    continue
+                retry = retry_delay(response, body, attempt, self.retry_base, self.retry_max)
+                if retry is None or attempt >= self.max_retries:
+                    return _data(body)
+                delay, throttled = retry
+                if throttled:
+                    self.limiter.pause(endpoint, delay)
+                logger.warning(
+                    "Lark %s: HTTP %s code=%s; retry %d in %.1fs",
+                    endpoint, response.status_code, body.get("code"), attempt + 1, delay,
+                )
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def _send(
+        self, method: str, path: str, token: str, json: dict | None, params: dict | None
+    ) -> tuple[httpx.Response, dict]:
+        return await self._timed(
+            method, path, json=json, params=params, headers={"Authorization": f"Bearer {token}"}
+        )
+
+    def stats(self) -> dict:
+        return {"token_fetches": self._token.fetches, "retries": self.retries}
+
+    async def aclose(self) -> None:
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        await self._client.aclose()
@@ -1,18 +1,93 @@
 """FastAPI app: Lark webhook endpoint (URL verification + message receive)."""
+import asyncio
 import json
 import logging
 import re
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
 
-from fastapi import BackgroundTasks, FastAPI, Request, Response
+from fastapi import FastAPI, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 
-from . import pipeline
-from .config import LARK_BOT_OPEN_ID
+from . import embeddings, lark_client, pipeline, store
+from .config import (
+    ASYNC_PIPELINE,
+    LARK_BOT_OPEN_ID,
+    REPLY_COALESCE_MAX_ROOTS,
+    REPLY_COALESCE_WINDOW_MS,
+    RERANK_ENABLED,
+    WARMUP_ON_STARTUP,
+    WEBHOOK_DEDUPE_BACKEND,
+    WEBHOOK_DEDUPE_MAX_EVENTS,
+    WEBHOOK_DEDUPE_PATH,
+    WEBHOOK_DEDUPE_WINDOW_SECONDS,
+    WORK_QUEUE_DEFER_SECONDS,
+    WORK_QUEUE_INDEX_SHARE,
+    WORK_QUEUE_MAX_DEFERRALS,
+    WORK_QUEUE_MAX_SIZE,
+    WORK_QUEUE_WORKERS,
+)
+from .dedupe import create_deduper, dedupe_keys
+from .reply_coalescer import ReplyCoalescer
+from .work_queue import PRIORITY_ANSWER, PRIORITY_INDEX, WorkQueue, WorkShed
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Answered-Once Bot", version="0.1.0")
+# Lark redelivers events when we are slow; duplicates are dropped before any work is scheduled.
+_deduper = create_deduper(
+    WEBHOOK_DEDUPE_BACKEND, WEBHOOK_DEDUPE_WINDOW_SECONDS, WEBHOOK_DEDUPE_MAX_EVENTS, WEBHOOK_DEDUPE_PATH
+)
+
+# Answers and reply indexing share a bounded worker pool; answers run first.
+_work_queue = WorkQueue(
+    WORK_QUEUE_WORKERS, WORK_QUEUE_MAX_SIZE, low_priority_share=WORK_QUEUE_INDEX_SHARE, name="webhook"
+)
+
+# Readiness: set once startup warmup has loaded the model, vector store and Lark client.
+_readiness: dict[str, object] = {"ready": False, "error": None, "warmup_seconds": None}
+
+
+def _warmup() -> None:
+    """Preload embedding model, vector store and Lark client; run a dummy encode and query."""
+    start = time.monotonic()
+    try:
+        vec = embeddings.warmup()
+        store.warmup(vec)
+        lark_client.warmup()
+        if RERANK_ENABLED:
+            from . import reranker
+            reranker.warmup()
+    except Exception as e:
+        logger.exception("Warmup failed: %s", e)
+        _readiness["error"] = str(e)
+        return
+    _readiness["warmup_seconds"] = round(time.monotonic() - start, 3)
+    _readiness["error"] = None
+    _readiness["ready"] = True
+    logger.info("Warmup done in %.1fs; instance is ready", _readiness["warmup_seconds"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up in the background so /health answers immediately while /ready waits for warmup."""
+    task = None
+    if WARMUP_ON_STARTUP:
+        task = asyncio.create_task(run_in_threadpool(_warmup))
+    else:
+        _readiness["ready"] = True
+    yield
+    if task is not None and not task.done():
+        task.cancel()
+    await _drain_async_answers(10.0)
+    await run_in_threadpool(_reply_coalescer.drain, 10.0)
+    await run_in_threadpool(_work_queue.drain, 10.0)
+    await lark_client.aclose()
+
+
+app = FastAPI(title="Answered-Once Bot", version="0.1.0", lifespan=lifespan)
 
 # Lark @mention in text: <at user_id="ou_xxx">name</at> or @_user_1 placeholder
 _AT_TAG_RE = re.compile(r"<at[^>]*>.*?</at>", re.IGNORECASE | re.DOTALL)
@@ -52,7 +127,7 @@ def _parse_message_content(content: str) -> str:
         return ""
 
 
-async def _handle_lark_webhook(request: Request, background_tasks: BackgroundTasks) -> Response:
+async def _handle_lark_webhook(request: Request) -> Response:
     """Handle Lark event subscription callback: URL verification and message events."""
     try:
         body = await request.json()
@@ -64,10 +139,12 @@ async def _handle_lark_webhook(request: Request, background_tasks: BackgroundTas
     # Lark v2: schema + header + event; event type in header.event_type
     if body.get("schema") == "2.0" and "header" in body and "event" in body:
         event_type = (body.get("header") or {}).get("event_type")
+        event_id = (body.get("header") or {}).get("event_id")
         event = body.get("event", {})
     else:
         event = body.get("event", {})
         event_type = event.get("type")
+        event_id = body.get("uuid")
 
     # URL verification
     if body_type == "url_verification" or (body.get("challenge") is not None and not body_type):
@@ -111,23 +188,33 @@ async def _handle_lark_webhook(request: Request, background_tasks: BackgroundTas
     if isinstance(parent_id, dict):
         parent_id = parent_id.get("message_id") or parent_id.get("open_message_id") or ""
 
+    keys = dedupe_keys(event_id, message_id)
+    if _deduper.is_duplicate(keys):
+        logger.info("Lark webhook: skip (duplicate delivery) event_id=%s message_id=%s", event_id, message_id)
+        return JSONResponse(content={}, status_code=200)
+
     logger.info(
         "Lark message: chat_id=%s message_id=%s root_id=%s parent_id=%s text=%r",
         chat_id, message_id, root_id or None, parent_id or None, (message_text[:60] + "..." if len(message_text) > 60 else message_text),
     )
 
     if root_id or parent_id:
-        # Reply in a thread: try to record this Q&A (root question + this reply) into the store
+        # Reply in a thread: queue it per root; a burst is recorded with one root fetch and one write
         logger.info("Lark: reply in thread -> index_reply")
-        background_tasks.add_task(
-            _run_index_reply,
-            chat_id=chat_id,
-            root_id=root_id or parent_id,
-            reply_message_id=message_id,
-            reply_content=content,
-            reply_sender_id=sender_id,
-            reply_create_time=create_time,
+        accepted = _reply_coalescer.submit(
+            chat_id,
+            root_id or parent_id,
+            {
+                "reply_message_id": message_id,
+                "reply_content": content,
+                "reply_sender_id": sender_id,
+                "reply_create_time": create_time,
+            },
         )
+        if not accepted:
+            # Too many threads waiting: fail the delivery so Lark sends the reply again later
+            _deduper.forget(keys)
+            return JSONResponse(content={}, status_code=503)
         return JSONResponse(content={}, status_code=200)
 
     # Root-level message: answer only when the bot is @mentioned
@@ -148,13 +235,16 @@ async def _handle_lark_webhook(request: Request, background_tasks: BackgroundTas
                 "LARK_BOT_OPEN_ID not set. From this @mention, candidate open_ids: %s — set one in .env to only answer when @mentioned.",
                 open_ids,
             )
-    background_tasks.add_task(
-        _run_pipeline,
-        chat_id=chat_id,
-        message_id=message_id,
-        message_text=message_text,
-        sender_id=sender_id,
-    )
+    kwargs = {"chat_id": chat_id, "message_id": message_id, "message_text": message_text, "sender_id": sender_id}
+    if ASYNC_PIPELINE:
+        accepted = _start_async_answer(kwargs)
+    else:
+        accepted = _work_queue.submit(PRIORITY_ANSWER, _run_pipeline, **kwargs) is not None
+    if not accepted:
+        logger.warning("Lark: answer queue full, refusing question message_id=%s", message_id)
+        # Fail the delivery so Lark sends the event again later
+        _deduper.forget(keys)
+        return JSONResponse(content={}, status_code=503)
     return JSONResponse(content={}, status_code=200)
 
 
@@ -175,37 +265,94 @@ def _run_pipeline(
         logger.exception("Pipeline error: %s", e)
 
 
-def _run_index_reply(
+async def _run_pipeline_async(
     chat_id: str,
-    root_id: str,
-    reply_message_id: str,
-    reply_content: str,
-    reply_sender_id: str,
-    reply_create_time: str,
+    message_id: str,
+    message_text: str,
+    sender_id: str,
 ) -> None:
+    from . import async_pipeline
+
     try:
-        pipeline.index_reply(
+        await async_pipeline.handle_message(
             chat_id=chat_id,
-            root_id=root_id,
-            reply_message_id=reply_message_id,
-            reply_content=reply_content,
-            reply_sender_id=reply_sender_id,
-            reply_create_time=reply_create_time,
+            message_id=message_id,
+            message_text=message_text,
+            sender_id=sender_id,
         )
+    except Exception as e:
+        logger.exception("Pipeline error: %s", e)
+
+
+# ASYNC_PIPELINE answers run as tasks on the event loop, not on work queue threads; at most
+# WORK_QUEUE_MAX_SIZE are in flight. Tasks are kept here so shutdown can wait for them.
+_async_answers: set[asyncio.Task] = set()
+_async_counts = {"submitted": 0, "completed": 0, "rejected": 0}
+
+
+def _start_async_answer(kwargs: dict[str, str]) -> bool:
+    """Start an answer task on the running loop; False when WORK_QUEUE_MAX_SIZE answers are already in flight."""
+    if len(_async_answers) >= WORK_QUEUE_MAX_SIZE:
+        _async_counts["rejected"] += 1
+        return False
+    task = asyncio.get_running_loop().create_task(_run_pipeline_async(**kwargs))
+    _async_answers.add(task)
+    _async_counts["submitted"] += 1
+    task.add_done_callback(_async_answer_done)
+    return True
+
+
+def _async_answer_done(task: asyncio.Task) -> None:
+    _async_answers.discard(task)
+    _async_counts["completed"] += 1
+
+
+async def _drain_async_answers(timeout: float) -> None:
+    if _async_answers:
+        await asyncio.wait(set(_async_answers), timeout=timeout)
+
+
+def _run_index_replies(chat_id: str, root_id: str, replies: list[dict]) -> None:
+    try:
+        pipeline.index_replies(chat_id=chat_id, root_id=root_id, replies=replies)
     except Exception as e:
         logger.exception("Index reply error: %s", e)
 
 
+def _index_replies_queued(chat_id: str, root_id: str, replies: list[dict]) -> Future:
+    """Coalescer handler: index the batch on the work queue; the root stays busy until its future resolves.
+
+    A batch the queue refuses or sheds fails with WorkShed, so the coalescer retries it after
+    WORK_QUEUE_DEFER_SECONDS (merged with newer replies) and drops it after WORK_QUEUE_MAX_DEFERRALS tries.
+    """
+    future = _work_queue.submit(PRIORITY_INDEX, _run_index_replies, chat_id, root_id, replies)
+    if future is None:
+        future = Future()
+        future.set_exception(WorkShed("work queue full"))
+    return future
+
+
+# Replies are serialized per root_id and coalesced over REPLY_COALESCE_WINDOW_MS.
+_reply_coalescer = ReplyCoalescer(
+    _index_replies_queued,
+    REPLY_COALESCE_WINDOW_MS / 1000.0,
+    max_pending_roots=REPLY_COALESCE_MAX_ROOTS,
+    retry_on=(WorkShed,),
+    retry_delay=WORK_QUEUE_DEFER_SECONDS,
+    max_retries=WORK_QUEUE_MAX_DEFERRALS,
+)
+
+
 @app.post("/webhook/lark")
-async def lark_webhook(request: Request, background_tasks: BackgroundTasks) -> Response:
+async def lark_webhook(request: Request) -> Response:
     """Lark webhook endpoint at /webhook/lark."""
-    return await _handle_lark_webhook(request, background_tasks)
+    return await _handle_lark_webhook(request)
 
 
 @app.post("/")
-async def lark_webhook_root(request: Request, background_tasks: BackgroundTasks) -> Response:
+async def lark_webhook_root(request: Request) -> Response:
     """Lark webhook endpoint at root (/) - supports both paths."""
-    return await _handle_lark_webhook(request, background_tasks)
+    return await _handle_lark_webhook(request)
 
 
 @app.get("/")
@@ -217,3 +364,26 @@ async def root() -> Response:
 @app.get("/health")
 async def health() -> dict[str, str]:
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def metrics() -> dict:
+    """Work queue depth, wait times and shed counts (sync answers, reply indexing); async answers in flight;
+    threads with replies waiting to be indexed, and shed/retried/dropped reply batches; Lark latency histograms."""
+    return {
+        "work_queue": _work_queue.stats(),
+        "async_answers": {"in_flight": len(_async_answers), "max_in_flight": WORK_QUEUE_MAX_SIZE, **_async_counts},
+        "reply_coalescer": _reply_coalescer.stats(),
+        "lark": lark_client.metrics(),
+    }
+
+
+@app.get("/ready")
+async def ready() -> Response:
+    """Readiness probe: 200 once warmup finished, 503 while warming up or after a failed warmup."""
+    if _readiness["ready"]:
+        return JSONResponse(content={"status": "ready", "warmup_seconds": _readiness["warmup_seconds"]})
+    body = {"status": "warming_up"}
+    if _readiness["error"]:
+        body = {"status": "error", "error": _readiness["error"]}
+    return JSONResponse(content=body, status_code=503)
@@ -0,0 +1,414 @@
+"""In-process NumPy vector index: brute-force cosine search over one contiguous float32 matrix.
+
+A store.VectorStore used for STORE_BACKEND=numpy (persisted as a <path>.npy + <path>.json snapshot
+plus a <path>.log journal of later writes) and STORE_BACKEND=memory (no path, nothing persisted).
+"""
+import base64
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: no cross-process lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyVectorStore:
+    """Rows of unit-length float32 vectors with parallel id/document/metadata arrays.
+
+    Scores are dot products (= cosine for normalized embeddings, same scale as store._dist_to_score).
+    Each row carries an integer chat code so a chat's rows are selected with one vectorized mask.
+    Deletes swap the last row into the freed slot, so rows stay contiguous.
+
+    Writes append to the journal (O(rows written)); the snapshot is rewritten only once the journal
+    outgrows the index. Several processes (server and backfill) may share one path: writes and
+    compaction take a file lock, and each process replays the others' journal entries before its
+    next read or write.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = Path(path) if path is not None else None
+        self._lock = threading.RLock()
+        self._reset()
+        if self.path is not None:
+            with self._lock, self._file_lock():
+                self._sync()
+            if self._n:
+                logger.info("Loaded numpy index %s (%d rows)", self.path, self._n)
+
+    def _reset(self) -> None:
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._chat_codes = np.zeros(0, dtype=np.int32)
+        self._n = 0
+        self._ids: list[str] = []
+        self._documents: list[str] = []
+        self._metadatas: list[dict] = []
+        self._chat_code_of: dict[str, int] = {}
+        self._row_of: dict[str, int] = {}
+        self._ids_by_root: dict[str, set[str]] = {}
+        self._snapshot = None  # (inode, mtime, size) of the sidecar this state was loaded from
+        self._journal_pos = 0
+        self._journal_entries = 0
+
+    # --- persistence -------------------------------------------------------
+
+    def _files(self) -> tuple[Path, Path]:
+        assert self.path is not None
+        return self.path.with_suffix(".npy"), self.path.with_suffix(".json")
+
+    def _journal(self) -> Path:
+        assert self.path is not None
+        return self.path.with_suffix(".log")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on <path>.lock, shared by every process using this index. Not reentrant."""
+        if self.path is None or fcntl is None:
+            yield
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _disk_state(self) -> tuple[tuple | None, int]:
+        try:
+            st = self._files()[1].stat()
+            snapshot = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            snapshot = None
+        try:
+            journal_size = self._journal().stat().st_size
+        except FileNotFoundError:
+            journal_size = 0
+        return snapshot, journal_size
+
+    def _refresh(self) -> None:
+        """Pick up writes of other processes (two stat calls when there are none)."""
+        if self.path is None:
+            return
+        snapshot, journal_size = self._disk_state()
+        if snapshot != self._snapshot or journal_size != self._journal_pos:
+            with self._file_lock():
+                self._sync()
+
+    def _sync(self) -> None:
+        """Catch up with the files on disk; caller holds the file lock."""
+        snapshot, journal_size = self._disk_state()
+        if snapshot != self._snapshot or journal_size < self._journal_pos:
+            self._reset()
+            self._load_snapshot()
+            self._snapshot = snapshot
+        if journal_size > self._journal_pos:
+            self._replay_journal()
+
+    def _load_snapshot(self) -> None:
+        vec_file, meta_file = self._files()
+        if not vec_file.exists() or not meta_file.exists():
+            return
+        vectors = np.load(vec_file)
+        with open(meta_file, encoding="utf-8") as f:
+            side = json.load(f)
+        if len(side["ids"]) != len(vectors):
+            logger.error("Numpy index %s: sidecar has %d rows, matrix %d; ignoring", self.path, len(side["ids"]), len(vectors))
+            return
+        self._vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._n = len(vectors)
+        self._ids = list(side["ids"])
+        self._documents = list(side["documents"])
+        self._metadatas = list(side["metadatas"])
+        self._chat_codes = np.array([self._chat_code(m.get("chat_id", "")) for m in self._metadatas], dtype=np.int32)
+        for row, (id_, meta) in enumerate(zip(self._ids, self._metadatas)):
+            self._index_row(row, id_, meta)
+
+    def _replay_journal(self) -> None:
+        with open(self._journal(), "rb") as f:
+            f.seek(self._journal_pos)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a line still being written by another process is read next time
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Numpy index journal %s: skipping unreadable line", self._journal())
+                continue
+            self._journal_entries += 1
+            op = entry.get("op")
+            if op == "put":
+                vec = np.frombuffer(base64.b64decode(entry["vec"]), dtype=np.float32)
+                self._upsert([entry["id"]], vec[None, :], [entry["doc"]], [entry["meta"]])
+            elif op == "meta":
+                self._update_metadata([entry["id"]], [entry["meta"]])
+            elif op == "del":
+                self._delete_root(entry["root"])
+        self._journal_pos += end
+
+    def _append(self, entries: list[dict]) -> None:
+        """Journal entries already applied in memory; caller holds the file lock and has synced."""
+        if self.path is None or not entries:
+            return
+        data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8")
+        with open(self._journal(), "ab") as f:
+            f.write(data)
+        self._journal_pos += len(data)
+        self._journal_entries += len(entries)
+        if self._journal_entries > self._n + 1000:
+            self._write_snapshot()
+
+    @staticmethod
+    def _put_entries(ids: list[str], mat: np.ndarray, documents: list[str], metadatas: list[dict]) -> list[dict]:
+        return [
+            {"op": "put", "id": id_, "vec": base64.b64encode(mat[i].tobytes()).decode("ascii"), "doc": doc, "meta": meta}
+            for i, (id_, doc, meta) in enumerate(zip(ids, documents, metadatas))
+        ]
+
+    def save(self) -> None:
+        """Rewrite the snapshot from the current rows and empty the journal (no-op for an in-memory index)."""
+        if self.path is None:
+            return
+        with self._lock, self._file_lock():
+            self._sync()
+            self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        vec_file, meta_file = self._files()
+        vec_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_vec = vec_file.with_suffix(".npy.tmp")
+        with open(tmp_vec, "wb") as f:
+            np.save(f, self._vectors[: self._n])
+        tmp_meta = meta_file.with_suffix(".json.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}, f)
+        os.replace(tmp_vec, vec_file)
+        os.replace(tmp_meta, meta_file)
+        # Readers compare the sidecar stamp first, so a stale journal is never replayed onto the new snapshot
+        open(self._journal(), "wb").close()
+        self._snapshot, self._journal_pos = self._disk_state()
+        self._journal_entries = 0
+
+    # --- writes --------------------------------------------------------------
+
+    def _chat_code(self, chat_id: str) -> int:
+        code = self._chat_code_of.get(chat_id)
+        if code is None:
+            code = len(self._chat_code_of)
+            self._chat_code_of[chat_id] = code
+        return code
+
+    def _reserve(self, extra: int, dim: int) -> None:
+        if self._vectors.shape[1] not in (0, dim):
+            raise ValueError(f"Embedding dim {dim} does not match index dim {self._vectors.shape[1]}")
+        needed = self._n + extra
+        if needed <= len(self._vectors) and self._vectors.shape[1] == dim:
+            return
+        capacity = max(needed, 2 * len(self._vectors), 64)
+        grown = np.zeros((capacity, dim), dtype=np.float32)
+        if self._n:
+            grown[: self._n] = self._vectors[: self._n]
+        self._vectors = grown
+        codes = np.full(capacity, -1, dtype=np.int32)
+        codes[: self._n] = self._chat_codes[: self._n]
+        self._chat_codes = codes
+
+    def _index_row(self, row: int, id_: str, meta: dict) -> None:
+        self._row_of[id_] = row
+        self._ids_by_root.setdefault(meta.get("root_message_id", ""), set()).add(id_)
+
+    def _unindex_id(self, id_: str, meta: dict) -> None:
+        self._row_of.pop(id_, None)
+        root = meta.get("root_message_id", "")
+        ids = self._ids_by_root.get(root)
+        if ids is not None:
+            ids.discard(id_)
+            if not ids:
+                del self._ids_by_root[root]
+
+    def add(self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]) -> None:
+        if not ids:
+            return
+        mat = np.asarray(embeddings, dtype=np.float32)
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            self._add(ids, mat, documents, metadatas)
+            self._append(self._put_entries(ids, mat, documents, metadatas))
+
+    def upsert(self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]) -> None:
+        """Replace rows with these ids in place; append the ones that do not exist yet."""
+        if not ids:
+            return
+        mat = np.asarray(embeddings, dtype=np.float32)
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            self._upsert(ids, mat, documents, metadatas)
+            self._append(self._put_entries(ids, mat, documents, metadatas))
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict]) -> None:
+        """Replace metadata of existing rows, keeping their vectors and documents."""
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            self._update_metadata(ids, metadatas)
+            self._append([{"op": "meta", "id": id_, "meta": meta} for id_, meta in zip(ids, metadatas) if id_ in self._row_of])
+
+    def delete_by_root(self, root_message_id: str) -> int:
+        """Delete rows of this thread root; returns rows removed."""
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            removed = self._delete_root(root_message_id)
+            if removed:
+                self._append([{"op": "del", "root": root_message_id}])
+            return removed
+
+    def _refresh_locked(self) -> None:
+        if self.path is not None:
+            self._sync()
+
+    def _add(self, ids: list[str], mat: np.ndarray, documents: list[str], metadatas: list[dict]) -> None:
+        self._reserve(len(ids), mat.shape[1])
+        self._vectors[self._n : self._n + len(ids)] = mat
+        for i, (id_, meta) in enumerate(zip(ids, metadatas)):
+            self._chat_codes[self._n + i] = self._chat_code(meta.get("chat_id", ""))
+            self._index_row(self._n + i, id_, meta)
+        self._n += len(ids)
+        self._ids.extend(ids)
+        self._documents.extend(documents)
+        self._metadatas.extend(dict(m) for m in metadatas)
+
+    def _upsert(self, ids: list[str], mat: np.ndarray, documents: list[str], metadatas: list[dict]) -> None:
+        new = [i for i, id_ in enumerate(ids) if id_ not in self._row_of]
+        for i, id_ in enumerate(ids):
+            row = self._row_of.get(id_)
+            if row is None:
+                continue
+            self._vectors[row] = mat[i]
+            self._set_row_metadata(row, metadatas[i])
+            self._documents[row] = documents[i]
+        if new:
+            self._add([ids[i] for i in new], mat[new], [documents[i] for i in new], [metadatas[i] for i in new])
+
+    def _update_metadata(self, ids: list[str], metadatas: list[dict]) -> None:
+        for id_, meta in zip(ids, metadatas):
+            row = self._row_of.get(id_)
+            if row is not None:
+                self._set_row_metadata(row, meta)
+
+    def _set_row_metadata(self, row: int, meta: dict) -> None:
+        id_ = self._ids[row]
+        self._unindex_id(id_, self._metadatas[row])
+        self._metadatas[row] = dict(meta)
+        self._chat_codes[row] = self._chat_code(meta.get("chat_id", ""))
+        self._index_row(row, id_, meta)
+
+    def _delete_root(self, root_message_id: str) -> int:
+        ids = list(self._ids_by_root.get(root_message_id, ()))
+        rows = sorted((self._row_of[id_] for id_ in ids), reverse=True)
+        for row in rows:
+            self._unindex_id(self._ids[row], self._metadatas[row])
+            last = self._n - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self._chat_codes[row] = self._chat_codes[last]
+                self._ids[row] = self._ids[last]
+                self._documents[row] = self._documents[last]
+                self._metadatas[row] = self._metadatas[last]
+                self._row_of[self._ids[row]] = row
+            self._chat_codes[last] = -1
+            self._ids.pop()
+            self._documents.pop()
+            self._metadatas.pop()
+            self._n -= 1
+        return len(rows)
+
+    # --- reads ---------------------------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._n
+
+    def rows(self):
+        """Snapshot of every (id, document, metadata) row."""
+        with self._lock:
+            self._refresh()
+            return list(zip(self._ids[: self._n], self._documents[: self._n], [dict(m) for m in self._metadatas[: self._n]]))
+
+    def nbytes(self) -> int:
+        """Approximate resident size: the vector matrix plus documents and metadata."""
+        with self._lock:
+            text = sum(len(d) for d in self._documents) + sum(len(str(m)) for m in self._metadatas)
+            return int(self._vectors.nbytes) + 2 * text
+
+    def get_by_root(self, root_message_id: str) -> tuple[str, str, dict] | None:
+        """(id, document, metadata) of one row of this thread root, or None."""
+        with self._lock:
+            self._refresh()
+            ids = self._ids_by_root.get(root_message_id)
+            if not ids:
+                return None
+            id_ = min(ids)
+            row = self._row_of[id_]
+            return id_, self._documents[row], dict(self._metadatas[row])
+
+    def get_by_roots(self, root_message_ids: list[str]) -> dict[str, tuple[str, str, dict]]:
+        """get_by_root for each root, under one lock; roots without rows are left out."""
+        with self._lock:
+            self._refresh()
+            found = {}
+            for root in root_message_ids:
+                ids = self._ids_by_root.get(root)
+                if ids:
+                    id_ = min(ids)
+                    row = self._row_of[id_]
+                    found[root] = (id_, self._documents[row], dict(self._metadatas[row]))
+            return found
+
+    def query(self, query_embedding: list[float], top_k: int, chat_id: str | None = None) -> list[tuple[str, dict, float]]:
+        """Top-k (document, metadata, score) rows, best first; restricted to chat_id rows when given."""
+        with self._lock:
+            self._refresh()
+            if self._n == 0 or top_k <= 0:
+                return []
+            rows = None
+            if chat_id is not None:
+                rows = self._chat_rows(chat_id)
+                if rows is None:
+                    return []
+            return self._top_k(np.asarray(query_embedding, dtype=np.float32), rows, top_k)
+
+    def search(self, query_embedding: list[float], top_k: int, chat_id: str | None = None) -> list[tuple[str, dict, float]]:
+        """Chat's rows if it has any, else all rows; the mask is resolved first so there is one matrix product."""
+        with self._lock:
+            self._refresh()
+            if self._n == 0 or top_k <= 0:
+                return []
+            rows = self._chat_rows(chat_id) if chat_id is not None else None
+            return self._top_k(np.asarray(query_embedding, dtype=np.float32), rows, top_k)
+
+    def _chat_rows(self, chat_id: str) -> np.ndarray | None:
+        """Row indices of chat_id, or None when the chat has no rows."""
+        code = self._chat_code_of.get(chat_id)
+        if code is None:
+            return None
+        rows = np.flatnonzero(self._chat_codes[: self._n] == code)
+        return rows if len(rows) else None
+
+    def _top_k(self, q: np.ndarray, rows: np.ndarray | None, top_k: int) -> list[tuple[str, dict, float]]:
+        scores = (self._vectors[rows] if rows is not None else self._vectors[: self._n]) @ q
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        out = []
+        for i in top:
+            row = int(rows[i]) if rows is not None else int(i)
+            out.append((self._documents[row], dict(self._metadatas[row]), float(scores[i])))
+        return out
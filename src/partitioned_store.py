@@ -0,0 +1,281 @@
+"""Per-chat partitioned VectorStore: one index per chat, loaded lazily and evicted under a memory budget."""
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+from .cache import LRUCache
+from .store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Rough per-row footprint for engines that cannot report their own (384-dim float32 + metadata).
+_DEFAULT_ROW_BYTES = 4096
+
+
+def partition_name(chat_id: str) -> str:
+    """Filesystem/collection-safe name for a chat's partition."""
+    return "chat_" + hashlib.sha1(chat_id.encode("utf-8")).hexdigest()[:20]
+
+
+def _approx_bytes(vs: VectorStore) -> int:
+    nbytes = getattr(vs, "nbytes", None)
+    if callable(nbytes):
+        return nbytes()
+    return vs.count() * _DEFAULT_ROW_BYTES
+
+
+class PartitionedVectorStore:
+    """VectorStore that routes each row to its chat's partition (plus an optional global index).
+
+    - Partitions are created by factory(partition_name(chat_id)) on first use and kept in an LRU;
+      when their estimated size exceeds memory_budget_bytes the least recently used ones are dropped
+      (they reload from disk on the next question in that chat). None disables eviction. Dropping a
+      partition only frees memory when the partition owns its data (numpy); Chroma partitions share
+      one client whose caches keep them resident, so store.create_partitioned_store never evicts them.
+    - A small SQLite table maps root_message_id -> chat_id so root lookups know the partition, and
+      doubles as the per-chat row count for search(). Counts are cached for count_ttl seconds and dropped
+      on this process's writes; chats written by another process (e.g. backfill) show up once they expire.
+    - search() scopes to the chat's partition; chats without records fall back to the global index
+      when one is configured, otherwise return no candidates.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], VectorStore],
+        *,
+        root_map_path: Path | str,
+        global_index: VectorStore | None = None,
+        memory_budget_bytes: int | None = None,
+        count_ttl: float = 10.0,
+    ) -> None:
+        self._factory = factory
+        self.global_index = global_index
+        self._budget = memory_budget_bytes
+        self._lock = threading.RLock()
+        self._partitions: OrderedDict[str, VectorStore] = OrderedDict()
+        if str(root_map_path) != ":memory:":
+            Path(root_map_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(root_map_path), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS roots (root_message_id TEXT PRIMARY KEY, chat_id TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS roots_chat ON roots(chat_id)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+        self._db.commit()
+        self._count_cache = LRUCache(10000, ttl_seconds=count_ttl)
+
+    # --- partitions ---------------------------------------------------------
+
+    def partition(self, chat_id: str) -> VectorStore:
+        """The chat's partition, loading it (and evicting cold ones) if needed."""
+        with self._lock:
+            vs = self._partitions.get(chat_id)
+            if vs is not None:
+                self._partitions.move_to_end(chat_id)
+                return vs
+            vs = self._factory(partition_name(chat_id))
+            self._partitions[chat_id] = vs
+            self._evict(keep=chat_id)
+            return vs
+
+    def _evict(self, keep: str) -> None:
+        if self._budget is None:
+            return
+        sizes = {chat: _approx_bytes(vs) for chat, vs in self._partitions.items()}
+        total = sum(sizes.values())
+        for chat in list(self._partitions):
+            if total <= self._budget:
+                break
+            if chat == keep:
+                continue
+            del self._partitions[chat]
+            total -= sizes[chat]
+            logger.info("Evicted partition for chat_id=%s (~%d bytes)", chat, sizes[chat])
+
+    def loaded_chats(self) -> list[str]:
+        with self._lock:
+            return list(self._partitions)
+
+    def _chat_of_root(self, root_message_id: str) -> str | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT chat_id FROM roots WHERE root_message_id = ?", (root_message_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _chat_count(self, chat_id: str | None) -> int:
+        """Rows of chat_id (all rows for None), from the roots table."""
+        n = self._count_cache.get(chat_id)
+        if n is None:
+            with self._lock:
+                if chat_id is None:
+                    n = self._db.execute("SELECT COUNT(*) FROM roots").fetchone()[0]
+                else:
+                    n = self._db.execute("SELECT COUNT(*) FROM roots WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+            self._count_cache.put(chat_id, n)
+        return n
+
+    def _record_roots(self, metadatas: list[dict]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO roots (root_message_id, chat_id) VALUES (?, ?)",
+                [(meta.get("root_message_id", ""), meta.get("chat_id", "")) for meta in metadatas],
+            )
+            self._db.commit()
+        # A root may have moved chats: drop every cached count
+        self._count_cache.clear()
+
+    @staticmethod
+    def _by_chat(ids: list[str], metadatas: list[dict]) -> dict[str, list[int]]:
+        groups: dict[str, list[int]] = {}
+        for i, meta in enumerate(metadatas):
+            groups.setdefault(meta.get("chat_id", ""), []).append(i)
+        return groups
+
+    # --- migration ------------------------------------------------------------
+
+    def needs_legacy_import(self) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM migrations WHERE name = 'legacy_rows'").fetchone() is None
+
+    def import_legacy_rows(
+        self, legacy: VectorStore, embed: Callable[[list[str]], list[list[float]]], batch_size: int = 256
+    ) -> int:
+        """Copy rows of the unpartitioned index into their chat partitions (once); returns rows copied.
+
+        Rows written before partitioning was turned on are otherwise unknown to the roots map. Their
+        questions are re-embedded with embed, since rows() does not return vectors.
+        """
+        if not self.needs_legacy_import():
+            return 0
+        copied = 0
+        batch: list[tuple[str, str, dict]] = []
+
+        def flush() -> None:
+            nonlocal copied
+            if not batch:
+                return
+            ids = [id_ for id_, _, _ in batch]
+            docs = [doc for _, doc, _ in batch]
+            metadatas = [meta for _, _, meta in batch]
+            vectors = embed(docs)
+            for chat, idx in self._by_chat(ids, metadatas).items():
+                self.partition(chat).upsert(
+                    [ids[i] for i in idx], [vectors[i] for i in idx], [docs[i] for i in idx], [metadatas[i] for i in idx]
+                )
+            self._record_roots(metadatas)
+            copied += len(batch)
+            batch.clear()
+
+        for id_, doc, meta in legacy.rows():
+            meta = meta or {}
+            if self._chat_of_root(meta.get("root_message_id", "")) is not None:
+                continue
+            batch.append((id_, doc or "", meta))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO migrations (name) VALUES ('legacy_rows')")
+            self._db.commit()
+        if copied:
+            logger.info("Copied %d row(s) of the unpartitioned index into chat partitions", copied)
+        return copied
+
+    # --- VectorStore ----------------------------------------------------------
+
+    def add(
+        self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None:
+        self._write("add", ids, embeddings, documents, metadatas)
+
+    def upsert(
+        self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None:
+        self._write("upsert", ids, embeddings, documents, metadatas)
+
+    def _write(
+        self, op: str, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None:
+        for chat, idx in self._by_chat(ids, metadatas).items():
+            getattr(self.partition(chat), op)(
+                [ids[i] for i in idx],
+                [embeddings[i] for i in idx],
+                [documents[i] for i in idx],
+                [metadatas[i] for i in idx],
+            )
+        if self.global_index is not None:
+            getattr(self.global_index, op)(ids, embeddings, documents, metadatas)
+        self._record_roots(metadatas)
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict]) -> None:
+        for chat, idx in self._by_chat(ids, metadatas).items():
+            self.partition(chat).update_metadata([ids[i] for i in idx], [metadatas[i] for i in idx])
+        if self.global_index is not None:
+            self.global_index.update_metadata(ids, metadatas)
+
+    def get_by_root(self, root_message_id: str) -> tuple[str, str, dict] | None:
+        chat = self._chat_of_root(root_message_id)
+        if chat is None:
+            return None
+        return self.partition(chat).get_by_root(root_message_id)
+
+    def get_by_roots(self, root_message_ids: list[str]) -> dict[str, tuple[str, str, dict]]:
+        by_chat: dict[str, list[str]] = {}
+        with self._lock:
+            for start in range(0, len(root_message_ids), 500):
+                chunk = list(root_message_ids[start:start + 500])
+                marks = ",".join("?" * len(chunk))
+                for root, chat in self._db.execute(
+                    f"SELECT root_message_id, chat_id FROM roots WHERE root_message_id IN ({marks})", chunk
+                ):
+                    by_chat.setdefault(chat, []).append(root)
+        found: dict[str, tuple[str, str, dict]] = {}
+        for chat, roots in by_chat.items():
+            found.update(self.partition(chat).get_by_roots(roots))
+        return found
+
+    def delete_by_root(self, root_message_id: str) -> None:
+        chat = self._chat_of_root(root_message_id)
+        if chat is None:
+            return
+        self.partition(chat).delete_by_root(root_message_id)
+        if self.global_index is not None:
+            self.global_index.delete_by_root(root_message_id)
+        with self._lock:
+            self._db.execute("DELETE FROM roots WHERE root_message_id = ?", (root_message_id,))
+            self._db.commit()
+        self._count_cache.pop(chat)
+        self._count_cache.pop(None)
+
+    def query(
+        self, query_embedding: list[float], top_k: int, chat_id: str | None = None
+    ) -> list[tuple[str, dict, float]]:
+        if chat_id is not None:
+            if not self._chat_count(chat_id):
+                return []
+            return self.partition(chat_id).query(query_embedding, top_k)
+        if self.global_index is None:
+            return []
+        return self.global_index.query(query_embedding, top_k)
+
+    def search(
+        self, query_embedding: list[float], top_k: int, chat_id: str | None = None
+    ) -> list[tuple[str, dict, float]]:
+        if chat_id is not None and self._chat_count(chat_id):
+            return self.partition(chat_id).search(query_embedding, top_k)
+        if self.global_index is None:
+            return []
+        return self.global_index.search(query_embedding, top_k)
+
+    def count(self) -> int:
+        return self._chat_count(None)
+
+    def rows(self):
+        """Every row, partition by partition (loads each chat's partition in turn)."""
+        with self._lock:
+            chats = [c for (c,) in self._db.execute("SELECT DISTINCT chat_id FROM roots").fetchall()]
+        for chat in chats:
+            yield from self.partition(chat).rows()
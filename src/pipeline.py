@@ -1,23 +1,61 @@
 """Pipeline: question check -> embed -> match -> format -> send; and index Q&A from replies."""
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from . import embeddings
 from . import store
+from .cache import LRUCache
 from . import formatter
 from . import lark_client
 from . import question_detector
+from . import summary_cache
+from .store import THREAD_REPLY_DELIMITER
+from .thread_summarizer import QuietThreadScheduler
 from .config import (
     ANSWER_MODE,
     ANSWERED_ONCE_CHAT_IDS,
     BEST_ANSWER_POLICY,
+    LLM_STREAM_MAX_EDITS,
+    LLM_STREAM_UPDATE_MS,
+    LLM_STREAMING,
+    RERANK_CANDIDATES,
+    RERANK_ENABLED,
+    RERANK_TOP_K,
+    ROOT_CACHE_SIZE,
+    ROOT_CACHE_TTL_SECONDS,
+    THREAD_SUMMARY_ENABLED,
+    THREAD_SUMMARY_MAX_CONCURRENCY,
+    THREAD_SUMMARY_MAX_PENDING,
+    THREAD_SUMMARY_MIN_CHARS,
+    THREAD_SUMMARY_QUIET_SECONDS,
     TOP_K_CANDIDATES,
 )
 
 logger = logging.getLogger(__name__)
 
 DONT_KNOW_REPLY = "I don't have an answer for this question yet."
+STREAM_PLACEHOLDER = "Looking through past discussions…"
+
+# root_id -> (question_text, is_question). Non-question roots are cached too, so replies in those
+# threads are dropped without a Lark call. Failed fetches are not cached.
+_root_cache = LRUCache(ROOT_CACHE_SIZE, ttl_seconds=ROOT_CACHE_TTL_SECONDS)
+
+
+def should_answer(chat_id: str, message_id: str, message_text: str) -> bool:
+    """True if a root message is a non-empty question in an enabled chat (logs why not otherwise)."""
+    if not message_text or not message_text.strip():
+        logger.info("handle_message: skip (empty text) message_id=%s", message_id)
+        return False
+    if not question_detector.is_question(message_text):
+        logger.info("handle_message: skip (not a question) message_id=%s text=%r", message_id, message_text[:50])
+        return False
+    if ANSWERED_ONCE_CHAT_IDS and chat_id not in ANSWERED_ONCE_CHAT_IDS:
+        logger.info("handle_message: skip (chat_id not in ANSWERED_ONCE_CHAT_IDS) chat_id=%s", chat_id)
+        return False
+    return True
 
 
 def handle_message(
@@ -27,41 +65,64 @@ def handle_message(
     sender_id: str,
 ) -> None:
     """Handle a root-level message: if it's a question, reply with a match or 'don't know'."""
-    if not message_text or not message_text.strip():
-        logger.info("handle_message: skip (empty text) message_id=%s", message_id)
-        return
-    if not question_detector.is_question(message_text):
-        logger.info("handle_message: skip (not a question) message_id=%s text=%r", message_id, message_text[:50])
-        return
-    if ANSWERED_ONCE_CHAT_IDS and chat_id not in ANSWERED_ONCE_CHAT_IDS:
-        logger.info("handle_message: skip (chat_id not in ANSWERED_ONCE_CHAT_IDS) chat_id=%s", chat_id)
+    if not should_answer(chat_id, message_id, message_text):
         return
     query_embedding = embeddings.embed(message_text)
 
     if ANSWER_MODE == "llm_summarize":
         _handle_message_llm_summarize(chat_id, message_id, message_text, query_embedding)
     else:
-        _handle_message_top_1(chat_id, message_id, query_embedding)
+        _handle_message_top_1(chat_id, message_id, query_embedding, message_text)
+
 
+def find_match(chat_id: str, message_text: str | None, query_embedding: list[float]) -> store.QARecord | None:
+    """top_1 retrieval: the single best Q&A (reranked when RERANK_ENABLED), or None."""
+    if RERANK_ENABLED:
+        ranked = _retrieve_reranked(chat_id, message_text, query_embedding, top_k=1)
+        return ranked[0][0] if ranked else None
+    return store.find_similar_question(query_embedding, chat_id=chat_id, query_text=message_text)
+
+
+def find_candidates(
+    chat_id: str, message_text: str | None, query_embedding: list[float]
+) -> list[tuple[store.QARecord, float]]:
+    """llm_summarize retrieval: TOP_K_CANDIDATES hits, or the reranked best RERANK_TOP_K."""
+    if RERANK_ENABLED:
+        return _retrieve_reranked(chat_id, message_text, query_embedding, top_k=RERANK_TOP_K)
+    return store.find_similar_questions(
+        query_embedding,
+        chat_id=chat_id,
+        top_k=TOP_K_CANDIDATES,
+        query_text=message_text,
+    )
 
-def _handle_message_top_1(chat_id: str, message_id: str, query_embedding: list[float]) -> None:
+
+def record_reply_content(rec: store.QARecord, max_chars: int) -> tuple[str, dict]:
+    """(plain text, post content) of a reply quoting one stored Q&A (its summary, or truncated answer)."""
+    thread_link = lark_client.build_thread_link(rec.chat_id, rec.root_message_id)
+    summary = rec.answer_summary or _truncate_summary(rec.answer_text, max_chars=max_chars)
+    post_content = formatter.build_post_content(
+        answer_time=rec.answer_time,
+        answer_summary=summary,
+        thread_link=thread_link,
+        answerer_open_id=rec.answerer_open_id,
+    )
+    reply_text = formatter.format_reply(
+        answerer_name=rec.answerer_name,
+        answer_time=rec.answer_time,
+        answer_summary=summary,
+        thread_link=thread_link,
+    )
+    return reply_text, post_content
+
+
+def _handle_message_top_1(
+    chat_id: str, message_id: str, query_embedding: list[float], message_text: str | None = None
+) -> None:
     """top_1 mode: single best match, no LLM; reply is truncated stored answer."""
-    match = store.find_similar_question(query_embedding, chat_id=chat_id)
+    match = find_match(chat_id, message_text, query_embedding)
     if match:
-        thread_link = lark_client.build_thread_link(match.chat_id, match.root_message_id)
-        summary = _truncate_summary(match.answer_text, max_chars=2000)
-        post_content = formatter.build_post_content(
-            answer_time=match.answer_time,
-            answer_summary=summary,
-            thread_link=thread_link,
-            answerer_open_id=match.answerer_open_id,
-        )
-        reply_text = formatter.format_reply(
-            answerer_name=match.answerer_name,
-            answer_time=match.answer_time,
-            answer_summary=summary,
-            thread_link=thread_link,
-        )
+        reply_text, post_content = record_reply_content(match, max_chars=2000)
         sent_id = lark_client.send_text_message(
             chat_id,
             reply_text,
@@ -77,6 +138,24 @@ def _handle_message_top_1(chat_id: str, message_id: str, query_embedding: list[f
         logger.warning("Failed to send reply for message_id=%s", message_id)
 
 
+def _retrieve_reranked(
+    chat_id: str,
+    message_text: str | None,
+    query_embedding: list[float],
+    top_k: int,
+) -> list[tuple[store.QARecord, float]]:
+    """Retrieve a wide candidate set (RERANK_CANDIDATES) and keep the cross-encoder's best top_k."""
+    from . import reranker
+
+    candidates = store.find_similar_questions(
+        query_embedding,
+        chat_id=chat_id,
+        top_k=max(top_k, RERANK_CANDIDATES),
+        query_text=message_text,
+    )
+    return reranker.rerank(message_text or "", candidates, top_k)
+
+
 def _handle_message_llm_summarize(
     chat_id: str,
     message_id: str,
@@ -86,62 +165,22 @@ def _handle_message_llm_summarize(
     """llm_summarize mode: top-k candidates, LLM summary, source links."""
     from . import answer_summarizer
 
-    candidates = store.find_similar_questions(
-        query_embedding,
-        chat_id=chat_id,
-        top_k=TOP_K_CANDIDATES,
-    )
+    candidates = find_candidates(chat_id, message_text, query_embedding)
     if not candidates:
         sent_id = lark_client.send_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+    elif LLM_STREAMING:
+        sent_id = _reply_llm_streaming(chat_id, message_id, message_text, query_embedding, candidates)
     else:
         try:
-            summary = answer_summarizer.summarize_answer(message_text, candidates)
+            summary = answer_summarizer.summarize_answer(message_text, candidates, query_embedding=query_embedding)
         except (ValueError, ImportError) as e:
             logger.warning("LLM summarization skipped (%s), falling back to top-1", e)
-            best = store.pick_best_candidate(candidates, policy=BEST_ANSWER_POLICY)
-            if best:
-                thread_link = lark_client.build_thread_link(best.chat_id, best.root_message_id)
-                summary = _truncate_summary(best.answer_text, max_chars=500)
-                post_content = formatter.build_post_content(
-                    answer_time=best.answer_time,
-                    answer_summary=summary,
-                    thread_link=thread_link,
-                    answerer_open_id=best.answerer_open_id,
-                )
-                reply_text = formatter.format_reply(
-                    answerer_name=best.answerer_name,
-                    answer_time=best.answer_time,
-                    answer_summary=summary,
-                    thread_link=thread_link,
-                )
-                sent_id = lark_client.send_text_message(
-                    chat_id, reply_text, root_id=message_id, post_content=post_content
-                )
-            else:
-                sent_id = lark_client.send_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+            sent_id = _reply_best_candidate(chat_id, message_id, candidates)
         except Exception as e:
             logger.exception("LLM summarization failed: %s", e)
             sent_id = lark_client.send_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
         else:
-            source_links = [
-                lark_client.build_thread_link(rec.chat_id, rec.root_message_id)
-                for rec, _ in candidates
-            ]
-            summary_truncated = _truncate_summary(summary, max_chars=500)
-            post_content = formatter.build_post_content(
-                answer_time="various",
-                answer_summary=summary_truncated,
-                thread_link=source_links[0] if source_links else "",
-                answerer_open_id=None,
-                source_links=source_links,
-            )
-            reply_text = formatter.format_reply(
-                answerer_name="Past discussions",
-                answer_time="various",
-                answer_summary=summary_truncated,
-                thread_link=source_links[0] if source_links else "",
-                source_links=source_links,
-            )
+            reply_text, post_content = llm_reply_content(summary, candidates)
             sent_id = lark_client.send_text_message(
                 chat_id,
                 reply_text,
@@ -154,6 +193,93 @@ def _handle_message_llm_summarize(
         logger.warning("Failed to send reply for message_id=%s", message_id)
 
 
+def _reply_best_candidate(chat_id: str, message_id: str, candidates: list) -> str | None:
+    """Fallback when the LLM is unavailable: reply with the best candidate by BEST_ANSWER_POLICY."""
+    best = store.pick_best_candidate(candidates, policy=BEST_ANSWER_POLICY)
+    if not best:
+        return lark_client.send_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+    reply_text, post_content = record_reply_content(best, max_chars=500)
+    return lark_client.send_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+
+
+def llm_reply_content(summary: str, candidates: list) -> tuple[str, dict]:
+    """(plain text, post content) of an LLM summary reply with links to the candidate threads."""
+    source_links = [lark_client.build_thread_link(rec.chat_id, rec.root_message_id) for rec, _ in candidates]
+    summary_truncated = _truncate_summary(summary, max_chars=500)
+    post_content = formatter.build_post_content(
+        answer_time="various",
+        answer_summary=summary_truncated,
+        thread_link=source_links[0] if source_links else "",
+        answerer_open_id=None,
+        source_links=source_links,
+    )
+    reply_text = formatter.format_reply(
+        answerer_name="Past discussions",
+        answer_time="various",
+        answer_summary=summary_truncated,
+        thread_link=source_links[0] if source_links else "",
+        source_links=source_links,
+    )
+    return reply_text, post_content
+
+
+def _reply_llm_streaming(
+    chat_id: str,
+    message_id: str,
+    message_text: str,
+    query_embedding: list[float],
+    candidates: list,
+) -> str | None:
+    """Post a placeholder reply right away, then edit it in place as the LLM streams the summary.
+
+    Edits are throttled to one per LLM_STREAM_UPDATE_MS and capped at LLM_STREAM_MAX_EDITS (Lark limits
+    edits per message); the last one always carries the complete summary. An edit that would not change
+    the displayed (truncated) reply is not sent. If the stream fails, the message is edited to
+    DONT_KNOW_REPLY rather than left with a cut-off summary.
+    """
+    from . import answer_summarizer
+
+    try:
+        chunks = answer_summarizer.summarize_answer_stream(message_text, candidates, query_embedding=query_embedding)
+    except (ValueError, ImportError) as e:
+        logger.warning("LLM summarization skipped (%s), falling back to top-1", e)
+        return _reply_best_candidate(chat_id, message_id, candidates)
+
+    reply_text, post_content = llm_reply_content(STREAM_PLACEHOLDER, candidates)
+    sent_id = lark_client.send_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+    interval = LLM_STREAM_UPDATE_MS / 1000.0
+    text = ""
+    shown = reply_text  # what the message says now; the reply is cut to 500 chars, so late chunks may not change it
+    edits = 0
+    last_edit = float("-inf")
+    try:
+        for chunk in chunks:
+            text += chunk
+            now = time.monotonic()
+            if sent_id and edits < LLM_STREAM_MAX_EDITS - 1 and now - last_edit >= interval:
+                reply_text, post_content = llm_reply_content(text + " …", candidates)
+                last_edit = now
+                if reply_text != shown:
+                    lark_client.update_message(sent_id, reply_text, post_content=post_content)
+                    shown = reply_text
+                    edits += 1
+    except Exception as e:
+        # A cut-off summary must not stay posted as if it were the answer: replace it like a failed call
+        logger.exception("LLM summarization failed after %d chars: %s", len(text), e)
+        if not sent_id:
+            return lark_client.send_text_message(chat_id, DONT_KNOW_REPLY, root_id=message_id)
+        lark_client.update_message(sent_id, DONT_KNOW_REPLY, post_content=formatter.build_plain_post(DONT_KNOW_REPLY))
+        return sent_id
+    reply_text, post_content = llm_reply_content(text.strip(), candidates)
+    if not sent_id:
+        return lark_client.send_text_message(chat_id, reply_text, root_id=message_id, post_content=post_content)
+    if reply_text != shown:
+        lark_client.update_message(sent_id, reply_text, post_content=post_content)
+        edits += 1
+    logger.info("Streamed summary for message_id=%s with %d edit(s)", message_id, edits)
+    return sent_id
+
+
 def index_reply(
     chat_id: str,
     root_id: str,
@@ -163,36 +289,133 @@ def index_reply(
     reply_create_time: str,
 ) -> None:
     """When a reply is posted, append it to the Q&A for this root (create if first reply)."""
-    if not root_id or not reply_content:
+    index_replies(
+        chat_id,
+        root_id,
+        [
+            {
+                "reply_message_id": reply_message_id,
+                "reply_content": reply_content,
+                "reply_sender_id": reply_sender_id,
+                "reply_create_time": reply_create_time,
+            }
+        ],
+    )
+
+
+def index_replies(chat_id: str, root_id: str, replies: list[dict]) -> None:
+    """Append a burst of replies (index_reply kwargs minus chat/root) to this root's Q&A.
+
+    One root fetch and one store write for the whole burst; the latest reply is the answerer.
+    """
+    replies = [r for r in replies if r.get("reply_content")]
+    if not root_id or not replies:
         logger.info("index_reply: skip (no root_id or empty reply) root_id=%s", root_id)
         return
-    root_msg = lark_client.get_message(root_id)
-    if not root_msg:
+    root = _get_root_question(root_id)
+    if root is None:
         logger.warning("index_reply: skip (could not fetch root message) root_id=%s", root_id)
         return
-    question_text = _parse_content(root_msg.get("content") or "{}")
-    if not question_detector.is_question(question_text):
+    question_text, root_is_question = root
+    if not root_is_question:
         logger.info("index_reply: skip (root is not a question) root_id=%s text=%r", root_id, question_text[:50])
         return
-    answer_text = _parse_content(reply_content)
-    if not answer_text.strip():
+    replies = sorted(replies, key=lambda r: _create_time_key(r.get("reply_create_time")))
+    texts = []
+    for r in replies:
+        text = _parse_content(r["reply_content"])
+        if text.strip():
+            texts.append(text)
+            last = r
+    if not texts:
         logger.info("index_reply: skip (reply has no text) root_id=%s", root_id)
         return
     try:
-        ts = datetime.utcfromtimestamp(int(reply_create_time) / 1000)
+        ts = datetime.utcfromtimestamp(int(last.get("reply_create_time")) / 1000)
     except (TypeError, ValueError):
         ts = datetime.utcnow()
+    reply_sender_id = last.get("reply_sender_id") or ""
     answerer_name = f"User ({reply_sender_id[:12]}...)" if len(str(reply_sender_id)) > 12 else f"User ({reply_sender_id})"
+    # Appending the joined texts yields the same thread as appending each reply in turn.
     store.append_reply_to_qa(
         chat_id=chat_id,
         root_id=root_id,
         question_text=question_text,
-        new_reply_text=answer_text,
+        new_reply_text=THREAD_REPLY_DELIMITER.join(texts),
         answerer_name=answerer_name,
         answer_time=ts,
         answerer_open_id=reply_sender_id or None,
     )
-    logger.info("Appended reply to Q&A for root_id=%s", root_id)
+    summary_cache.invalidate_root(root_id)
+    if _thread_summaries is not None:
+        _thread_summaries.touch(root_id)
+    logger.info("Appended %d repl%s to Q&A for root_id=%s", len(texts), "y" if len(texts) == 1 else "ies", root_id)
+
+
+def summarize_thread(root_id: str) -> bool:
+    """Store a compact answer_summary for a long thread (runs once the thread has gone quiet); True if stored."""
+    rec = store.get_qa_by_root(root_id)
+    if rec is None or len(rec.answer_text) < THREAD_SUMMARY_MIN_CHARS:
+        return False
+    from . import answer_summarizer
+
+    try:
+        summary = answer_summarizer.summarize_thread(rec.question_text, rec.answer_text)
+    except (ValueError, ImportError) as e:
+        logger.warning("Thread summary skipped for root_id=%s (%s)", root_id, e)
+        return False
+    except Exception as e:
+        logger.exception("Thread summary failed for root_id=%s: %s", root_id, e)
+        return False
+    if summary and store.set_answer_summary(root_id, summary, rec.answer_text):
+        logger.info("Stored thread summary for root_id=%s (%d -> %d chars)", root_id, len(rec.answer_text), len(summary))
+        return True
+    return False
+
+
+def summarize_missing_threads(workers: int = THREAD_SUMMARY_MAX_CONCURRENCY) -> int:
+    """Summarize every long thread that has no answer_summary yet; returns how many were stored.
+
+    Threads written in bulk (seed and backfill scripts, store.add_qa_many) never go through index_replies,
+    so the quiet-thread scheduler never sees them; the scripts run this pass after writing instead.
+    """
+    roots = store.roots_missing_summary(THREAD_SUMMARY_MIN_CHARS)
+    if not roots:
+        return 0
+    logger.info("Summarizing %d long thread(s) without a summary", len(roots))
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="thread-summary") as pool:
+        return sum(pool.map(summarize_thread, roots))
+
+
+# Threads get their summary THREAD_SUMMARY_QUIET_SECONDS after their last indexed reply.
+_thread_summaries = (
+    QuietThreadScheduler(
+        summarize_thread, THREAD_SUMMARY_QUIET_SECONDS, THREAD_SUMMARY_MAX_CONCURRENCY, THREAD_SUMMARY_MAX_PENDING
+    )
+    if THREAD_SUMMARY_ENABLED
+    else None
+)
+
+
+def _get_root_question(root_id: str) -> tuple[str, bool] | None:
+    """(root text, is-question verdict) for a thread root, from cache or one Lark fetch; None if unavailable."""
+    cached = _root_cache.get(root_id)
+    if cached is not None:
+        return cached
+    root_msg = lark_client.get_message(root_id)
+    if not root_msg:
+        return None
+    question_text = _parse_content(root_msg.get("content") or "{}")
+    result = (question_text, question_detector.is_question(question_text))
+    _root_cache.put(root_id, result)
+    return result
+
+
+def _create_time_key(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
 
 
 def _parse_content(content: str) -> str:
@@ -0,0 +1,155 @@
+"""Token budgeting for LLM prompts: count tokens, drop near-duplicate candidates, trim long threads."""
+import logging
+from typing import Callable
+
+from .bm25 import tokenize
+from .store import THREAD_REPLY_DELIMITER, QARecord
+
+logger = logging.getLogger(__name__)
+
+GAP_MARKER = "[...]"
+
+
+def _load_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+
+        enc = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(enc.encode(text, disallowed_special=()))
+    except Exception:
+        return _approx_tokens
+
+
+def _approx_tokens(text: str) -> int:
+    """~4 characters per token for Latin text; CJK and other wide characters count one token each."""
+    wide = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return (len(text) - wide + 3) // 4 + wide
+
+
+_counter: Callable[[str], int] | None = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text: exact with tiktoken installed (cl100k_base), else an estimate."""
+    global _counter
+    if _counter is None:
+        _counter = _load_counter()
+    return _counter(text or "")
+
+
+def _jaccard(a: set[str], b: set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def drop_near_duplicates(
+    candidates: list[tuple[QARecord, float]], threshold: float
+) -> tuple[list[tuple[QARecord, float]], int]:
+    """Keep the better-scored of candidates whose question+answer term sets overlap >= threshold (Jaccard).
+
+    Returns (kept candidates in their original order, number dropped).
+    """
+    order = sorted(range(len(candidates)), key=lambda i: -candidates[i][1])
+    kept: list[int] = []
+    terms: dict[int, set[str]] = {}
+    for i in order:
+        rec = candidates[i][0]
+        terms[i] = set(tokenize(f"{rec.question_text} {rec.answer_summary or rec.answer_text}"))
+        if all(_jaccard(terms[i], terms[j]) < threshold for j in kept):
+            kept.append(i)
+    kept.sort()
+    return [candidates[i] for i in kept], len(candidates) - len(kept)
+
+
+def allocate(needs: list[int], weights: list[float], budget: int) -> list[int]:
+    """Split budget in proportion to weights, giving any share a candidate does not need to the others."""
+    shares = [0] * len(needs)
+    open_ = [i for i, need in enumerate(needs) if need > 0]
+    remaining = budget
+    while open_ and remaining > 0:
+        total = sum(weights[i] for i in open_)
+        satisfied = [i for i in open_ if needs[i] - shares[i] <= remaining * weights[i] / total]
+        if not satisfied:
+            for i in open_:
+                shares[i] += int(remaining * weights[i] / total)
+            break
+        for i in satisfied:
+            remaining -= needs[i] - shares[i]
+            shares[i] = needs[i]
+            open_.remove(i)
+    return shares
+
+
+def _truncate_to_tokens(text: str, tokens: int) -> str:
+    if count_tokens(text) <= tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) + 1 <= tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + "…" if lo else ""
+
+
+def trim_thread(answer_text: str, query: str, tokens: int) -> str:
+    """Fit a thread into tokens by keeping its most relevant replies (in thread order).
+
+    Replies are ranked by how many query terms they contain; the last reply (usually the resolution)
+    is always preferred, then later replies win ties. Skipped stretches are marked with GAP_MARKER.
+    """
+    if count_tokens(answer_text) <= tokens:
+        return answer_text
+    replies = [r.strip() for r in answer_text.split(THREAD_REPLY_DELIMITER)]
+    query_terms = set(tokenize(query))
+    last = len(replies) - 1
+
+    def rank(i: int) -> tuple:
+        return (i == last, len(query_terms & set(tokenize(replies[i]))), i)
+
+    chosen: list[int] = []
+    used = 0
+    sep = count_tokens(THREAD_REPLY_DELIMITER + GAP_MARKER)
+    for i in sorted(range(len(replies)), key=rank, reverse=True):
+        cost = count_tokens(replies[i]) + sep
+        if used + cost <= tokens:
+            chosen.append(i)
+            used += cost
+    if not chosen:
+        return _truncate_to_tokens(replies[last], tokens)
+    chosen.sort()
+    parts: list[str] = []
+    prev = -1
+    for i in chosen:
+        if i != prev + 1:
+            parts.append(GAP_MARKER)
+        parts.append(replies[i])
+        prev = i
+    if prev != last:
+        parts.append(GAP_MARKER)
+    return THREAD_REPLY_DELIMITER.join(parts)
+
+
+def fit_candidates(
+    user_question: str,
+    candidates: list[tuple[QARecord, float]],
+    token_budget: int,
+    duplicate_threshold: float,
+) -> tuple[list[tuple[str, str]], int]:
+    """(question, answer) texts for the prompt, within token_budget in total; and the count of dropped duplicates.
+
+    Budget is shared in proportion to similarity score; a candidate's question is kept whole and its
+    answer (the precomputed summary when there is one) is trimmed to the rest of its share.
+    """
+    kept, dropped = drop_near_duplicates(candidates, duplicate_threshold)
+    answers = [rec.answer_summary or rec.answer_text for rec, _ in kept]
+    question_tokens = [count_tokens(rec.question_text) for rec, _ in kept]
+    needs = [q + count_tokens(a) for q, a in zip(question_tokens, answers)]
+    weights = [max(score, 0.05) for _, score in kept]
+    shares = allocate(needs, weights, token_budget)
+    fitted = []
+    for (rec, _), answer, q_tokens, share in zip(kept, answers, question_tokens, shares):
+        fitted.append((rec.question_text, trim_thread(answer, user_question, max(share - q_tokens, 0))))
+    return fitted, dropped
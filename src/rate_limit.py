@@ -0,0 +1,162 @@
+"""Client-side rate limiting for Lark API calls: per-endpoint token buckets with live-over-backfill priority."""
+import asyncio
+import threading
+import time
+
+# Lower goes first. Live traffic (answers, edits, root lookups) vs. bulk history reads.
+PRIORITY_LIVE = 0
+PRIORITY_BACKFILL = 1
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`. Backfill may not take the last reserve_share of the burst,
+    and yields while live callers are waiting, so live calls are not queued behind bulk traffic."""
+
+    def __init__(self, rate: float, burst: float, *, reserve_share: float = 0.2) -> None:
+        self.rate = max(rate, 1e-6)
+        self.burst = max(burst, 1.0)
+        self.reserve = self.burst * min(max(reserve_share, 0.0), 0.9)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._live_waiting = 0
+        self._lock = threading.Lock()
+        self.throttled_seconds = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now <= self._updated:
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, priority: int) -> float:
+        """Take a token and return 0.0, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            need = 1.0
+            if priority != PRIORITY_LIVE:
+                if self._live_waiting:
+                    return 1.0 / self.rate
+                need += self.reserve
+            if self._tokens >= need:
+                self._tokens -= 1.0
+                return 0.0
+            return (need - self._tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller for `seconds` (the server asked us to back off) and start refilling from empty."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+    def _waiting(self, priority: int, delta: int) -> None:
+        if priority == PRIORITY_LIVE:
+            with self._lock:
+                self._live_waiting += delta
+
+    def acquire(self, priority: int = PRIORITY_LIVE) -> float:
+        """Block until a token is taken; returns the seconds waited."""
+        wait = self.try_take(priority)
+        if not wait:
+            return 0.0
+        start = time.monotonic()
+        self._waiting(priority, 1)
+        try:
+            while wait:
+                time.sleep(wait)
+                wait = self.try_take(priority)
+        finally:
+            self._waiting(priority, -1)
+        return self._throttled(start)
+
+    async def aacquire(self, priority: int = PRIORITY_LIVE) -> float:
+        """acquire() for the event loop."""
+        wait = self.try_take(priority)
+        if not wait:
+            return 0.0
+        start = time.monotonic()
+        self._waiting(priority, 1)
+        try:
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.try_take(priority)
+        finally:
+            self._waiting(priority, -1)
+        return self._throttled(start)
+
+    def _throttled(self, start: float) -> float:
+        waited = time.monotonic() - start
+        with self._lock:
+            self.throttled_seconds += waited
+        return waited
+
+
+class RateLimiter:
+    """One TokenBucket per endpoint name (see lark_http.endpoint_name); `default` covers the rest.
+
+    limits maps endpoint -> (rate per second, burst); endpoints without a limit and no default are
+    not limited.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float, float]] | None = None,
+        default: tuple[float, float] | None = None,
+        *,
+        reserve_share: float = 0.2,
+    ) -> None:
+        self._limits = dict(limits or {})
+        self._default = default
+        self._reserve_share = reserve_share
+        self._buckets: dict[str, TokenBucket | None] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, endpoint: str) -> TokenBucket | None:
+        with self._lock:
+            if endpoint not in self._buckets:
+                limit = self._limits.get(endpoint, self._default)
+                self._buckets[endpoint] = (
+                    TokenBucket(*limit, reserve_share=self._reserve_share) if limit else None
+                )
+            return self._buckets[endpoint]
+
+    def acquire(self, endpoint: str, priority: int = PRIORITY_LIVE) -> float:
+        bucket = self.bucket(endpoint)
+        return bucket.acquire(priority) if bucket else 0.0
+
+    async def aacquire(self, endpoint: str, priority: int = PRIORITY_LIVE) -> float:
+        bucket = self.bucket(endpoint)
+        return await bucket.aacquire(priority) if bucket else 0.0
+
+    def pause(self, endpoint: str, seconds: float) -> None:
+        bucket = self.bucket(endpoint)
+        if bucket is not None:
+            bucket.pause(seconds)
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            buckets = {name: b for name, b in self._buckets.items() if b is not None}
+        return {
+            name: {"rate": b.rate, "burst": b.burst, "throttled_seconds": round(b.throttled_seconds, 3)}
+            for name, b in sorted(buckets.items())
+        }
+
+
+def parse_limits(spec: str | None) -> dict[str, tuple[float, float]]:
+    """Parse "ENDPOINT=RATE[/BURST],..." (e.g. "GET /open-apis/im/v1/messages=10/20"); burst defaults to rate."""
+    limits: dict[str, tuple[float, float]] = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        endpoint, _, value = part.rpartition("=")
+        rate, _, burst = value.partition("/")
+        try:
+            limits[" ".join(endpoint.split())] = (float(rate), float(burst or rate))
+        except ValueError:
+            continue
+    return limits
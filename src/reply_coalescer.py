@@ -0,0 +1,195 @@
+"""Per-thread reply queue: serializes index writes per root_id and coalesces bursts of replies."""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# handler(chat_id, root_id, replies) -> None | Future; replies are the dicts passed to submit(), in arrival order.
+# A returned Future keeps the root busy until it resolves, without holding a coalescer thread.
+ReplyHandler = Callable[[str, str, list[dict]], "Future | None"]
+
+
+@dataclass
+class _RootQueue:
+    chat_id: str
+    replies: list[dict] = field(default_factory=list)
+    due: float | None = None  # monotonic time of the scheduled flush
+    running: bool = False
+    retries: int = 0
+
+
+class ReplyCoalescer:
+    """Collect replies per root for window_seconds after the first one, then hand them to handler at once.
+
+    At most one handler call runs per root at a time; replies arriving while it runs form the next batch.
+    Different roots are handled independently: one scheduler thread waits on a heap of flush times and
+    at most max_concurrency handlers run at once. At most max_pending_roots roots are queued; replies for
+    new roots beyond that are shed (submit returns False).
+
+    A batch whose handler fails with one of retry_on is put back in front of the root's queue and retried
+    after retry_delay seconds, up to max_retries times in a row; then it is dropped.
+    """
+
+    def __init__(
+        self,
+        handler: ReplyHandler,
+        window_seconds: float,
+        *,
+        max_pending_roots: int = 10000,
+        max_concurrency: int = 4,
+        retry_on: tuple[type[BaseException], ...] = (),
+        retry_delay: float = 0.0,
+        max_retries: int = 0,
+    ) -> None:
+        self._handler = handler
+        self._window = max(0.0, window_seconds)
+        self._max_pending = max(1, max_pending_roots)
+        self._max_concurrency = max(1, max_concurrency)
+        self._retry_on = retry_on
+        self._retry_delay = max(0.0, retry_delay)
+        self._max_retries = max(0, max_retries)
+        self._cond = threading.Condition()
+        self._roots: dict[str, _RootQueue] = {}
+        self._heap: list[tuple[float, int, str]] = []  # may hold superseded flush times; skipped when popped
+        self._seq = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._pool: ThreadPoolExecutor | None = None
+        self._counts = {"shed": 0, "retried": 0, "dropped": 0}
+
+    def submit(self, chat_id: str, root_id: str, reply: dict) -> bool:
+        """Queue reply for root_id; False when it was shed because max_pending_roots roots are queued."""
+        with self._cond:
+            q = self._roots.get(root_id)
+            if q is None:
+                if len(self._roots) >= self._max_pending:
+                    self._counts["shed"] += 1
+                    logger.warning("Reply coalescer full (%d roots); shedding reply for root_id=%s", self._max_pending, root_id)
+                    return False
+                q = self._roots[root_id] = _RootQueue(chat_id=chat_id)
+            q.replies.append(reply)
+            if q.due is None and not q.running:
+                self._schedule(root_id, q, self._window)
+            return True
+
+    def _schedule(self, root_id: str, q: _RootQueue, delay: float) -> None:
+        q.due = time.monotonic() + delay
+        heapq.heappush(self._heap, (q.due, next(self._seq), root_id))
+        if self._thread is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._max_concurrency, thread_name_prefix="reply-flush")
+            self._thread = threading.Thread(target=self._run, name="reply-coalescer", daemon=True)
+            self._thread.start()
+        self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._is_stale(self._heap[0]):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, _, root_id = heapq.heappop(self._heap)
+                q = self._roots[root_id]
+                batch = self._take(q)
+            self._pool.submit(self._handle, root_id, q, batch)
+
+    def _is_stale(self, entry: tuple[float, int, str]) -> bool:
+        q = self._roots.get(entry[2])
+        return q is None or q.due != entry[0]
+
+    def _take(self, q: _RootQueue) -> list[dict]:
+        """Under the lock: claim the root's queued replies as one running batch."""
+        batch, q.replies = q.replies, []
+        q.due = None
+        q.running = True
+        return batch
+
+    def _handle(self, root_id: str, q: _RootQueue, batch: list[dict]) -> None:
+        if len(batch) > 1:
+            logger.info("Coalesced %d replies for root_id=%s", len(batch), root_id)
+        try:
+            result = self._handler(q.chat_id, root_id, batch)
+        except Exception as e:
+            self._finish(root_id, q, batch, e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(lambda f: self._finish(root_id, q, batch, _future_error(f)))
+        else:
+            self._finish(root_id, q, batch, None)
+
+    def _finish(self, root_id: str, q: _RootQueue, batch: list[dict], error: BaseException | None) -> None:
+        with self._cond:
+            q.running = False
+            delay = self._window
+            if error is not None and isinstance(error, self._retry_on):
+                if q.retries < self._max_retries:
+                    q.retries += 1
+                    self._counts["retried"] += 1
+                    q.replies = batch + q.replies
+                    delay = self._retry_delay
+                    logger.info("Deferring %d repl(ies) for root_id=%s (attempt %d): %s", len(batch), root_id, q.retries, error)
+                else:
+                    q.retries = 0
+                    self._counts["dropped"] += 1
+                    logger.warning("Dropping %d repl(ies) for root_id=%s: %s", len(batch), root_id, error)
+            else:
+                q.retries = 0
+                if error is not None:
+                    logger.error("Reply handler error for root_id=%s: %s", root_id, error, exc_info=error)
+            if q.replies:
+                self._schedule(root_id, q, delay)
+            else:
+                del self._roots[root_id]
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        """Number of roots with queued or in-flight replies."""
+        with self._cond:
+            return len(self._roots)
+
+    def stats(self) -> dict:
+        """Queued roots, roots waiting to retry, and counts of shed, retried and dropped batches."""
+        with self._cond:
+            return {
+                "pending_roots": len(self._roots),
+                "retrying_roots": sum(1 for q in self._roots.values() if q.retries),
+                **self._counts,
+            }
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Flush every queued root now and wait for in-flight handlers (e.g. at shutdown).
+
+        False if timeout ran out first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                waiting = [(r, q) for r, q in self._roots.items() if not q.running and q.replies]
+                if not waiting:
+                    if not self._roots:
+                        return True
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                    continue
+                batches = [(r, q, self._take(q)) for r, q in waiting]
+            for root_id, q, batch in batches:
+                self._handle(root_id, q, batch)
+
+
+def _future_error(future: Future) -> BaseException | None:
+    if future.cancelled():
+        return RuntimeError("cancelled")
+    return future.exception()
@@ -0,0 +1,101 @@
+"""Optional cross-encoder rerank of retrieved Q&A candidates, with a score cache and latency budget."""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any
+
+from .cache import LRUCache
+from .config import RERANK_BUDGET_MS, RERANK_CACHE_SIZE, RERANK_MODEL, RERANK_WORKERS
+from .store import QARecord, record_id_for_root
+
+logger = logging.getLogger(__name__)
+
+# Characters of the answer scored with the question; cross-encoders truncate long pairs anyway.
+_ANSWER_CHARS = 500
+
+_model: Any = None
+_model_lock = threading.Lock()
+# Scoring threads: a batch that overruns the budget while running finishes in the background and fills
+# the cache; one that is still queued when the budget runs out is cancelled.
+_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+# (query hash, record id, passage hash) -> cross-encoder score
+_scores = LRUCache(RERANK_CACHE_SIZE)
+
+
+def get_model() -> Any:
+    """Lazy-load the cross-encoder."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import CrossEncoder
+                _model = CrossEncoder(RERANK_MODEL)
+                logger.info("Loaded rerank model %s", RERANK_MODEL)
+    return _model
+
+
+def warmup() -> None:
+    """Load the cross-encoder and score one pair."""
+    get_model().predict([("Is the reranker warm?", "Yes.")])
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()[:32]
+
+
+def _passage(rec: QARecord) -> str:
+    return f"{rec.question_text}\n{rec.answer_text[:_ANSWER_CHARS]}"
+
+
+def _score_pairs(query_text: str, passages: list[str], keys: list[tuple]) -> list[float]:
+    scores = [float(s) for s in get_model().predict([(query_text, p) for p in passages])]
+    for key, score in zip(keys, scores):
+        _scores.put(key, score)
+    return scores
+
+
+def rerank(
+    query_text: str,
+    candidates: list[tuple[QARecord, float]],
+    top_k: int,
+    budget_ms: float = RERANK_BUDGET_MS,
+) -> list[tuple[QARecord, float]]:
+    """Best top_k candidates by cross-encoder score; (record, score) pairs keep their vector scores.
+
+    Cached pairs are not rescored; the rest go through the model in one batch on the scoring pool. If
+    that batch has not finished budget_ms after this call started (including time spent waiting for a
+    free scoring thread), or fails, candidates are returned in their original (vector) order.
+    """
+    start = time.monotonic()
+    if len(candidates) <= 1 or not query_text:
+        return candidates[:top_k]
+    qhash = _digest(query_text)
+    keys = []
+    ce_scores: list[float | None] = []
+    for rec, _score in candidates:
+        key = (qhash, record_id_for_root(rec.root_message_id), _digest(_passage(rec)))
+        keys.append(key)
+        ce_scores.append(_scores.get(key))
+    missing = [i for i, s in enumerate(ce_scores) if s is None]
+    if missing:
+        future = _executor.submit(
+            _score_pairs, query_text, [_passage(candidates[i][0]) for i in missing], [keys[i] for i in missing]
+        )
+        try:
+            remaining = max(0.0, budget_ms / 1000.0 - (time.monotonic() - start))
+            for i, score in zip(missing, future.result(timeout=remaining)):
+                ce_scores[i] = score
+        except FutureTimeout:
+            queued = future.cancel()  # still waiting for a scoring thread: drop it
+            logger.info(
+                "Rerank over budget (%.0f ms, %d pairs, %s); using vector order",
+                budget_ms, len(missing), "queued" if queued else "scoring",
+            )
+            return candidates[:top_k]
+        except Exception as e:
+            logger.warning("Rerank failed (%s); using vector order", e)
+            return candidates[:top_k]
+    order = sorted(range(len(candidates)), key=lambda i: -ce_scores[i])
+    return [candidates[i] for i in order[:top_k]]
@@ -1,17 +1,39 @@
-"""Vector store for Q&A: Chroma with metadata."""
+"""Vector store for Q&A: module-level API over a pluggable VectorStore (Chroma by default)."""
 import logging
+import threading
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Protocol
 import uuid
 
-from .config import CHROMA_PERSIST_DIR, SIMILARITY_THRESHOLD
+from .config import (
+    BM25_INDEX_PATH,
+    CHROMA_PERSIST_DIR,
+    HYBRID_CANDIDATE_MULTIPLIER,
+    HYBRID_LEXICAL_MIN_SCORE,
+    HYBRID_MIN_TERM_COVERAGE,
+    HYBRID_RRF_K,
+    HYBRID_SEARCH,
+    NUMPY_STORE_PATH,
+    SIMILARITY_THRESHOLD,
+    STORE_BACKEND,
+    STORE_BULK_EMBED_BATCH,
+    STORE_BULK_WRITE_CHUNK,
+    STORE_GLOBAL_INDEX,
+    STORE_PARTITION_MEMORY_MB,
+    STORE_PARTITIONING,
+)
 from . import embeddings
+from .bm25 import BM25Index
+from .cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
 COLLECTION_NAME = "answered_once_qa"
 THREAD_REPLY_DELIMITER = "\n---\n"
+# Metadata keys _record_metadata may omit; replacing metadata must clear them.
+_OPTIONAL_METADATA_KEYS = ("answerer_open_id", "answer_summary")
 
 
 @dataclass
@@ -24,60 +46,394 @@ class QARecord:
     root_message_id: str
     thread_id: str
     answerer_open_id: str | None = None
+    answer_summary: str | None = None  # compact LLM summary of answer_text, set once the thread goes quiet
 
 
-_collection: Any = None
+class VectorStore(Protocol):
+    """Storage engine behind the module-level store functions.
 
+    Engines store (id, embedding, document, metadata) rows, where document is the question text and
+    metadata comes from _record_metadata. Scores are cosine-like similarities in [0, 1] (higher is better).
+    """
 
-def _get_collection():
-    global _collection
-    if _collection is None:
+    def add(
+        self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None: ...
+
+    def upsert(
+        self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None:
+        """Add rows, replacing existing rows with the same id in place."""
+        ...
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict]) -> None:
+        """Replace metadata of existing rows without touching their embeddings."""
+        ...
+
+    def get_by_root(self, root_message_id: str) -> tuple[str, str, dict] | None:
+        """(id, document, metadata) of one row for this thread root, or None."""
+        ...
+
+    def get_by_roots(self, root_message_ids: list[str]) -> dict[str, tuple[str, str, dict]]:
+        """get_by_root for many roots in one lookup: {root: (id, document, metadata)} of those indexed."""
+        ...
+
+    def delete_by_root(self, root_message_id: str) -> None: ...
+
+    def query(
+        self, query_embedding: list[float], top_k: int, chat_id: str | None = None
+    ) -> list[tuple[str, dict, float]]:
+        """Top-k (document, metadata, score), best first; only rows of chat_id when given."""
+        ...
+
+    def search(
+        self, query_embedding: list[float], top_k: int, chat_id: str | None = None
+    ) -> list[tuple[str, dict, float]]:
+        """Chat-scoped top-k in one search: chat_id's rows if that chat has any, otherwise all rows.
+
+        Same result as query(chat_id) falling back to query() when it is empty, without paying for two searches.
+        """
+        ...
+
+    def count(self) -> int: ...
+
+    def rows(self) -> Iterator[tuple[str, str, dict]]:
+        """Every (id, document, metadata) row, for rebuilding derived indexes."""
+        ...
+
+
+class ChromaVectorStore:
+    """VectorStore on a persistent Chroma collection (L2 space over normalized embeddings).
+
+    Per-chat and total row counts (so search() knows up front whether to filter by chat or search
+    globally) are cached for count_ttl seconds and dropped on this process's writes; rows written by
+    another process show up once the entry expires.
+    """
+
+    def __init__(self, path: Path, collection_name: str = COLLECTION_NAME, count_ttl: float = 10.0) -> None:
         import chromadb
         from chromadb.config import Settings
         client = chromadb.PersistentClient(
-            path=str(CHROMA_PERSIST_DIR),
+            path=str(path),
             settings=Settings(anonymized_telemetry=False),
         )
-        _collection = client.get_or_create_collection(
-            name=COLLECTION_NAME,
+        self.collection = client.get_or_create_collection(
+            name=collection_name,
             metadata={"description": "Answered-once Q&A"},
         )
-    return _collection
+        self._count_cache = LRUCache(10000, ttl_seconds=count_ttl)
+
+    def _chat_count(self, chat_id: str | None) -> int:
+        """Rows of chat_id (all rows for None); ids only, no documents or metadata are read."""
+        n = self._count_cache.get(chat_id)
+        if n is None:
+            if chat_id is None:
+                n = self.collection.count()
+            else:
+                n = len(self.collection.get(where={"chat_id": chat_id}, include=[])["ids"])
+            self._count_cache.put(chat_id, n)
+        return n
+
+    def _invalidate_counts(self, metadatas: list[dict]) -> None:
+        self._count_cache.pop(None)
+        for meta in metadatas:
+            self._count_cache.pop(meta.get("chat_id", ""))
+
+    def add(
+        self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None:
+        self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        self._invalidate_counts(metadatas)
+
+    def upsert(
+        self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]
+    ) -> None:
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=self._full(metadatas))
+        self._invalidate_counts(metadatas)
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict]) -> None:
+        # Rows keep their chat here (thread updates never move chats), so the counts are unchanged.
+        self.collection.update(ids=ids, metadatas=self._full(metadatas))
+
+    @staticmethod
+    def _full(metadatas: list[dict]) -> list[dict]:
+        """Chroma merges metadata on update/upsert; a None value removes a key, giving replace semantics."""
+        return [{**{k: None for k in _OPTIONAL_METADATA_KEYS}, **m} for m in metadatas]
+
+    def get_by_root(self, root_message_id: str) -> tuple[str, str, dict] | None:
+        result = self.collection.get(
+            where={"root_message_id": root_message_id},
+            limit=1,
+            include=["metadatas", "documents"],
+        )
+        if not result or not result.get("ids") or not result["ids"][0]:
+            return None
+        # get() returns flat lists: ids, metadatas, documents are each list of items (one per record)
+        doc = (result["documents"][0] if result.get("documents") and result["documents"] else "")
+        return result["ids"][0], doc, result["metadatas"][0]
+
+    def get_by_roots(self, root_message_ids: list[str]) -> dict[str, tuple[str, str, dict]]:
+        if not root_message_ids:
+            return {}
+        result = self.collection.get(
+            where={"root_message_id": {"$in": list(root_message_ids)}},
+            include=["metadatas", "documents"],
+        )
+        found: dict[str, tuple[str, str, dict]] = {}
+        for id_, doc, meta in zip(result["ids"], result.get("documents") or [], result.get("metadatas") or []):
+            root = (meta or {}).get("root_message_id", "")
+            # Prefer the stable id when a legacy row of the same root is still around
+            if root not in found or id_ == record_id_for_root(root):
+                found[root] = (id_, doc or "", meta)
+        return found
+
+    def delete_by_root(self, root_message_id: str) -> None:
+        self.collection.delete(where={"root_message_id": root_message_id})
+        self._count_cache.clear()
+
+    def query(
+        self, query_embedding: list[float], top_k: int, chat_id: str | None = None
+    ) -> list[tuple[str, dict, float]]:
+        n = self.collection.count()
+        if n == 0 or top_k <= 0:
+            return []
+        return self._query(query_embedding, min(top_k, n), {"chat_id": chat_id} if chat_id else None)
+
+    def search(
+        self, query_embedding: list[float], top_k: int, chat_id: str | None = None
+    ) -> list[tuple[str, dict, float]]:
+        if top_k <= 0:
+            return []
+        in_chat = self._chat_count(chat_id) if chat_id else 0
+        if in_chat:
+            hits = self._query(query_embedding, min(top_k, in_chat), {"chat_id": chat_id})
+            if hits:
+                return hits
+            # Count was stale (rows removed by another process): fall through to the global search.
+        total = self._chat_count(None)
+        if total == 0:
+            return []
+        return self._query(query_embedding, min(top_k, total), None)
+
+    def _query(self, query_embedding: list[float], n_results: int, where: dict | None) -> list[tuple[str, dict, float]]:
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        if not results["ids"] or not results["ids"][0]:
+            return []
+        out: list[tuple[str, dict, float]] = []
+        for i, dist in enumerate(results["distances"][0]):
+            doc = results["documents"][0][i] if results["documents"][0] else ""
+            out.append((doc, results["metadatas"][0][i], _dist_to_score(dist)))
+        return out
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def rows(self) -> Iterator[tuple[str, str, dict]]:
+        offset = 0
+        while True:
+            page = self.collection.get(include=["documents", "metadatas"], limit=1000, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                return
+            yield from zip(ids, page.get("documents") or [""] * len(ids), page.get("metadatas") or [{}] * len(ids))
+            offset += len(ids)
+
+
+def create_store(backend: str) -> VectorStore:
+    """Build the VectorStore for a STORE_BACKEND name: chroma | numpy (file-backed) | memory."""
+    if backend == "chroma":
+        return ChromaVectorStore(CHROMA_PERSIST_DIR)
+    if backend in ("numpy", "memory"):
+        from .numpy_store import NumpyVectorStore
+        return NumpyVectorStore(NUMPY_STORE_PATH if backend == "numpy" else None)
+    raise ValueError(f"Unknown STORE_BACKEND {backend!r}; expected chroma, numpy or memory")
+
+
+def _partition_factory(backend: str):
+    """Per-chat partition constructor for a STORE_BACKEND name (see create_partitioned_store)."""
+    if backend == "chroma":
+        return lambda name: ChromaVectorStore(CHROMA_PERSIST_DIR, collection_name=f"{COLLECTION_NAME}__{name}")
+    if backend in ("numpy", "memory"):
+        from .numpy_store import NumpyVectorStore
+        if backend == "memory":
+            return lambda name: NumpyVectorStore(None)
+        parts_dir = NUMPY_STORE_PATH.parent / f"{NUMPY_STORE_PATH.name}_chats"
+        return lambda name: NumpyVectorStore(parts_dir / name)
+    raise ValueError(f"Unknown STORE_BACKEND {backend!r}; expected chroma, numpy or memory")
+
+
+def create_partitioned_store(
+    backend: str, global_index: bool = STORE_GLOBAL_INDEX, memory_mb: float = STORE_PARTITION_MEMORY_MB
+) -> VectorStore:
+    """One index per chat on the given backend, plus an all-chats index when global_index is set.
+
+    On first start, rows of the existing unpartitioned index are copied into their chat partitions.
+    Only numpy partitions are evicted over the memory budget: in-memory ones cannot be reloaded, and
+    Chroma ones share one client that keeps them loaded anyway.
+    """
+    from .partitioned_store import PartitionedVectorStore
+    persistent = backend != "memory"
+    global_store = create_store(backend) if global_index else None
+    pvs = PartitionedVectorStore(
+        _partition_factory(backend),
+        root_map_path=CHROMA_PERSIST_DIR / "partitions.sqlite3" if persistent else ":memory:",
+        global_index=global_store,
+        memory_budget_bytes=int(memory_mb * 1024 * 1024) if backend == "numpy" else None,
+    )
+    if persistent and pvs.needs_legacy_import():
+        legacy = global_store if global_store is not None else create_store(backend)
+        pvs.import_legacy_rows(legacy, embeddings.embed_many, STORE_BULK_EMBED_BATCH)
+    return pvs
+
+
+_store: VectorStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> VectorStore:
+    """The process-wide VectorStore (created from STORE_BACKEND / STORE_PARTITIONING on first use)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STORE_PARTITIONING == "chat":
+                    _store = create_partitioned_store(STORE_BACKEND)
+                else:
+                    _store = create_store(STORE_BACKEND)
+    return _store
+
+
+def set_store(store: VectorStore | None) -> None:
+    """Replace the process-wide VectorStore (e.g. an in-memory store for benchmarks); None resets it.
+
+    An injected store gets a fresh in-memory lexical index; None also resets that to the configured one.
+    """
+    global _store, _lexical
+    _store = store
+    _lexical = _bootstrap_lexical(BM25Index(), store) if store is not None and HYBRID_SEARCH else None
+
+
+_lexical: BM25Index | None = None
+_lexical_lock = threading.Lock()
+
+
+def get_lexical_index() -> BM25Index | None:
+    """The BM25 index kept next to the vector store (None when HYBRID_SEARCH is off)."""
+    global _lexical
+    if not HYBRID_SEARCH:
+        return None
+    if _lexical is None:
+        with _lexical_lock:
+            if _lexical is None:
+                index = BM25Index(None if STORE_BACKEND == "memory" else BM25_INDEX_PATH)
+                if not index.log_exists:
+                    _bootstrap_lexical(index, get_store())
+                _lexical = index
+    return _lexical
+
+
+def _bootstrap_lexical(index: BM25Index, vs: VectorStore) -> BM25Index:
+    """Index the store's existing rows (a new or missing BM25 log next to a populated store)."""
+    if vs.count() == 0:
+        return index
+    batch: list[tuple[str, str, str, str]] = []
+    for id_, doc, meta in vs.rows():
+        batch.append((id_, doc or "", (meta or {}).get("chat_id", ""), (meta or {}).get("root_message_id", "")))
+        if len(batch) >= 1000:
+            index.put_many(batch)
+            batch = []
+    index.put_many(batch)
+    logger.info("Built BM25 index from %d stored question(s)", len(index))
+    return index
+
+
+def warmup(query_embedding: list[float]) -> None:
+    """Open the store, run one query and load (or bootstrap) the BM25 index, so the first real search
+    does not pay for loading either."""
+    get_store().query(query_embedding, top_k=1)
+    get_lexical_index()
 
 
 def has_qa_for_root(root_message_id: str) -> bool:
     """Return True if we already have a Q&A record for this thread root."""
     if not root_message_id:
         return False
-    coll = _get_collection()
-    result = coll.get(where={"root_message_id": root_message_id}, limit=1)
-    return bool(result and result.get("ids"))
+    return get_store().get_by_root(root_message_id) is not None
 
 
 def get_qa_by_root(root_message_id: str) -> QARecord | None:
     """Return the Q&A record for this thread root, or None."""
     if not root_message_id:
         return None
-    coll = _get_collection()
-    result = coll.get(
-        where={"root_message_id": root_message_id},
-        limit=1,
-        include=["metadatas", "documents"],
-    )
-    if not result or not result.get("ids") or not result["ids"][0]:
+    hit = get_store().get_by_root(root_message_id)
+    if hit is None:
         return None
-    # get() returns flat lists: ids, metadatas, documents are each list of items (one per record)
-    meta = result["metadatas"][0]
-    doc = (result["documents"][0] if result.get("documents") and result["documents"] else "")
+    _id, doc, meta = hit
     return _metadata_to_record(meta, doc)
 
 
 def delete_by_root(root_message_id: str) -> None:
-    """Remove all Q&A records for this thread root (Chroma has no in-place update)."""
+    """Remove all Q&A records for this thread root."""
     if not root_message_id:
         return
-    coll = _get_collection()
-    coll.delete(where={"root_message_id": root_message_id})
+    get_store().delete_by_root(root_message_id)
+    lexical = get_lexical_index()
+    if lexical is not None:
+        lexical.delete_by_root(root_message_id)
+
+
+def record_id_for_root(root_message_id: str) -> str:
+    """Stable record id for a thread, so updates replace the row instead of adding a new one."""
+    return f"root:{root_message_id}"
+
+
+# Striped per-root locks: appends to the same thread run one at a time within this process.
+_ROOT_LOCKS = [threading.RLock() for _ in range(64)]
+
+
+def _root_lock(root_message_id: str) -> threading.RLock:
+    return _ROOT_LOCKS[hash(root_message_id) % len(_ROOT_LOCKS)]
+
+
+def upsert_qa(
+    question_text: str,
+    answer_text: str,
+    answerer_name: str,
+    answer_time: datetime | str,
+    chat_id: str,
+    root_message_id: str,
+    thread_id: str,
+    answerer_open_id: str | None = None,
+) -> None:
+    """Create or replace the Q&A for this thread root under its stable id.
+
+    The question is only re-embedded when its text changed; otherwise only metadata is rewritten.
+    A legacy row (random id from add_qa) for the root is migrated to the stable id.
+    """
+    meta = _record_metadata(
+        answer_text, answerer_name, answer_time, chat_id, root_message_id, thread_id, answerer_open_id
+    )
+    stable_id = record_id_for_root(root_message_id)
+    vs = get_store()
+    lexical = get_lexical_index()
+    with _root_lock(root_message_id):
+        hit = vs.get_by_root(root_message_id)
+        if hit is not None and hit[0] == stable_id and hit[1] == question_text:
+            vs.update_metadata([stable_id], [meta])
+        else:
+            vec = embeddings.embed(question_text)
+            if hit is not None and hit[0] != stable_id:
+                vs.delete_by_root(root_message_id)
+                if lexical is not None:
+                    lexical.delete_by_root(root_message_id)
+            vs.upsert([stable_id], [vec], [question_text], [meta])
+        if lexical is not None:
+            lexical.put(stable_id, question_text, chat_id, root_message_id)
 
 
 def append_reply_to_qa(
@@ -89,12 +445,21 @@ def append_reply_to_qa(
     answer_time: datetime | str,
     answerer_open_id: str | None = None,
 ) -> None:
-    """Append this reply to the Q&A for this root. Creates the record if first reply."""
-    existing = get_qa_by_root(root_id)
-    if existing is None:
-        add_qa(
+    """Append this reply to the Q&A for this root. Creates the record if first reply.
+
+    Runs under the root's lock and writes through upsert_qa, so concurrent replies cannot leave the
+    thread missing (no delete + add window) or duplicated (one stable id per root).
+    """
+    with _root_lock(root_id):
+        existing = get_qa_by_root(root_id)
+        if existing is None:
+            answer_text = new_reply_text.strip()
+        else:
+            answer_text = (existing.answer_text.strip() + THREAD_REPLY_DELIMITER + new_reply_text.strip()).strip()
+            question_text = question_text or existing.question_text
+        upsert_qa(
             question_text=question_text,
-            answer_text=new_reply_text.strip(),
+            answer_text=answer_text,
             answerer_name=answerer_name,
             answer_time=answer_time,
             chat_id=chat_id,
@@ -102,19 +467,31 @@ def append_reply_to_qa(
             thread_id=root_id,
             answerer_open_id=answerer_open_id,
         )
-        return
-    merged = (existing.answer_text.strip() + THREAD_REPLY_DELIMITER + new_reply_text.strip()).strip()
-    delete_by_root(root_id)
-    add_qa(
-        question_text=existing.question_text,
-        answer_text=merged,
-        answerer_name=answerer_name,
-        answer_time=answer_time,
-        chat_id=chat_id,
-        root_message_id=root_id,
-        thread_id=root_id,
-        answerer_open_id=answerer_open_id,
-    )
+
+
+def set_answer_summary(root_message_id: str, summary: str, answer_text: str) -> bool:
+    """Store the thread's answer_summary if its answer is still answer_text (the text that was summarized).
+
+    Returns False when the record is gone or got new replies meanwhile (those clear the summary).
+    """
+    vs = get_store()
+    with _root_lock(root_message_id):
+        hit = vs.get_by_root(root_message_id)
+        if hit is None or hit[2].get("answer_text") != answer_text[:10000]:
+            return False
+        meta = dict(hit[2])
+        meta["answer_summary"] = summary
+        vs.update_metadata([hit[0]], [meta])
+        return True
+
+
+def roots_missing_summary(min_chars: int) -> list[str]:
+    """Roots of threads with at least min_chars of answer and no answer_summary (e.g. written in bulk)."""
+    return [
+        meta["root_message_id"]
+        for _id, _doc, meta in get_store().rows()
+        if meta and len(meta.get("answer_text") or "") >= min_chars and not meta.get("answer_summary")
+    ]
 
 
 def add_qa(
@@ -128,9 +505,109 @@ def add_qa(
     answerer_open_id: str | None = None,
 ) -> None:
     """Index one Q&A pair."""
-    coll = _get_collection()
     vec = embeddings.embed(question_text)
     id_ = str(uuid.uuid4())
+    meta = _record_metadata(
+        answer_text, answerer_name, answer_time, chat_id, root_message_id, thread_id, answerer_open_id
+    )
+    get_store().add([id_], [vec], [question_text], [meta])
+    lexical = get_lexical_index()
+    if lexical is not None:
+        lexical.put(id_, question_text, chat_id, root_message_id)
+
+
+def add_qa_many(
+    records: Iterable[QARecord],
+    *,
+    embed_batch_size: int = STORE_BULK_EMBED_BATCH,
+    write_chunk_size: int = STORE_BULK_WRITE_CHUNK,
+    progress: Callable[[int, int], None] | None = None,
+) -> list[QARecord]:
+    """Index many Q&A pairs; returns the records that were added or updated.
+
+    One record per root_message_id: later duplicates in `records` and records without a root are
+    skipped. Existing roots are looked up with one get_by_roots() per chunk: unchanged ones are
+    skipped, ones whose answer text changed are rewritten (metadata only when the question is the
+    same). Questions are embedded embed_batch_size at a time and rows written write_chunk_size per
+    store call, under each root's stable id. progress(done, total) is called after every chunk.
+    """
+    unique: dict[str, QARecord] = {}
+    skipped = 0
+    for rec in records:
+        if not rec.root_message_id or rec.root_message_id in unique:
+            skipped += 1
+            continue
+        unique[rec.root_message_id] = rec
+    if skipped:
+        logger.info("Bulk add: skipped %d duplicate or rootless record(s)", skipped)
+    vs = get_store()
+    lexical = get_lexical_index()
+    embed_batch_size = max(1, embed_batch_size)
+    pending = list(unique.values())
+    written: list[QARecord] = []
+    unchanged = 0
+    for start in range(0, len(pending), max(1, write_chunk_size)):
+        chunk = pending[start:start + max(1, write_chunk_size)]
+        existing = vs.get_by_roots([rec.root_message_id for rec in chunk])
+        to_embed: list[tuple[QARecord, dict]] = []
+        meta_only: list[tuple[str, dict]] = []
+        for rec in chunk:
+            meta = _record_metadata(
+                rec.answer_text,
+                rec.answerer_name,
+                rec.answer_time,
+                rec.chat_id,
+                rec.root_message_id,
+                rec.thread_id,
+                rec.answerer_open_id,
+            )
+            hit = existing.get(rec.root_message_id)
+            stable_id = record_id_for_root(rec.root_message_id)
+            if hit is None:
+                to_embed.append((rec, meta))
+            elif hit[2].get("answer_text") == meta["answer_text"]:
+                unchanged += 1
+                continue
+            elif hit[0] == stable_id and hit[1] == rec.question_text:
+                meta_only.append((stable_id, meta))
+            else:
+                # Legacy random-id row or a new question text: replace the row under the stable id
+                vs.delete_by_root(rec.root_message_id)
+                if lexical is not None:
+                    lexical.delete_by_root(rec.root_message_id)
+                to_embed.append((rec, meta))
+            written.append(rec)
+        if meta_only:
+            vs.update_metadata([id_ for id_, _ in meta_only], [meta for _, meta in meta_only])
+        if to_embed:
+            questions = [rec.question_text for rec, _ in to_embed]
+            vectors: list[list[float]] = []
+            for i in range(0, len(questions), embed_batch_size):
+                vectors.extend(embeddings.embed_many(questions[i:i + embed_batch_size]))
+            ids = [record_id_for_root(rec.root_message_id) for rec, _ in to_embed]
+            # upsert, not add: a live reply may have created the same stable id since the lookup above
+            vs.upsert(ids, vectors, questions, [meta for _, meta in to_embed])
+            if lexical is not None:
+                lexical.put_many(
+                    [(id_, rec.question_text, rec.chat_id, rec.root_message_id) for id_, (rec, _) in zip(ids, to_embed)]
+                )
+        if progress is not None:
+            progress(start + len(chunk), len(pending))
+    if unchanged:
+        logger.info("Bulk add: %d record(s) already indexed unchanged", unchanged)
+    return written
+
+
+def _record_metadata(
+    answer_text: str,
+    answerer_name: str,
+    answer_time: datetime | str,
+    chat_id: str,
+    root_message_id: str,
+    thread_id: str,
+    answerer_open_id: str | None = None,
+) -> dict:
+    """Metadata stored next to the question embedding (inverse of _metadata_to_record)."""
     meta = {
         "answer_text": answer_text[:10000],
         "answerer_name": answerer_name,
@@ -141,12 +618,7 @@ def add_qa(
     }
     if answerer_open_id:
         meta["answerer_open_id"] = answerer_open_id
-    coll.add(
-        ids=[id_],
-        embeddings=[vec],
-        documents=[question_text],
-        metadatas=[meta],
-    )
+    return meta
 
 
 def _dist_to_score(dist: float) -> float:
@@ -168,6 +640,7 @@ def _metadata_to_record(meta: dict, document: str) -> QARecord:
         root_message_id=meta["root_message_id"],
         thread_id=meta["thread_id"],
         answerer_open_id=meta.get("answerer_open_id") or None,
+        answer_summary=meta.get("answer_summary") or None,
     )
 
 
@@ -176,36 +649,70 @@ def find_similar_questions(
     chat_id: str | None = None,
     top_k: int = 5,
     min_score: float | None = None,
+    query_text: str | None = None,
 ) -> list[tuple[QARecord, float]]:
-    """Return all Q&A records with score >= min_score, up to top_k, (record, score) pairs."""
+    """Return all Q&A records with score >= min_score, up to top_k, (record, score) pairs.
+
+    Ranking: best score first. Scope: when chat_id has any indexed Q&A, only that chat's records are
+    candidates (a chat with records but no match above min_score returns []); a chat with no records
+    falls back to all chats. Resolved by one VectorStore.search call.
+
+    With query_text and HYBRID_SEARCH on, BM25 matches of the text are fused with the vector hits
+    (see _hybrid_search): a strong lexical match qualifies below min_score, and ranking is by fused
+    rank. Scores stay cosine similarities.
+    """
     if min_score is None:
         min_score = SIMILARITY_THRESHOLD
-    coll = _get_collection()
-    n = coll.count()
-    if n == 0:
-        return []
-    results = {"ids": [[]], "metadatas": [[]], "distances": [[]], "documents": [[]]}
-    for where_filter in [{"chat_id": chat_id} if chat_id else None, None]:
-        part = coll.query(
-            query_embeddings=[query_embedding],
-            n_results=min(top_k, n),
-            where=where_filter,
-            include=["documents", "metadatas", "distances"],
-        )
-        if part["ids"] and part["ids"][0]:
-            results = part
-            break
-    if not results["ids"] or not results["ids"][0]:
-        return []
-    out: list[tuple[QARecord, float]] = []
-    for i, dist in enumerate(results["distances"][0]):
-        score = _dist_to_score(dist)
-        if score < min_score:
-            continue
-        meta = results["metadatas"][0][i]
-        doc = results["documents"][0][i] if results["documents"][0] else ""
-        out.append((_metadata_to_record(meta, doc), score))
-    return out
+    lexical = get_lexical_index() if query_text else None
+    if lexical is not None:
+        return _hybrid_search(query_embedding, query_text, chat_id, top_k, min_score, lexical)
+    hits = get_store().search(query_embedding, top_k, chat_id=chat_id)
+    return [(_metadata_to_record(meta, doc), score) for doc, meta, score in hits if score >= min_score]
+
+
+def _hybrid_search(
+    query_embedding: list[float],
+    query_text: str,
+    chat_id: str | None,
+    top_k: int,
+    min_score: float,
+    lexical: BM25Index,
+) -> list[tuple[QARecord, float]]:
+    """Reciprocal-rank fusion of vector hits (>= min_score) and BM25 hits, one result per thread root.
+
+    Both lists are widened to top_k * HYBRID_CANDIDATE_MULTIPLIER before fusing. Lexical-only hits
+    are scored by cosine against their (usually cached) question embedding and must still reach
+    min(min_score, HYBRID_LEXICAL_MIN_SCORE): shared tokens alone never make an unrelated thread a match.
+    """
+    pool = top_k * HYBRID_CANDIDATE_MULTIPLIER
+    vs = get_store()
+    rows: dict[str, tuple[str, dict, float]] = {}
+    fused: dict[str, float] = {}
+    vector_hits = [h for h in vs.search(query_embedding, pool, chat_id=chat_id) if h[2] >= min_score]
+    for rank, (doc, meta, score) in enumerate(vector_hits):
+        root = meta["root_message_id"]
+        if root not in rows:
+            rows[root] = (doc, meta, score)
+            fused[root] = 1.0 / (HYBRID_RRF_K + rank + 1)
+    lexical_hits = lexical.search(query_text, pool, chat_id=chat_id, min_coverage=HYBRID_MIN_TERM_COVERAGE)
+    for rank, (_id, root, _bm25) in enumerate(lexical_hits):
+        fused[root] = fused.get(root, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+
+    missing = []
+    for root in fused:
+        if root not in rows:
+            hit = vs.get_by_root(root)
+            if hit is not None:
+                missing.append((root, hit[1], hit[2]))
+    if missing:
+        floor = min(min_score, HYBRID_LEXICAL_MIN_SCORE)
+        vectors = embeddings.embed_many([doc for _, doc, _ in missing])
+        for (root, doc, meta), vec in zip(missing, vectors):
+            score = float(sum(a * b for a, b in zip(query_embedding, vec)))
+            if score >= floor:
+                rows[root] = (doc, meta, score)
+    ranked = sorted((r for r in fused if r in rows), key=lambda r: -fused[r])[:top_k]
+    return [(_metadata_to_record(rows[root][1], rows[root][0]), rows[root][2]) for root in ranked]
 
 
 def pick_best_candidate(
@@ -234,10 +741,11 @@ def find_similar_question(
     chat_id: str | None = None,
     top_k: int = 1,
     min_score: float | None = None,
+    query_text: str | None = None,
 ) -> QARecord | None:
     """Return the best matching Q&A if score >= min_score, else None (backward compatible)."""
     candidates = find_similar_questions(
-        query_embedding, chat_id=chat_id, top_k=max(1, top_k), min_score=min_score
+        query_embedding, chat_id=chat_id, top_k=max(1, top_k), min_score=min_score, query_text=query_text
     )
     if not candidates:
         return None
@@ -0,0 +1,189 @@
+"""Cache of LLM summaries keyed by candidate set, reused for near-duplicate questions."""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .config import (
+    LLM_MODEL,
+    SUMMARY_CACHE_ENABLED,
+    SUMMARY_CACHE_MAX_ITEMS,
+    SUMMARY_CACHE_PATH,
+    SUMMARY_CACHE_SIMILARITY,
+    SUMMARY_CACHE_TTL_SECONDS,
+)
+from .store import QARecord
+
+logger = logging.getLogger(__name__)
+
+
+def content_version(rec: QARecord) -> str:
+    """Short hash of what the LLM sees of a record; changes when the thread gets a new reply."""
+    text = f"{rec.question_text}\0{rec.answer_text}\0{rec.answer_summary or ''}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def candidate_set_key(candidates: list[tuple[QARecord, float]], model: str = LLM_MODEL) -> str:
+    """Order-independent key of the candidate records and their content versions (and the LLM model)."""
+    members = sorted(f"{rec.root_message_id}:{content_version(rec)}" for rec, _ in candidates)
+    return hashlib.sha256("\0".join([model, *members]).encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """SQLite-backed summaries per candidate set.
+
+    A set can hold summaries for several phrasings; get() returns one whose question embedding is at
+    least `similarity` cosine to the new question. Entries expire after ttl_seconds and the least
+    recently used are evicted beyond max_items. invalidate_root() drops every entry citing a thread.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        *,
+        ttl_seconds: float = 604800.0,
+        max_items: int = 5000,
+        similarity: float = 0.92,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max(1, max_items)
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (id INTEGER PRIMARY KEY, set_key TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, summary TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summaries_set ON summaries(set_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries(last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summary_roots (summary_id INTEGER NOT NULL, root_message_id TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summary_roots_root ON summary_roots(root_message_id)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_embedding: list[float], candidates: list[tuple[QARecord, float]]) -> str | None:
+        """Cached summary for this candidate set and a near-duplicate question, or None."""
+        key = candidate_set_key(candidates)
+        q = np.asarray(query_embedding, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, embedding, summary FROM summaries WHERE set_key = ? AND created > ?",
+                    (key, now - self.ttl_seconds),
+                ).fetchall()
+                best = None
+                for id_, blob, summary in rows:
+                    score = float(np.frombuffer(blob, dtype=np.float32) @ q)
+                    if score >= self.similarity and (best is None or score > best[0]):
+                        best = (score, id_, summary)
+                if best is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute("UPDATE summaries SET last_used = ? WHERE id = ?", (now, best[1]))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Summary cache read failed: %s", e)
+                return None
+        self.hits += 1
+        return best[2]
+
+    def put(self, query_embedding: list[float], candidates: list[tuple[QARecord, float]], summary: str) -> None:
+        """Store the summary for this question and candidate set; evicts expired and overflowing rows."""
+        key = candidate_set_key(candidates)
+        blob = np.asarray(query_embedding, dtype=np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            try:
+                cur = self._conn.execute(
+                    "INSERT INTO summaries (set_key, embedding, summary, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, summary, now, now),
+                )
+                roots = {rec.root_message_id for rec, _ in candidates}
+                self._conn.executemany(
+                    "INSERT INTO summary_roots (summary_id, root_message_id) VALUES (?, ?)",
+                    [(cur.lastrowid, root) for root in roots],
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Summary cache write failed: %s", e)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM summaries WHERE created <= ?", (now - self.ttl_seconds,))
+        overflow = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0] - self.max_items
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM summaries WHERE id IN (SELECT id FROM summaries ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+        self._conn.execute("DELETE FROM summary_roots WHERE summary_id NOT IN (SELECT id FROM summaries)")
+
+    def invalidate_root(self, root_message_id: str) -> int:
+        """Drop summaries that cite this thread; returns how many."""
+        with self._lock:
+            try:
+                ids = [
+                    r[0]
+                    for r in self._conn.execute(
+                        "SELECT summary_id FROM summary_roots WHERE root_message_id = ?", (root_message_id,)
+                    )
+                ]
+                if not ids:
+                    return 0
+                marks = ",".join("?" * len(ids))
+                self._conn.execute(f"DELETE FROM summaries WHERE id IN ({marks})", ids)
+                self._conn.execute(f"DELETE FROM summary_roots WHERE summary_id IN ({marks})", ids)
+                self._conn.commit()
+                return len(ids)
+            except sqlite3.Error as e:
+                logger.warning("Summary cache invalidation failed: %s", e)
+                return 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: SummaryCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> SummaryCache | None:
+    """Lazy-open the summary cache (None when SUMMARY_CACHE_ENABLED is off)."""
+    global _cache
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SummaryCache(
+                    SUMMARY_CACHE_PATH,
+                    ttl_seconds=SUMMARY_CACHE_TTL_SECONDS,
+                    max_items=SUMMARY_CACHE_MAX_ITEMS,
+                    similarity=SUMMARY_CACHE_SIMILARITY,
+                )
+    return _cache
+
+
+def invalidate_root(root_message_id: str) -> None:
+    """Drop cached summaries citing this thread (called when it gets new replies)."""
+    cache = get_cache()
+    if cache is not None:
+        n = cache.invalidate_root(root_message_id)
+        if n:
+            logger.info("Invalidated %d cached summar%s for root_id=%s", n, "y" if n == 1 else "ies", root_message_id)
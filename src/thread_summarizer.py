@@ -0,0 +1,87 @@
+"""Debounced per-thread jobs: run a handler for a root once its thread has been quiet for a while."""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class QuietThreadScheduler:
+    """Call handler(root_id) quiet_seconds after the last touch(root_id).
+
+    Every touch pushes the root's deadline back, so a busy thread is handled once, after its last reply.
+    One scheduler thread waits on a heap of deadlines; at most max_concurrency handlers run at a time.
+    At most max_pending roots wait at once; touches of new roots beyond that are dropped.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], None],
+        quiet_seconds: float,
+        max_concurrency: int = 2,
+        max_pending: int = 10000,
+    ) -> None:
+        self._handler = handler
+        self._quiet = max(0.0, quiet_seconds)
+        self._max_concurrency = max(1, max_concurrency)
+        self._max_pending = max(1, max_pending)
+        self._cond = threading.Condition()
+        self._due: dict[str, float] = {}  # root -> current deadline
+        self._heap: list[tuple[float, int, str]] = []  # may hold superseded deadlines; skipped when popped
+        self._seq = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._pool: ThreadPoolExecutor | None = None
+
+    def touch(self, root_id: str) -> None:
+        with self._cond:
+            if root_id not in self._due and len(self._due) >= self._max_pending:
+                logger.warning("Thread scheduler full (%d roots); dropping root_id=%s", self._max_pending, root_id)
+                return
+            due = time.monotonic() + self._quiet
+            self._due[root_id] = due
+            heapq.heappush(self._heap, (due, next(self._seq), root_id))
+            if len(self._heap) > 2 * len(self._due) + 64:
+                self._heap = [(d, next(self._seq), r) for r, d in self._due.items()]
+                heapq.heapify(self._heap)
+            if self._thread is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._max_concurrency, thread_name_prefix="thread-job")
+                self._thread = threading.Thread(target=self._run, name="thread-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                _, _, root_id = heapq.heappop(self._heap)
+                del self._due[root_id]
+            self._pool.submit(self._fire, root_id)
+
+    def _fire(self, root_id: str) -> None:
+        try:
+            self._handler(root_id)
+        except Exception as e:
+            logger.exception("Thread job failed for root_id=%s: %s", root_id, e)
+
+    def pending(self) -> int:
+        """Number of roots waiting for their thread to go quiet."""
+        with self._cond:
+            return len(self._due)
+
+    def cancel_all(self) -> None:
+        with self._cond:
+            self._due.clear()
+            self._heap.clear()
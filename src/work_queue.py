@@ -0,0 +1,147 @@
+"""Bounded priority work queue with a fixed worker pool: answers go ahead of reply indexing."""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first.
+PRIORITY_ANSWER = 0
+PRIORITY_INDEX = 1
+PRIORITY_NAMES = {PRIORITY_ANSWER: "answer", PRIORITY_INDEX: "index"}
+
+
+class WorkShed(Exception):
+    """A queued job was dropped to make room for higher-priority work."""
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    fn: Callable[..., Any] = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict = field(compare=False)
+    future: Future = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+class WorkQueue:
+    """At most max_size jobs wait; `workers` threads run them in (priority, arrival) order.
+
+    Low-priority jobs are only admitted while the queue is below low_priority_share of max_size, so
+    answers keep headroom. When the queue is full, an answer evicts the newest queued lower-priority
+    job (its future fails with WorkShed); if there is none, the answer itself is rejected.
+    """
+
+    def __init__(self, workers: int, max_size: int, *, low_priority_share: float = 0.8, name: str = "work") -> None:
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.low_priority_limit = max(1, int(self.max_size * low_priority_share))
+        self.name = name
+        self._cond = threading.Condition()
+        self._heap: list[_Job] = []
+        self._seq = itertools.count()
+        self._threads: list[threading.Thread] = []
+        self._running = 0
+        self._waits: dict[int, deque] = {p: deque(maxlen=1000) for p in PRIORITY_NAMES}
+        self._counts: dict[str, dict[int, int]] = {
+            k: dict.fromkeys(PRIORITY_NAMES, 0) for k in ("submitted", "completed", "rejected", "shed")
+        }
+
+    def submit(self, priority: int, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future | None:
+        """Queue fn(*args, **kwargs); returns its Future, or None when the queue has no room for it."""
+        with self._cond:
+            self._start_workers()
+            limit = self.max_size if priority == PRIORITY_ANSWER else self.low_priority_limit
+            if len(self._heap) >= limit and not (priority == PRIORITY_ANSWER and self._shed_one(priority)):
+                self._counts["rejected"][priority] += 1
+                logger.warning(
+                    "%s queue saturated (%d queued): rejected %s job", self.name, len(self._heap), PRIORITY_NAMES[priority]
+                )
+                return None
+            job = _Job(priority, next(self._seq), fn, args, kwargs, Future(), time.monotonic())
+            heapq.heappush(self._heap, job)
+            self._counts["submitted"][priority] += 1
+            self._cond.notify()
+            return job.future
+
+    def _shed_one(self, priority: int) -> bool:
+        victims = [j for j in self._heap if j.priority > priority]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda j: (j.priority, j.seq))
+        self._heap.remove(victim)
+        heapq.heapify(self._heap)
+        self._counts["shed"][victim.priority] += 1
+        victim.future.set_exception(WorkShed(f"shed from {self.name} queue"))
+        return True
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                job = heapq.heappop(self._heap)
+                self._running += 1
+                self._waits[job.priority].append(time.monotonic() - job.enqueued)
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    try:
+                        job.future.set_result(job.fn(*job.args, **job.kwargs))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._counts["completed"][job.priority] += 1
+                    self._cond.notify_all()
+
+    def depth(self) -> int:
+        """Jobs waiting (not yet running)."""
+        with self._cond:
+            return len(self._heap)
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Wait until nothing is queued or running; False if timeout ran out first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self) -> dict:
+        """Queue depth, running jobs, and per-priority counters and wait times (seconds, recent jobs)."""
+        with self._cond:
+            by_priority = {}
+            for p, pname in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[p])
+                by_priority[pname] = {
+                    "queued": sum(1 for j in self._heap if j.priority == p),
+                    **{k: v[p] for k, v in self._counts.items()},
+                    "wait_p50": round(waits[len(waits) // 2], 4) if waits else 0.0,
+                    "wait_p95": round(waits[int(len(waits) * 0.95)], 4) if waits else 0.0,
+                    "wait_max": round(waits[-1], 4) if waits else 0.0,
+                }
+            return {
+                "depth": len(self._heap),
+                "running": self._running,
+                "workers": self.workers,
+                "max_size": self.max_size,
+                "priorities": by_priority,
+            }
@@ -8,14 +8,26 @@ import pytest
 
 
 @pytest.fixture(autouse=True)
-def reset_store_collection():
-    """Reset the store's global collection so tests use fresh Chroma."""
-    import src.store as store_mod
+def reset_store_collection(monkeypatch, tmp_path):
+    """Reset the store's global VectorStore so tests use a fresh one (Chroma unless a test injects another).
 
-    old = getattr(store_mod, "_collection", None)
-    store_mod._collection = None
+    The BM25 index, the embedding cache and the LLM summary cache are reset too and persisted under
+    the test's tmp_path.
+    """
+    import src.embeddings as embeddings_mod
+    import src.store as store_mod
+    import src.summary_cache as summary_cache_mod
+
+    old = getattr(store_mod, "_store", None)
+    store_mod._store = None
+    monkeypatch.setattr(store_mod, "_lexical", None)
+    monkeypatch.setattr(store_mod, "BM25_INDEX_PATH", tmp_path / "bm25.jsonl")
+    monkeypatch.setattr(embeddings_mod, "_cache", None)
+    monkeypatch.setattr(embeddings_mod, "EMBED_CACHE_PATH", tmp_path / "embedding_cache.sqlite3")
+    monkeypatch.setattr(summary_cache_mod, "_cache", None)
+    monkeypatch.setattr(summary_cache_mod, "SUMMARY_CACHE_PATH", tmp_path / "summary_cache.sqlite3")
     yield
-    store_mod._collection = old
+    store_mod._store = old
 
 
 @pytest.fixture
@@ -0,0 +1,85 @@
+"""Tests for the LLM answer summarizer (OpenAI client mocked)."""
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+import src.answer_summarizer as summarizer
+import src.summary_cache as summary_cache_mod
+from src.store import QARecord
+
+
+def _rec(root: str) -> QARecord:
+    return QARecord(f"question {root}", "answer", "Alice", "2024-02-13T00:00:00", "oc_1", root, root)
+
+
+def _event(text: str | None) -> MagicMock:
+    return MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+
+
+@pytest.fixture
+def client(monkeypatch) -> MagicMock:
+    client = MagicMock()
+    monkeypatch.setattr(summarizer, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(summarizer, "OpenAI", MagicMock(return_value=client))
+    return client
+
+
+def test_stream_yields_chunks_and_caches_result(client, monkeypatch) -> None:
+    monkeypatch.setattr(summary_cache_mod, "SUMMARY_CACHE_ENABLED", True)
+    client.chat.completions.create.return_value = iter([_event("Use "), _event(None), _event("VPN.")])
+    candidates = [(_rec("r1"), 0.9)]
+
+    assert list(summarizer.summarize_answer_stream("How?", candidates, query_embedding=[1.0, 0.0])) == ["Use ", "VPN."]
+    assert client.chat.completions.create.call_args.kwargs["stream"] is True
+    assert list(summarizer.summarize_answer_stream("How?", candidates, query_embedding=[1.0, 0.0])) == ["Use VPN."]
+    assert client.chat.completions.create.call_count == 1
+
+
+def test_stream_without_key_raises_before_iterating(monkeypatch) -> None:
+    monkeypatch.setattr(summarizer, "OPENAI_API_KEY", None)
+    with pytest.raises(ValueError):
+        summarizer.summarize_answer_stream("How?", [(_rec("r1"), 0.9)])
+
+
+@pytest.fixture
+def async_client(monkeypatch) -> MagicMock:
+    client = MagicMock()
+    monkeypatch.setattr(summarizer, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(summarizer, "_async_client_instance", client)
+    return client
+
+
+async def test_async_stream_yields_chunks_and_caches_result(async_client, monkeypatch) -> None:
+    monkeypatch.setattr(summary_cache_mod, "SUMMARY_CACHE_ENABLED", True)
+
+    async def events():
+        for text in ("Use ", None, "VPN."):
+            yield _event(text)
+
+    async def create(**kwargs):
+        return events()
+
+    async_client.chat.completions.create = MagicMock(side_effect=create)
+    candidates = [(_rec("r1"), 0.9)]
+
+    chunks = [c async for c in summarizer.asummarize_answer_stream("How?", candidates, query_embedding=[1.0, 0.0])]
+    assert chunks == ["Use ", "VPN."]
+    assert async_client.chat.completions.create.call_args.kwargs["stream"] is True
+    assert await summarizer.asummarize_answer("How?", candidates, query_embedding=[1.0, 0.0]) == "Use VPN."
+    assert async_client.chat.completions.create.call_count == 1
+
+
+async def test_async_summary_does_cache_and_token_work_off_the_event_loop(async_client, monkeypatch) -> None:
+    loop_thread = threading.get_ident()
+    seen: list[int] = []
+    real_cached, real_messages = summarizer._cached_summary, summarizer._summary_messages
+    monkeypatch.setattr(summarizer, "_cached_summary", lambda *a: (seen.append(threading.get_ident()), real_cached(*a))[1])
+    monkeypatch.setattr(summarizer, "_summary_messages", lambda *a: (seen.append(threading.get_ident()), real_messages(*a))[1])
+
+    async def create(**kwargs):
+        return MagicMock(choices=[MagicMock(message=MagicMock(content="Use VPN."))], usage=None)
+
+    async_client.chat.completions.create = MagicMock(side_effect=create)
+    assert await summarizer.asummarize_answer("How?", [(_rec("r1"), 0.9)], query_embedding=[1.0, 0.0]) == "Use VPN."
+    assert len(seen) == 2 and loop_thread not in seen
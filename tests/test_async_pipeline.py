@@ -0,0 +1,179 @@
+"""Tests for the async pipeline."""
+import threading
+from unittest.mock import DEFAULT, MagicMock
+
+import pytest
+
+from src import async_pipeline
+from src import formatter as real_formatter
+from src.pipeline import DONT_KNOW_REPLY, STREAM_PLACEHOLDER
+
+
+class AsyncStubLark:
+    """Async stand-in for lark_client: records sent messages and applies in-place edits."""
+
+    def __init__(self) -> None:
+        self.messages: dict[str, str] = {}
+        self.edits: list[tuple[str, str]] = []
+
+    def build_thread_link(self, chat_id: str, message_id: str) -> str:
+        return f"https://example.test/{chat_id}/{message_id}"
+
+    async def asend_text_message(self, chat_id, text, *, root_id=None, post_content=None):
+        message_id = f"om_bot_{len(self.messages)}"
+        self.messages[message_id] = text
+        return message_id
+
+    async def aupdate_message(self, message_id, text, *, post_content=None) -> bool:
+        self.messages[message_id] = text
+        self.edits.append((message_id, text))
+        return True
+
+
+@pytest.fixture
+def deps(monkeypatch):
+    """Mock store and embeddings; record which threads embed and search run on."""
+    threads: dict[str, str] = {}
+    mock_store = MagicMock()
+    mock_store.find_similar_question.return_value = None
+
+    def record_search_thread(*args, **kwargs):
+        threads["search"] = threading.current_thread().name
+        return DEFAULT
+
+    mock_store.find_similar_question.side_effect = record_search_thread
+    mock_store.find_similar_questions.return_value = []
+
+    def fake_embed(text):
+        threads["embed"] = threading.current_thread().name
+        return [0.1] * 384
+
+    lark = AsyncStubLark()
+    monkeypatch.setattr("src.pipeline.store", mock_store)
+    monkeypatch.setattr("src.async_pipeline.embeddings.embed", fake_embed)
+    monkeypatch.setattr("src.pipeline.lark_client", lark)
+    monkeypatch.setattr("src.async_pipeline.lark_client", lark)
+    monkeypatch.setattr("src.pipeline.ANSWERED_ONCE_CHAT_IDS", [])
+    monkeypatch.setattr("src.pipeline.RERANK_ENABLED", False)
+    monkeypatch.setattr("src.async_pipeline.ANSWER_MODE", "top_1")
+    return mock_store, lark, threads
+
+
+def _record(**kwargs):
+    fields = dict(
+        chat_id="oc_1",
+        root_message_id="om_root",
+        answer_text="Run make deploy.",
+        answer_summary=None,
+        answerer_name="Alice",
+        answerer_open_id="ou_alice",
+        answer_time="2024-01-01 10:00",
+    )
+    fields.update(kwargs)
+    return MagicMock(**fields)
+
+
+async def test_skips_non_question(deps) -> None:
+    _, lark, threads = deps
+    await async_pipeline.handle_message("oc_1", "om_1", "Hello world", "ou_1")
+    assert lark.messages == {}
+    assert threads == {}
+
+
+async def test_top_1_embeds_and_searches_off_the_event_loop(deps) -> None:
+    mock_store, lark, threads = deps
+    mock_store.find_similar_question.return_value = _record()
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+
+    assert threads["embed"].startswith("answer-cpu")
+    assert threads["search"].startswith("answer-cpu")
+    (text,) = lark.messages.values()
+    assert "Run make deploy." in text
+
+
+async def test_top_1_no_match_sends_dont_know(deps) -> None:
+    _, lark, _ = deps
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+    assert list(lark.messages.values()) == [DONT_KNOW_REPLY]
+
+
+@pytest.fixture
+def llm_mode(deps, monkeypatch):
+    mock_store, lark, _ = deps
+    monkeypatch.setattr("src.async_pipeline.ANSWER_MODE", "llm_summarize")
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAM_UPDATE_MS", 0.0)
+    monkeypatch.setattr("src.pipeline.formatter", real_formatter)
+    mock_store.find_similar_questions.return_value = [(_record(), 0.9)]
+    return lark
+
+
+async def test_llm_non_streaming_uses_async_summarizer(llm_mode, monkeypatch) -> None:
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAMING", False)
+
+    async def fake_summary(question, candidates, query_embedding=None):
+        return "Use make deploy."
+
+    monkeypatch.setattr("src.answer_summarizer.asummarize_answer", fake_summary)
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+    (text,) = llm_mode.messages.values()
+    assert "Use make deploy." in text
+
+
+async def test_llm_streaming_edits_placeholder_in_place(llm_mode, monkeypatch) -> None:
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAMING", True)
+    seen_at_first_chunk = {}
+
+    def fake_stream(question, candidates, query_embedding=None):
+        async def gen():
+            seen_at_first_chunk.update(llm_mode.messages)
+            yield "Restart "
+            yield "the runner."
+        return gen()
+
+    monkeypatch.setattr("src.answer_summarizer.asummarize_answer_stream", fake_stream)
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+
+    assert list(llm_mode.messages) == ["om_bot_0"]
+    assert STREAM_PLACEHOLDER in seen_at_first_chunk["om_bot_0"]
+    assert "Restart the runner." in llm_mode.messages["om_bot_0"]
+
+
+async def test_llm_streaming_error_midway_replaces_partial_summary(llm_mode, monkeypatch) -> None:
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAMING", True)
+
+    def dies_midway(question, candidates, query_embedding=None):
+        async def gen():
+            yield "Restart "
+            raise RuntimeError("connection reset")
+        return gen()
+
+    monkeypatch.setattr("src.answer_summarizer.asummarize_answer_stream", dies_midway)
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+    assert "Restart" in llm_mode.edits[0][1]
+    assert llm_mode.messages == {"om_bot_0": DONT_KNOW_REPLY}
+
+
+async def test_llm_streaming_without_key_falls_back_to_best_candidate(llm_mode, monkeypatch) -> None:
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAMING", True)
+    monkeypatch.setattr("src.answer_summarizer.OPENAI_API_KEY", None)
+    monkeypatch.setattr("src.async_pipeline.store.pick_best_candidate", lambda candidates, policy: candidates[0][0])
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+    (text,) = llm_mode.messages.values()
+    assert "Run make deploy." in text
+    assert llm_mode.edits == []
+
+
+async def test_llm_streaming_skips_edits_that_do_not_change_the_reply(llm_mode, monkeypatch) -> None:
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAMING", True)
+    monkeypatch.setattr("src.async_pipeline.LLM_STREAM_MAX_EDITS", 1000)
+
+    def fake_stream(question, candidates, query_embedding=None):
+        async def gen():
+            for i in range(200):
+                yield f"word{i:03d} "
+        return gen()
+
+    monkeypatch.setattr("src.answer_summarizer.asummarize_answer_stream", fake_stream)
+    await async_pipeline.handle_message("oc_1", "om_1", "How do I deploy?", "ou_1")
+    texts = [text for _, text in llm_mode.edits]
+    assert len(texts) == len(set(texts)) and len(texts) < 70
@@ -0,0 +1,161 @@
+"""Tests for the staged, checkpointed backfill in scripts/backfill.py."""
+import json
+import threading
+
+import pytest
+
+from scripts import backfill
+from src import store
+from src.store import create_store, get_qa_by_root, record_id_for_root
+
+HOUR_MS = 3600 * 1000
+
+
+def _msg(message_id: str, t_hours: float, text: str, root_id: str = "", sender: str = "ou_1") -> dict:
+    return {
+        "message_id": message_id,
+        "root_id": root_id,
+        "content": json.dumps({"text": text}),
+        "sender_id": sender,
+        "create_time": str(int(t_hours * HOUR_MS)),
+    }
+
+
+# Oldest first, as Lark returns them. Thread A settles long before the end; thread B is last.
+HISTORY = [
+    _msg("om_a", 1, "How do I deploy?"),
+    _msg("om_a1", 2, "Run the deploy script", root_id="om_a"),
+    _msg("om_x", 3, "Lunch is here"),
+    _msg("om_x1", 4, "thanks", root_id="om_x"),
+    _msg("om_a2", 5, "then check the dashboard", root_id="om_a", sender="ou_2"),
+    _msg("om_b", 100, "Where are the logs?"),
+    _msg("om_b1", 101, "In the logs bucket", root_id="om_b"),
+    _msg("om_c", 200, "Who owns billing?"),
+]
+
+
+class FakeHistory:
+    """iter_message_pages stand-in serving HISTORY per chat (page_token = offset), optionally failing once."""
+
+    def __init__(self, page_size: int = 2, fail_at_page: int | None = None) -> None:
+        self.page_size = page_size
+        self.fail_at_page = fail_at_page
+        self.calls: list[dict] = []
+
+    def __call__(self, chat_id, *, start_time=None, end_time=None, page_token=None, **kwargs):
+        self.calls.append({"chat_id": chat_id, "start_time": start_time, "page_token": page_token})
+        rows = [m for m in HISTORY if start_time is None or int(m["create_time"]) // 1000 >= start_time]
+        offset = int(page_token or 0)
+        while offset < len(rows):
+            if self.fail_at_page is not None and offset // self.page_size == self.fail_at_page:
+                self.fail_at_page = None
+                raise RuntimeError("connection reset")
+            page = rows[offset:offset + self.page_size]
+            offset += len(page)
+            yield page, str(offset) if offset < len(rows) else None
+
+
+@pytest.fixture
+def memory_store(monkeypatch):
+    store.set_store(create_store("memory"))
+    monkeypatch.setattr(store.embeddings, "embed_many", lambda texts: [[1.0, 0.0] for _ in texts])
+    yield store.get_store()
+    store.set_store(None)
+
+
+def _run(monkeypatch, tmp_path, history: FakeHistory, **kwargs) -> dict[str, int]:
+    monkeypatch.setattr(backfill, "iter_message_pages", history)
+    checkpoints = backfill.Checkpoints(tmp_path / "checkpoints.json")
+    end = 150 * 3600
+    return backfill.run(["oc_1"], checkpoints, settle_hours=24, end_time=end, **kwargs)
+
+
+def test_backfill_indexes_settled_question_threads(memory_store, monkeypatch, tmp_path) -> None:
+    indexed = _run(monkeypatch, tmp_path, FakeHistory(), batch_size=1)
+
+    assert indexed == {"oc_1": 2}
+    rec = get_qa_by_root("om_a")
+    assert rec.answer_text == "Run the deploy script" + store.THREAD_REPLY_DELIMITER + "then check the dashboard"
+    assert rec.answerer_open_id == "ou_2"
+    assert memory_store.get_by_root("om_a")[0] == record_id_for_root("om_a")
+    assert get_qa_by_root("om_b") is not None
+    assert get_qa_by_root("om_x") is None  # not a question
+    assert get_qa_by_root("om_c") is None  # no replies
+
+    state = json.loads((tmp_path / "checkpoints.json").read_text())["oc_1"]
+    assert state["complete"] is True
+    assert state["resume_time"] == 200 * 3600  # om_c may still get replies
+
+
+def test_rerun_is_incremental_and_does_not_duplicate(memory_store, monkeypatch, tmp_path) -> None:
+    _run(monkeypatch, tmp_path, FakeHistory())
+    count = memory_store.count()
+
+    history = FakeHistory()
+    assert _run(monkeypatch, tmp_path, history) == {"oc_1": 0}
+    assert memory_store.count() == count
+    assert history.calls[0]["start_time"] == 200 * 3600
+
+
+def test_crash_resumes_from_checkpoint(memory_store, monkeypatch, tmp_path) -> None:
+    assert _run(monkeypatch, tmp_path, FakeHistory(fail_at_page=3)) == {"oc_1": 1}
+    state = json.loads((tmp_path / "checkpoints.json").read_text())["oc_1"]
+    assert state["complete"] is False
+    assert state["resume_time"] == 100 * 3600  # thread B was open when the walk failed
+
+    history = FakeHistory()
+    assert _run(monkeypatch, tmp_path, history) == {"oc_1": 1}
+    assert history.calls[0]["start_time"] == 100 * 3600
+    assert memory_store.count() == 2
+
+
+def test_page_token_checkpoint_when_no_thread_is_open(memory_store, monkeypatch, tmp_path) -> None:
+    # A walk that stopped with no thread open saved its page token: the rerun continues that query.
+    checkpoints = backfill.Checkpoints(tmp_path / "checkpoints.json")
+    checkpoints.save({"oc_1": {"start_time": None, "end_time": 150 * 3600, "page_token": "6", "complete": False}})
+    history = FakeHistory()
+    monkeypatch.setattr(backfill, "iter_message_pages", history)
+    backfill.run(["oc_1"], checkpoints, settle_hours=0, end_time=150 * 3600)
+    assert history.calls == [{"chat_id": "oc_1", "start_time": None, "page_token": "6"}]
+    assert json.loads((tmp_path / "checkpoints.json").read_text())["oc_1"]["complete"] is True
+
+
+def test_assembler_emits_thread_once_history_moves_past_settle() -> None:
+    assembler = backfill.ThreadAssembler("oc_1", settle_ms=24 * HOUR_MS)
+    assert assembler.add_page(HISTORY[:2]) == []
+    assert assembler.resume_time() == 3600
+    done = assembler.add_page(HISTORY[2:6])
+    assert [t.root_id for t in done] == ["om_a"]
+    assert len(done[0].replies) == 2
+    assert list(assembler.open) == ["om_b"]
+
+
+def test_write_failure_stops_fetchers_instead_of_hanging(memory_store, monkeypatch, tmp_path) -> None:
+    def endless_history(chat_id, **kwargs):
+        # One question thread per page, each completing the previous one: fills the queue fast
+        for i in range(10_000):
+            page = [_msg(f"om_{chat_id}_{i}", i, f"How about {i}?"), _msg(f"om_{chat_id}_{i}r", i + 0.5, "so", f"om_{chat_id}_{i}")]
+            yield page, str(i + 1)
+
+    def broken_add_qa_many(records):
+        raise RuntimeError("embedding model crashed")
+
+    monkeypatch.setattr(backfill, "iter_message_pages", endless_history)
+    monkeypatch.setattr(backfill, "add_qa_many", broken_add_qa_many)
+    checkpoints = backfill.Checkpoints(tmp_path / "checkpoints.json")
+    outcome: list[BaseException] = []
+
+    def target() -> None:
+        try:
+            backfill.run(["oc_1", "oc_2", "oc_3"], checkpoints, workers=2, batch_size=4, settle_hours=0, end_time=10**9)
+        except BaseException as e:
+            outcome.append(e)
+
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    t.join(timeout=15)
+    assert not t.is_alive(), "backfill hung after the write stage failed"
+    assert isinstance(outcome[0], RuntimeError)
+    # Only checkpoints taken before any thread completed were saved: a rerun starts from the beginning
+    saved = json.loads((tmp_path / "checkpoints.json").read_text())
+    assert all(state["resume_time"] == 0 for state in saved.values())
@@ -0,0 +1,104 @@
+"""Tests for the incremental BM25 index."""
+from src.bm25 import BM25Index, tokenize
+
+
+def test_tokenize_keeps_jargon_tokens_and_their_parts() -> None:
+    terms = tokenize("How do I fix E1234 on db-01.prod?")
+    assert "e1234" in terms
+    assert "db-01.prod" in terms and "db" in terms and "prod" in terms
+    assert "how" not in terms and "do" not in terms
+
+
+def test_tokenize_cjk_characters_and_bigrams() -> None:
+    assert tokenize("部署失败") == ["部", "署", "失", "败", "部署", "署失", "失败"]
+
+
+def _index(path=None) -> BM25Index:
+    idx = BM25Index(path)
+    idx.put("a", "Deploy fails with E1234 on db-01.prod", "oc_1", "r_a")
+    idx.put("b", "How do I deploy the frontend?", "oc_1", "r_b")
+    idx.put("c", "Where is the VPN config?", "oc_2", "r_c")
+    return idx
+
+
+def test_rare_terms_rank_first() -> None:
+    hits = _index().search("error E1234", top_k=5)
+    assert [doc_id for doc_id, _, _ in hits] == ["a"]
+    assert hits[0][1] == "r_a"
+
+
+def test_search_scoped_to_chat_with_fallback_to_all() -> None:
+    idx = _index()
+    assert {d for d, _, _ in idx.search("deploy vpn", top_k=5, chat_id="oc_1")} == {"a", "b"}
+    assert [d for d, _, _ in idx.search("vpn", top_k=5, chat_id="oc_new")] == ["c"]
+
+
+def test_min_coverage_drops_weak_partial_matches() -> None:
+    idx = _index()
+    assert {d for d, _, _ in idx.search("deploy E1234 db-01.prod", top_k=5)} == {"a", "b"}
+    assert [d for d, _, _ in idx.search("deploy E1234 db-01.prod", top_k=5, min_coverage=0.5)] == ["a"]
+
+
+def test_put_replaces_and_delete_by_root_removes() -> None:
+    idx = _index()
+    idx.put("b", "Rotate the VPN certificate", "oc_1", "r_b")
+    assert [d for d, _, _ in idx.search("frontend", top_k=5)] == []
+    idx.delete_by_root("r_c")
+    assert [d for d, _, _ in idx.search("vpn", top_k=5)] == ["b"]
+    assert len(idx) == 2
+
+
+def test_log_replays_and_compacts(tmp_path) -> None:
+    path = tmp_path / "bm25.jsonl"
+    idx = _index(path)
+    idx.put("b", "Rotate the VPN certificate", "oc_1", "r_b")
+    idx.put("b", "Rotate the VPN certificate", "oc_1", "r_b")  # unchanged: not logged again
+    idx.delete_by_root("r_c")
+    assert len(path.read_text().splitlines()) == 5
+
+    reopened = BM25Index(path)
+    assert len(reopened) == 2
+    assert [d for d, _, _ in reopened.search("vpn", top_k=5)] == ["b"]
+    reopened.compact()
+    assert len(path.read_text().splitlines()) == 2
+    assert [d for d, _, _ in BM25Index(path).search("e1234", top_k=5)] == ["a"]
+
+
+def test_compaction_keeps_entries_appended_by_another_process(tmp_path) -> None:
+    path = tmp_path / "bm25.jsonl"
+    server = BM25Index(path)
+    server.put("s", "Rotate the VPN certificate", "oc_1", "r_s")
+    backfill = BM25Index(path)  # second writer on the same log
+    backfill.put_many([("b1", "Deploy fails with E1234", "oc_2", "r_b1"), ("b2", "Reset SSO password", "oc_2", "r_b2")])
+
+    server.compact()
+    assert len(path.read_text().splitlines()) == 3
+    assert {d for d, _, _ in BM25Index(path).search("e1234 vpn sso", top_k=5)} == {"s", "b1", "b2"}
+    assert [d for d, _, _ in server.search("e1234", top_k=5)] == ["b1"]  # refreshed from disk
+
+
+def test_search_picks_up_entries_another_process_appended(tmp_path) -> None:
+    path = tmp_path / "bm25.jsonl"
+    server = BM25Index(path)
+    server.put("s", "Rotate the VPN certificate", "oc_1", "r_s")
+    backfill = BM25Index(path)
+    backfill.put("b1", "Deploy fails with E1234", "oc_2", "r_b1")
+    assert [d for d, _, _ in server.search("e1234", top_k=5)] == ["b1"]
+
+    backfill.delete_by_root("r_s")
+    backfill.compact()  # replaces the file: the server reloads it
+    assert server.search("vpn", top_k=5) == []
+    server.put("s2", "Reset SSO password", "oc_1", "r_s2")
+    assert {d for d, _, _ in BM25Index(path).search("e1234 sso vpn", top_k=5)} == {"b1", "s2"}
+
+
+def test_partly_written_line_is_applied_once_complete(tmp_path) -> None:
+    path = tmp_path / "bm25.jsonl"
+    reader = BM25Index(path)
+    line = '{"op": "put", "id": "x", "text": "Deploy fails with E1234", "chat_id": "oc_1", "root": "r_x"}\n'
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[:20])
+        f.flush()
+        assert reader.search("e1234", top_k=5) == []
+        f.write(line[20:])
+    assert [d for d, _, _ in reader.search("e1234", top_k=5)] == ["x"]
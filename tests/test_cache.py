@@ -0,0 +1,32 @@
+"""Tests for the shared LRU/TTL cache."""
+import time
+
+from src.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used() -> None:
+    c = LRUCache(2)
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.get("a") == 1
+    c.put("c", 3)
+    assert "b" not in c
+    assert c.get("a") == 1 and c.get("c") == 3
+
+
+def test_ttl_expires_entries(monkeypatch) -> None:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    c = LRUCache(10, ttl_seconds=5)
+    c.put("k", "v")
+    now[0] += 4
+    assert c.get("k") == "v"
+    now[0] += 2
+    assert c.get("k") is None
+    assert len(c) == 0
+
+
+def test_zero_size_cache_stores_nothing() -> None:
+    c = LRUCache(0)
+    c.put("k", "v")
+    assert c.get("k") is None
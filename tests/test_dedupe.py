@@ -0,0 +1,54 @@
+"""Tests for webhook event dedupe."""
+import time
+
+import pytest
+
+from src.dedupe import EventDeduper, SqliteEventDeduper, dedupe_keys
+
+
+def test_dedupe_keys() -> None:
+    assert dedupe_keys("ev_1", "om_1") == ["event:ev_1", "message:om_1"]
+    assert dedupe_keys(None, "om_1") == ["message:om_1"]
+    assert dedupe_keys("", "") == []
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_deduper(request, tmp_path):
+    def make(window: float):
+        if request.param == "sqlite":
+            return SqliteEventDeduper(tmp_path / "dedupe.sqlite3", window)
+        return EventDeduper(window)
+
+    return make
+
+
+def test_any_seen_key_marks_duplicate(make_deduper) -> None:
+    d = make_deduper(60)
+    assert d.is_duplicate(["event:1", "message:a"]) is False
+    assert d.is_duplicate(["event:1", "message:a"]) is True
+    assert d.is_duplicate(["event:2", "message:a"]) is True
+    assert d.is_duplicate(["event:3", "message:b"]) is False
+    assert d.is_duplicate([]) is False
+
+
+def test_forgotten_keys_are_processed_again(make_deduper) -> None:
+    d = make_deduper(60)
+    assert d.is_duplicate(["event:1", "message:a"]) is False
+    d.forget(["event:1", "message:a"])
+    assert d.is_duplicate(["event:1", "message:a"]) is False
+    assert d.is_duplicate(["event:1", "message:a"]) is True
+
+
+def test_keys_expire_after_window(make_deduper) -> None:
+    d = make_deduper(0.05)
+    assert d.is_duplicate(["message:a"]) is False
+    time.sleep(0.1)
+    assert d.is_duplicate(["message:a"]) is False
+
+
+def test_sqlite_deduper_is_shared_between_instances(tmp_path) -> None:
+    path = tmp_path / "dedupe.sqlite3"
+    worker_a = SqliteEventDeduper(path, 60)
+    worker_b = SqliteEventDeduper(path, 60)
+    assert worker_a.is_duplicate(["event:1"]) is False
+    assert worker_b.is_duplicate(["event:1"]) is True
@@ -0,0 +1,217 @@
+"""Tests for embeddings (fake model, no sentence-transformers download)."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import src.embeddings as embeddings_mod
+from src.embedding_cache import EmbeddingCache, cache_key
+
+
+class FakeModel:
+    """Encodes text as [len(text), 1.0, 0.0] and records each encode call."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.calls: list[list[str]] = []
+        self.delay = delay
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True):
+        self.calls.append(list(texts))
+        if self.delay:
+            time.sleep(self.delay)
+        return np.array([[float(len(t)), 1.0, 0.0] for t in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(embeddings_mod, "_model", model)
+    monkeypatch.setattr(embeddings_mod, "_batcher", None)
+    monkeypatch.setattr(embeddings_mod, "EMBED_CACHE_ENABLED", False)
+    return model
+
+
+@pytest.fixture
+def cached_fake_model(fake_model, monkeypatch, tmp_path):
+    cache = EmbeddingCache("fake", memory_items=100, disk_path=tmp_path / "emb.sqlite3", disk_items=100)
+    monkeypatch.setattr(embeddings_mod, "EMBED_CACHE_ENABLED", True)
+    monkeypatch.setattr(embeddings_mod, "_cache", cache)
+    yield fake_model
+    cache.close()
+
+
+def test_embed_many_preserves_order_in_one_encode(fake_model) -> None:
+    vecs = embeddings_mod.embed_many(["a", "bbb", "cc"])
+    assert [v[0] for v in vecs] == [1.0, 3.0, 2.0]
+    assert len(fake_model.calls) == 1
+
+
+def test_embed_many_empty_and_blank(fake_model) -> None:
+    assert embeddings_mod.embed_many([]) == []
+    assert fake_model.calls == []
+    embeddings_mod.embed_many(["", "  x  "])
+    assert fake_model.calls[0] == [" ", "x"]
+
+
+def test_embed_without_batching(fake_model, monkeypatch) -> None:
+    monkeypatch.setattr(embeddings_mod, "EMBED_BATCH_WINDOW_MS", 0)
+    assert embeddings_mod.embed("abcd") == [4.0, 1.0, 0.0]
+    assert embeddings_mod._batcher is None
+
+
+def test_embed_micro_batches_concurrent_calls(fake_model, monkeypatch) -> None:
+    monkeypatch.setattr(embeddings_mod, "EMBED_BATCH_WINDOW_MS", 50)
+    texts = ["x" * n for n in range(1, 9)]
+    results: dict[str, list[float]] = {}
+
+    def worker(t: str) -> None:
+        results[t] = embeddings_mod.embed(t)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in texts]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join(timeout=5)
+    assert {t: v[0] for t, v in results.items()} == {t: float(len(t)) for t in texts}
+    assert len(fake_model.calls) < len(texts)
+    assert sum(len(c) for c in fake_model.calls) == len(texts)
+
+
+def test_embed_batcher_propagates_errors(monkeypatch) -> None:
+    class Broken:
+        def encode(self, *args, **kwargs):
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(embeddings_mod, "_model", Broken())
+    monkeypatch.setattr(embeddings_mod, "_batcher", None)
+    monkeypatch.setattr(embeddings_mod, "EMBED_BATCH_WINDOW_MS", 1)
+    with pytest.raises(RuntimeError, match="boom"):
+        embeddings_mod.embed("hello")
+
+
+def test_embed_many_dedupes_within_batch(fake_model) -> None:
+    vecs = embeddings_mod.embed_many(["same", "same ", "other"])
+    assert vecs[0] == vecs[1]
+    assert fake_model.calls == [["same", "other"]]
+
+
+def test_cache_key_normalizes_whitespace_and_includes_model() -> None:
+    assert cache_key("m", " How  do I\ndeploy? ") == cache_key("m", "How do I deploy?")
+    assert cache_key("m", "How do I deploy?") != cache_key("other", "How do I deploy?")
+
+
+def test_embed_uses_cache(cached_fake_model, monkeypatch) -> None:
+    monkeypatch.setattr(embeddings_mod, "EMBED_BATCH_WINDOW_MS", 0)
+    first = embeddings_mod.embed("How do I deploy?")
+    second = embeddings_mod.embed("  How do I   deploy? ")
+    assert first == second
+    assert len(cached_fake_model.calls) == 1
+    stats = embeddings_mod.cache_stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_embed_many_only_encodes_misses(cached_fake_model) -> None:
+    embeddings_mod.embed_many(["a", "bb"])
+    embeddings_mod.embed_many(["a", "bb", "ccc"])
+    assert cached_fake_model.calls == [["a", "bb"], ["ccc"]]
+
+
+def test_embedding_cache_disk_tier_survives_restart(tmp_path) -> None:
+    path = tmp_path / "emb.sqlite3"
+    cache = EmbeddingCache("m", memory_items=10, disk_path=path)
+    cache.put_many({"hello": [0.5, 0.25]})
+    cache.close()
+    reopened = EmbeddingCache("m", memory_items=10, disk_path=path)
+    assert reopened.get("hello") == [0.5, 0.25]
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_embedding_cache_evicts_to_size_bounds(tmp_path) -> None:
+    cache = EmbeddingCache("m", memory_items=2, disk_path=tmp_path / "emb.sqlite3", disk_items=3)
+    for i in range(5):
+        cache.put_many({f"t{i}": [float(i)]})
+    stats = cache.stats()
+    assert stats["memory_items"] == 2
+    assert stats["disk_items"] == 3
+    assert cache.get("t0") is None
+    assert cache.get("t4") == [4.0]
+    cache.close()
+
+
+def test_embedding_cache_evicts_rows_other_processes_added(tmp_path) -> None:
+    path = tmp_path / "emb.sqlite3"
+    server = EmbeddingCache("m", memory_items=0, disk_path=path, disk_items=4)
+    backfill = EmbeddingCache("m", memory_items=0, disk_path=path, disk_items=4)
+    backfill.put_many({f"b{i}": [float(i)] for i in range(3)})
+    server.put_many({"s0": [1.0], "s1": [2.0]})
+    assert server.stats()["disk_items"] == 4  # both processes' rows are counted
+    assert backfill.get("b0") is None and server.get("s1") == [2.0]
+    server.close()
+    backfill.close()
+
+
+def test_embedding_cache_counters_are_exact_under_threads() -> None:
+    cache = EmbeddingCache("m", memory_items=10)
+    cache.put_many({"hit": [1.0]})
+
+    def lookups() -> None:
+        for _ in range(500):
+            cache.get_many(["hit", "miss"])
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"]) == (4000, 4000)
+
+
+def test_embedding_cache_memory_tier_holds_float32_arrays() -> None:
+    cache = EmbeddingCache("m", memory_items=10)
+    cache.put_many({"hello": [0.5, 0.25]})
+    stored = cache._memory.get(cache_key("m", "hello"))
+    assert isinstance(stored, np.ndarray) and stored.dtype == np.float32
+    assert cache.get("hello") == [0.5, 0.25]
+
+
+def test_load_backend_unknown_raises() -> None:
+    with pytest.raises(ValueError, match="EMBEDDING_BACKEND"):
+        embeddings_mod.load_backend("tpu")
+
+
+def test_get_model_uses_configured_backend(monkeypatch) -> None:
+    loaded: list[tuple[str, str]] = []
+    monkeypatch.setitem(embeddings_mod.BACKENDS, "fake", lambda name: loaded.append(("fake", name)) or FakeModel())
+    monkeypatch.setattr(embeddings_mod, "EMBEDDING_BACKEND", "fake")
+    monkeypatch.setattr(embeddings_mod, "_model", None)
+    assert isinstance(embeddings_mod.get_model(), FakeModel)
+    assert loaded == [("fake", embeddings_mod.EMBEDDING_MODEL)]
+    assert "fake" in embeddings_mod.model_id()
+
+
+def _load_or_skip(backend: str):
+    try:
+        return embeddings_mod.load_backend(backend)
+    except Exception as e:  # missing optimum / model files not downloadable here
+        pytest.skip(f"{backend} backend unavailable: {e}")
+
+
+def test_onnx_int8_parity_with_reference_on_faq_seed() -> None:
+    """int8 ONNX vectors must agree with the float32 reference model on the seed FAQ."""
+    import json
+    from pathlib import Path
+
+    seed = json.loads((Path(__file__).resolve().parent.parent / "data" / "faq_seed.json").read_text())
+    texts = [item["question"] for item in seed] + [item["answer"] for item in seed]
+    reference = _load_or_skip("torch")
+    quantized = _load_or_skip("onnx_int8")
+    ref = np.asarray(reference.encode(texts, normalize_embeddings=True))
+    q8 = np.asarray(quantized.encode(texts, normalize_embeddings=True))
+    cosines = np.sum(ref * q8, axis=1)
+    assert cosines.min() >= 0.98
+    # Nearest reference vector for each quantized vector is its own text: rankings are preserved.
+    assert list(np.argmax(q8 @ ref.T, axis=1)) == list(range(len(texts)))
@@ -0,0 +1,341 @@
+"""lark_client against a local fake Lark HTTPS server: token caching, connection reuse, latency metrics;
+and history paging against a mock transport."""
+import json
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from src import lark_client
+from src.lark_http import LarkHTTP, endpoint_name
+
+
+class FakeLarkServer(ThreadingHTTPServer):
+    """Keep-alive HTTP/1.1 Lark stand-in over TLS. Every accepted connection is one TLS handshake."""
+
+    daemon_threads = True
+
+    def __init__(self, ssl_context: ssl.SSLContext, token_expire: int = 7200) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.ssl_context = ssl_context
+        self.token_expire = token_expire
+        self.token_delay = 0.0
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.tokens_issued = 0
+        self.auth_seen: list[str] = []
+        self.messages = 0
+
+    def get_request(self):
+        sock, addr = self.socket.accept()
+        return self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False), addr
+
+    @property
+    def url(self) -> str:
+        return f"https://127.0.0.1:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        self.request.do_handshake()
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _reply(self, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        server = self.server
+        if self.path.endswith("/tenant_access_token/internal"):
+            time.sleep(server.token_delay)
+            with server.lock:
+                server.tokens_issued += 1
+                token = f"t-{server.tokens_issued}"
+            return self._reply({"code": 0, "tenant_access_token": token, "expire": server.token_expire})
+        with server.lock:
+            server.auth_seen.append(self.headers.get("Authorization", ""))
+            server.messages += 1
+            n = server.messages
+        if self.command == "GET":
+            return self._reply({"code": 0, "data": {"items": [
+                {"message_id": "om_root", "body": {"content": '{"text":"How?"}'}, "sender": {"id": "ou_1"}, "chat_id": "oc_1"}
+            ]}})
+        self._reply({"code": 0, "data": {"message_id": f"om_bot_{n}"}})
+
+    do_GET = do_POST = do_PUT = _handle
+
+
+@pytest.fixture(scope="module")
+def tls_files(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not available to create a test certificate")
+    d = tmp_path_factory.mktemp("tls")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", str(d / "key.pem"), "-out", str(d / "cert.pem"),
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return d / "cert.pem", d / "key.pem"
+
+
+@pytest.fixture
+def start_server(tls_files):
+    cert, key = tls_files
+    servers = []
+
+    def start(**kwargs) -> tuple[FakeLarkServer, ssl.SSLContext]:
+        server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ctx.load_cert_chain(cert, key)
+        server = FakeLarkServer(server_ctx, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, ssl.create_default_context(cafile=str(cert))
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def lark(start_server, monkeypatch):
+    """lark_client wired to a fresh fake server; yields (server, transport)."""
+    server, client_ctx = start_server()
+    http = LarkHTTP(server.url, "app", "secret", max_connections=4, verify=client_ctx)
+    monkeypatch.setattr(lark_client, "_http", http)
+    yield server, http
+    http.close()
+
+
+def _answer_once(i: int) -> None:
+    sent = lark_client.send_text_message("oc_1", f"looking {i}", root_id="om_root")
+    assert sent
+    assert lark_client.update_message(sent, f"answer {i}")
+
+
+def test_steady_state_replies_open_no_new_connections(lark) -> None:
+    server, _ = lark
+    assert lark_client.get_message("om_root")["content"] == '{"text":"How?"}'
+    _answer_once(0)
+    warm_connections = server.connections
+
+    for i in range(1, 21):
+        _answer_once(i)
+
+    assert warm_connections == 1
+    assert server.connections == warm_connections  # zero TLS handshakes per reply once warm
+    assert server.tokens_issued == 1
+    assert set(server.auth_seen) == {"Bearer t-1"}
+
+
+def _answer_concurrently(workers: int, replies: int) -> None:
+    threads = [threading.Thread(target=lambda: [_answer_once(i) for i in range(replies)]) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_concurrent_replies_reuse_the_pool(lark) -> None:
+    server, _ = lark
+    _answer_concurrently(4, 5)
+    warm_connections = server.connections
+    _answer_concurrently(4, 10)
+
+    assert warm_connections <= 4
+    assert server.connections == warm_connections
+    assert server.tokens_issued == 1
+
+
+def _wait_for_refresh(http: LarkHTTP) -> None:
+    deadline = time.monotonic() + 5
+    while http._token.refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_token_is_refreshed_ahead_of_expiry_without_blocking(start_server) -> None:
+    server, client_ctx = start_server(token_expire=1000)
+    # refresh margin longer than the token's lifetime: every token is already due for refresh
+    http = LarkHTTP(server.url, "app", "secret", refresh_margin=1500, verify=client_ctx)
+    try:
+        http.request("POST", "/open-apis/im/v1/messages/om_root/reply", json={})
+        http.request("POST", "/open-apis/im/v1/messages/om_root/reply", json={})
+        _wait_for_refresh(http)
+        http.request("POST", "/open-apis/im/v1/messages/om_root/reply", json={})
+    finally:
+        http.close()
+    assert server.tokens_issued >= 2
+    # the request that triggered the refresh still went out with the current token
+    assert server.auth_seen[:2] == ["Bearer t-1", "Bearer t-1"]
+    assert server.auth_seen[-1] != "Bearer t-1"
+
+
+def test_requests_during_a_slow_refresh_do_not_wait_for_it(start_server) -> None:
+    server, client_ctx = start_server(token_expire=1000)
+    http = LarkHTTP(server.url, "app", "secret", refresh_margin=1500, verify=client_ctx)
+    path = "/open-apis/im/v1/messages/om_root/reply"
+    try:
+        http.request("POST", path, json={})  # first token, fetched inline
+        server.token_delay = 1.0
+        http.request("POST", path, json={})  # due for refresh: starts the slow background fetch
+        timings = []
+        for _ in range(3):
+            start = time.monotonic()
+            http.request("POST", path, json={})
+            timings.append(time.monotonic() - start)
+        assert max(timings) < 0.5
+        assert server.auth_seen[-3:] == ["Bearer t-1"] * 3
+        _wait_for_refresh(http)
+        http.request("POST", path, json={})
+    finally:
+        http.close()
+    assert server.auth_seen[-1] == "Bearer t-2"
+
+
+def test_latency_histograms_per_endpoint(lark) -> None:
+    _, http = lark
+    for i in range(3):
+        _answer_once(i)
+    lark_client.list_messages("oc_1")
+
+    snapshot = http.latency.snapshot()
+    assert snapshot["POST /open-apis/im/v1/messages/:id/reply"]["count"] == 3
+    assert snapshot["PUT /open-apis/im/v1/messages/:id"]["count"] == 3
+    assert snapshot["GET /open-apis/im/v1/messages"]["count"] == 1
+    assert snapshot["POST /open-apis/auth/v3/tenant_access_token/internal"]["count"] == 1
+    reply = snapshot["POST /open-apis/im/v1/messages/:id/reply"]
+    assert sum(reply["buckets"].values()) == 3
+    assert 0 < reply["p50_ms"] <= reply["p99_ms"]
+
+
+def test_endpoint_name_collapses_ids() -> None:
+    assert endpoint_name("put", "/open-apis/im/v1/messages/om_abc123") == "PUT /open-apis/im/v1/messages/:id"
+    assert endpoint_name("GET", "/open-apis/im/v1/messages?container_id=oc_1") == "GET /open-apis/im/v1/messages"
+
+
+async def test_async_transport_reuses_connections(start_server) -> None:
+    from src.lark_http import AsyncLarkHTTP
+
+    server, client_ctx = start_server()
+    http = AsyncLarkHTTP(server.url, "app", "secret", verify=client_ctx)
+    try:
+        for _ in range(10):
+            await http.request("POST", "/open-apis/im/v1/messages/om_root/reply", json={})
+    finally:
+        await http.aclose()
+    assert server.connections == 1
+    assert server.tokens_issued == 1
+
+
+class PagedLark:
+    """MockTransport handler serving a chat's history in pages of `page_size` (page_token = next offset)."""
+
+    def __init__(self, total: int, short_page: int | None = None) -> None:
+        self.total = total
+        self.short_page = short_page  # this page comes back with one item less (has_more still set)
+        self.requests: list[dict] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/tenant_access_token/internal"):
+            return httpx.Response(200, json={"code": 0, "tenant_access_token": "t", "expire": 7200})
+        params = dict(request.url.params)
+        self.requests.append(params)
+        start = int(params.get("page_token") or 0)
+        size = int(params["page_size"])
+        if len(self.requests) - 1 == self.short_page:
+            size -= 1
+        end = min(start + size, self.total)
+        items = [{"message_id": f"om_{i}", "create_time": str(i)} for i in range(start, end)]
+        data = {"items": items, "has_more": end < self.total}
+        if end < self.total:
+            data["page_token"] = str(end)
+        return httpx.Response(200, json={"code": 0, "data": data})
+
+
+@pytest.fixture
+def paged(monkeypatch):
+    def make(total: int, **kwargs) -> PagedLark:
+        fake = PagedLark(total, **kwargs)
+        http = LarkHTTP("https://lark.test", "app", "secret", transport=httpx.MockTransport(fake))
+        monkeypatch.setattr(lark_client, "_http", http)
+        return fake
+
+    return make
+
+
+def test_iter_message_pages_prefetches_next_page(paged) -> None:
+    fake = paged(5)
+    pages = lark_client.iter_message_pages("oc_1", page_size=2)
+    items, token = next(pages)
+    assert [m["message_id"] for m in items] == ["om_0", "om_1"]
+    assert token == "2"
+    deadline = time.monotonic() + 5
+    while len(fake.requests) < 2 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert len(fake.requests) == 2  # page 2 requested while page 1 is being processed
+    rest = list(pages)
+    assert [len(i) for i, _ in rest] == [2, 1]
+    assert rest[-1][1] is None
+    assert len(fake.requests) == 3
+
+
+def test_short_page_with_has_more_does_not_end_the_walk(paged) -> None:
+    paged(5, short_page=0)
+    pages = list(lark_client.iter_message_pages("oc_1", page_size=2))
+    assert [[m["message_id"] for m in items] for items, _ in pages] == [["om_0"], ["om_1", "om_2"], ["om_3", "om_4"]]
+    assert pages[-1][1] is None
+
+
+def test_iter_messages_time_window_and_resume(paged) -> None:
+    fake = paged(3)
+    ids = [m["message_id"] for m in lark_client.iter_messages("oc_1", page_size=2, start_time=100, end_time=200.5)]
+    assert ids == ["om_0", "om_1", "om_2"]
+    assert fake.requests[0]["start_time"] == "100"
+    assert fake.requests[0]["end_time"] == "200"
+    assert fake.requests[0]["container_id"] == "oc_1"
+
+    resumed = list(lark_client.iter_messages("oc_1", page_size=2, page_token="2"))
+    assert [m["message_id"] for m in resumed] == ["om_2"]
+
+
+def test_closing_the_iterator_stops_fetching(paged) -> None:
+    fake = paged(100)
+    pages = lark_client.iter_message_pages("oc_1", page_size=10)
+    next(pages)
+    pages.close()
+    time.sleep(0.05)
+    assert len(fake.requests) <= 2
+
+
+def test_list_messages_is_built_on_the_iterator(paged) -> None:
+    paged(7)
+    assert [m["message_id"] for m in lark_client.list_messages("oc_1", page_size=3)] == [f"om_{i}" for i in range(7)]
+
+
+def test_set_rate_limit_gives_a_script_its_own_budget(monkeypatch) -> None:
+    monkeypatch.setattr(lark_client, "_limiter", lark_client._limiter)
+    lark_client.set_rate_limit(2.0, 3.0)
+    bucket = lark_client._transport_kwargs()["limiter"].bucket("GET /open-apis/im/v1/messages")
+    assert (bucket.rate, bucket.burst, bucket.reserve) == (2.0, 3.0, 0.0)
@@ -0,0 +1,173 @@
+"""Tests for the async Lark transport and lark_client's async calls."""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from src import lark_client
+from src.lark_http import AsyncLarkHTTP, LarkAPIError, LarkHTTP, retry_after
+from src.rate_limit import RateLimiter
+
+
+class FakeLark:
+    """httpx MockTransport handler: issues tenant tokens and records authorized API calls."""
+
+    def __init__(self) -> None:
+        self.tokens_issued = 0
+        self.rejected: set[str] = set()
+        self.calls: list[tuple[str, str, str, dict]] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/tenant_access_token/internal"):
+            self.tokens_issued += 1
+            return httpx.Response(200, json={"code": 0, "tenant_access_token": f"t-{self.tokens_issued}", "expire": 7200})
+        auth = request.headers.get("Authorization", "")
+        if auth.removeprefix("Bearer ") in self.rejected:
+            return httpx.Response(200, json={"code": 99991663, "msg": "invalid access token"})
+        body = json.loads(request.content) if request.content else {}
+        self.calls.append((request.method, request.url.path, auth, body))
+        if request.url.path.endswith("/missing"):
+            return httpx.Response(200, json={"code": 230001, "msg": "not found"})
+        if request.method == "GET":
+            return httpx.Response(200, json={"code": 0, "data": {"items": [
+                {"body": {"content": '{"text":"hi"}'}, "create_time": "1", "sender": {"id": "ou_1"}, "chat_id": "oc_1"}
+            ]}})
+        return httpx.Response(200, json={"code": 0, "data": {"message_id": "om_sent"}})
+
+
+def _http(fake: FakeLark, **kwargs) -> AsyncLarkHTTP:
+    return AsyncLarkHTTP("https://lark.test", "app", "secret", transport=httpx.MockTransport(fake), **kwargs)
+
+
+class Flaky(FakeLark):
+    """FakeLark whose first `failures` API calls answer with `response` instead."""
+
+    def __init__(self, failures: int, response: httpx.Response) -> None:
+        super().__init__()
+        self.failures = failures
+        self.response = response
+        self.attempts = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/tenant_access_token/internal"):
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                return self.response
+        return super().__call__(request)
+
+
+async def test_token_is_fetched_once_for_concurrent_requests() -> None:
+    fake = FakeLark()
+    http = _http(fake)
+    await asyncio.gather(*(http.request("POST", "/open-apis/im/v1/messages") for _ in range(10)))
+    await http.aclose()
+    assert fake.tokens_issued == 1
+    assert {auth for _, _, auth, _ in fake.calls} == {"Bearer t-1"}
+
+
+async def test_rejected_token_is_refreshed_and_request_retried() -> None:
+    fake = FakeLark()
+    http = _http(fake)
+    await http.request("GET", "/open-apis/im/v1/messages/om_1")
+    fake.rejected.add("t-1")
+    data = await http.request("GET", "/open-apis/im/v1/messages/om_1")
+    await http.aclose()
+    assert data["items"]
+    assert fake.tokens_issued == 2
+    assert fake.calls[-1][2] == "Bearer t-2"
+
+
+async def test_error_code_raises() -> None:
+    http = _http(FakeLark())
+    with pytest.raises(LarkAPIError) as exc:
+        await http.request("GET", "/open-apis/im/v1/missing")
+    await http.aclose()
+    assert exc.value.code == 230001
+
+
+@pytest.fixture
+async def fake_lark(monkeypatch):
+    fake = FakeLark()
+    http = _http(fake)
+    monkeypatch.setattr(lark_client, "get_async_http", lambda: http)
+    yield fake
+    await http.aclose()
+
+
+async def test_asend_text_message_replies_in_thread(fake_lark) -> None:
+    sent = await lark_client.asend_text_message("oc_1", "héllo", root_id="om_root")
+    assert sent == "om_sent"
+    method, path, _, body = fake_lark.calls[0]
+    assert (method, path) == ("POST", "/open-apis/im/v1/messages/om_root/reply")
+    assert body.pop("uuid")  # idempotency key, so a retried send is not posted twice
+    assert body == {"content": '{"text": "héllo"}', "msg_type": "text", "reply_in_thread": True}
+
+
+async def test_asend_post_to_chat_and_update(fake_lark) -> None:
+    post = {"en_us": {"content": [[{"tag": "text", "text": "x"}]]}}
+    assert await lark_client.asend_text_message("oc_1", "x", post_content=post) == "om_sent"
+    assert await lark_client.aupdate_message("om_sent", "y") is True
+    (_, create_path, _, create_body), (update_method, update_path, _, update_body) = fake_lark.calls
+    assert create_path == "/open-apis/im/v1/messages"
+    assert create_body["receive_id"] == "oc_1" and create_body["msg_type"] == "post"
+    assert json.loads(create_body["content"]) == post
+    assert (update_method, update_path) == ("PUT", "/open-apis/im/v1/messages/om_sent")
+    assert update_body == {"content": '{"text": "y"}', "msg_type": "text"}
+
+
+async def test_aget_message(fake_lark) -> None:
+    msg = await lark_client.aget_message("om_1")
+    assert msg == {"content": '{"text":"hi"}', "create_time": "1", "sender_id": "ou_1", "chat_id": "oc_1"}
+
+
+async def test_async_calls_log_and_return_on_error(fake_lark) -> None:
+    assert await lark_client.aupdate_message("missing", "y") is False
+    assert await lark_client.aget_message("missing") is None
+
+
+async def test_throttled_call_is_retried_after_retry_after() -> None:
+    limiter = RateLimiter()
+    fake = Flaky(2, httpx.Response(429, headers={"Retry-After": "0"}, json={"code": 99991400, "msg": "too many"}))
+    http = _http(fake, limiter=limiter, retry_base=0.01)
+    data = await http.request("POST", "/open-apis/im/v1/messages/om_1/reply", json={})
+    await http.aclose()
+    assert data == {"message_id": "om_sent"}
+    assert fake.attempts == 3
+    assert http.stats()["retries"] == 2
+
+
+async def test_server_errors_retry_with_backoff_then_raise() -> None:
+    fake = Flaky(10, httpx.Response(503, text="upstream unavailable"))
+    http = _http(fake, max_retries=2, retry_base=0.01)
+    with pytest.raises(LarkAPIError) as exc:
+        await http.request("GET", "/open-apis/im/v1/messages/om_1")
+    await http.aclose()
+    assert exc.value.code == -503
+    assert fake.attempts == 3
+
+
+async def test_client_errors_are_not_retried() -> None:
+    fake = Flaky(1, httpx.Response(400, json={"code": 230002, "msg": "bad request"}))
+    http = _http(fake, retry_base=0.01)
+    with pytest.raises(LarkAPIError):
+        await http.request("GET", "/open-apis/im/v1/messages/om_1")
+    await http.aclose()
+    assert fake.attempts == 1
+
+
+def test_sync_transport_retries_throttled_calls() -> None:
+    fake = Flaky(1, httpx.Response(200, json={"code": 99991400, "msg": "frequency limit"}))
+    http = LarkHTTP("https://lark.test", "app", "secret", transport=httpx.MockTransport(fake), retry_base=0.01)
+    try:
+        assert http.request("GET", "/open-apis/im/v1/messages/om_1")["items"]
+    finally:
+        http.close()
+    assert fake.attempts == 2
+    assert http.stats()["retries"] == 1
+
+
+def test_retry_after_reads_lark_reset_header() -> None:
+    assert retry_after(httpx.Response(429, headers={"Retry-After": "3"})) == 3.0
+    assert retry_after(httpx.Response(429, headers={"x-ogw-ratelimit-reset": "7"})) == 7.0
+    assert retry_after(httpx.Response(429)) is None
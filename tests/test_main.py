@@ -1,8 +1,10 @@
 """Tests for main webhook app."""
+import threading
 from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 from fastapi.testclient import TestClient
 
+import src.main as main_mod
 from src.main import app
 
 
@@ -11,13 +13,22 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def fresh_deduper(monkeypatch):
+    from src.dedupe import EventDeduper
+
+    monkeypatch.setattr(main_mod, "_deduper", EventDeduper(window_seconds=60))
+
+
 @pytest.fixture(autouse=True)
 def mock_pipeline_tasks():
     """Prevent pipeline from actually running (no Lark/Chroma in tests)."""
     with patch("src.main.pipeline.handle_message") as mock_handle, patch(
         "src.main.pipeline.index_reply"
-    ) as mock_index:
-        yield {"handle": mock_handle, "index": mock_index}
+    ) as mock_index, patch("src.main.pipeline.index_replies") as mock_index_many:
+        yield {"handle": mock_handle, "index": mock_index, "index_many": mock_index_many}
+        main_mod._reply_coalescer.drain(timeout=5)
+        main_mod._work_queue.drain(timeout=5)
 
 
 def test_get_root(client: TestClient) -> None:
@@ -33,6 +44,39 @@ def test_get_health(client: TestClient) -> None:
     assert r.json() == {"status": "ok"}
 
 
+@pytest.fixture
+def fresh_readiness(monkeypatch):
+    monkeypatch.setattr(main_mod, "_readiness", {"ready": False, "error": None, "warmup_seconds": None})
+
+
+def test_ready_is_503_until_warmup(client: TestClient, fresh_readiness) -> None:
+    r = client.get("/ready")
+    assert r.status_code == 503
+    assert r.json()["status"] == "warming_up"
+    assert client.get("/health").status_code == 200
+
+
+def test_warmup_preloads_model_store_and_lark(client: TestClient, fresh_readiness) -> None:
+    with patch("src.main.embeddings.warmup", return_value=[0.0] * 384) as emb, patch(
+        "src.main.store.warmup"
+    ) as st, patch("src.main.lark_client.warmup") as lark:
+        main_mod._warmup()
+    emb.assert_called_once()
+    st.assert_called_once_with([0.0] * 384)
+    lark.assert_called_once()
+    r = client.get("/ready")
+    assert r.status_code == 200
+    assert r.json()["status"] == "ready"
+
+
+def test_warmup_failure_keeps_instance_unready(client: TestClient, fresh_readiness) -> None:
+    with patch("src.main.embeddings.warmup", side_effect=RuntimeError("no model")):
+        main_mod._warmup()
+    r = client.get("/ready")
+    assert r.status_code == 503
+    assert r.json() == {"status": "error", "error": "no model"}
+
+
 def test_url_verification(client: TestClient) -> None:
     r = client.post(
         "/webhook/lark",
@@ -123,6 +167,38 @@ def test_reply_message_triggers_index_reply(client: TestClient, mock_pipeline_ta
     assert r.status_code == 200
 
 
+def _reply_event(message_id: str, text: str) -> dict:
+    return {
+        "schema": "2.0",
+        "header": {"event_type": "im.message.receive_v1"},
+        "event": {
+            "message": {
+                "chat_id": "oc_chat1",
+                "message_id": message_id,
+                "root_id": "om_root1",
+                "parent_id": "om_root1",
+                "content": '{"text": "%s"}' % text,
+                "create_time": "1700000000000",
+            },
+            "sender": {"sender_id": {"open_id": "ou_user"}},
+        },
+    }
+
+
+def test_reply_burst_is_coalesced_per_root(client: TestClient, mock_pipeline_tasks, monkeypatch) -> None:
+    from src.reply_coalescer import ReplyCoalescer
+
+    monkeypatch.setattr(main_mod, "_reply_coalescer", ReplyCoalescer(main_mod._run_index_replies, 60.0))
+    for i in range(3):
+        assert client.post("/webhook/lark", json=_reply_event(f"om_reply{i}", f"r{i}")).status_code == 200
+    mock_pipeline_tasks["index_many"].assert_not_called()
+    main_mod._reply_coalescer.drain(timeout=5)
+    mock_pipeline_tasks["index_many"].assert_called_once()
+    kwargs = mock_pipeline_tasks["index_many"].call_args.kwargs
+    assert kwargs["root_id"] == "om_root1"
+    assert [r["reply_message_id"] for r in kwargs["replies"]] == ["om_reply0", "om_reply1", "om_reply2"]
+
+
 def test_chat_id_normalized_from_dict(client: TestClient, mock_pipeline_tasks) -> None:
     """Lark v2 may send chat_id as object."""
     r = client.post(
@@ -149,3 +225,137 @@ def test_chat_id_normalized_from_dict(client: TestClient, mock_pipeline_tasks) -
 def test_invalid_json_returns_400(client: TestClient) -> None:
     r = client.post("/webhook/lark", content="not json", headers={"Content-Type": "application/json"})
     assert r.status_code == 400
+
+
+def _root_event(event_id: str, message_id: str) -> dict:
+    return {
+        "schema": "2.0",
+        "header": {"event_type": "im.message.receive_v1", "event_id": event_id},
+        "event": {
+            "message": {
+                "chat_id": "oc_chat1",
+                "message_id": message_id,
+                "content": '{"text": "How do I deploy?"}',
+                "root_id": "",
+                "parent_id": "",
+                "mentions": [{"id": {"open_id": "ou_bot"}}],
+            },
+            "sender": {"sender_id": {"open_id": "ou_user"}},
+        },
+    }
+
+
+def test_redelivered_event_runs_pipeline_once(client: TestClient, mock_pipeline_tasks) -> None:
+    for _ in range(2):
+        assert client.post("/webhook/lark", json=_root_event("ev_1", "om_dup")).status_code == 200
+    main_mod._work_queue.drain(timeout=5)
+    mock_pipeline_tasks["handle"].assert_called_once()
+
+
+def test_same_message_with_new_event_id_is_deduped(client: TestClient, mock_pipeline_tasks) -> None:
+    client.post("/webhook/lark", json=_root_event("ev_1", "om_dup"))
+    client.post("/webhook/lark", json=_root_event("ev_2", "om_dup"))
+    client.post("/webhook/lark", json=_root_event("ev_3", "om_other"))
+    main_mod._work_queue.drain(timeout=5)
+    assert mock_pipeline_tasks["handle"].call_count == 2
+
+
+def test_redelivered_reply_is_queued_once(client: TestClient, mock_pipeline_tasks) -> None:
+    for _ in range(3):
+        client.post("/webhook/lark", json=_reply_event("om_reply_dup", "r"))
+    main_mod._reply_coalescer.drain(timeout=5)
+    replies = [r for call in mock_pipeline_tasks["index_many"].call_args_list for r in call.kwargs["replies"]]
+    assert [r["reply_message_id"] for r in replies] == ["om_reply_dup"]
+
+
+def test_metrics_reports_work_queue(client: TestClient, mock_pipeline_tasks) -> None:
+    client.post("/webhook/lark", json=_root_event("ev_m", "om_m"))
+    main_mod._work_queue.drain(timeout=5)
+    data = client.get("/metrics").json()
+    assert data["work_queue"]["depth"] == 0
+    assert data["work_queue"]["priorities"]["answer"]["completed"] >= 1
+    assert "wait_p95" in data["work_queue"]["priorities"]["index"]
+
+
+def test_saturated_queue_defers_reply_indexing(monkeypatch, mock_pipeline_tasks) -> None:
+    from src.reply_coalescer import ReplyCoalescer
+
+    refused = MagicMock(return_value=None)
+    monkeypatch.setattr(main_mod._work_queue, "submit", refused)
+    coalescer = ReplyCoalescer(
+        main_mod._index_replies_queued, 0.0, retry_on=(main_mod.WorkShed,), retry_delay=0.0, max_retries=2
+    )
+    before = threading.active_count()
+    coalescer.submit("oc_1", "om_root_d", {"reply_message_id": "om_r"})
+    assert coalescer.drain(timeout=5)
+    assert refused.call_count == 3  # two deferrals, then the batch is dropped
+    assert threading.active_count() <= before + 2  # scheduler + one handler thread, no timer per attempt
+    assert coalescer.stats() == {"pending_roots": 0, "retrying_roots": 0, "shed": 0, "retried": 2, "dropped": 1}
+
+
+def test_index_handler_does_not_wait_for_the_work_queue(monkeypatch) -> None:
+    from concurrent.futures import Future
+
+    queued = Future()
+    monkeypatch.setattr(main_mod._work_queue, "submit", MagicMock(return_value=queued))
+    assert main_mod._index_replies_queued("oc_1", "om_root", [{}]) is queued
+
+
+def test_question_rejected_by_full_queue_gets_503_and_is_processed_on_redelivery(client: TestClient, mock_pipeline_tasks, monkeypatch) -> None:
+    real_submit = main_mod._work_queue.submit
+    calls = []
+
+    def full_once(*args, **kwargs):
+        calls.append(args[0])
+        return None if len(calls) == 1 else real_submit(*args, **kwargs)
+
+    monkeypatch.setattr(main_mod._work_queue, "submit", full_once)
+    # Lark redelivers an event whose delivery failed
+    assert client.post("/webhook/lark", json=_root_event("ev_full", "om_full")).status_code == 503
+    assert client.post("/webhook/lark", json=_root_event("ev_full", "om_full")).status_code == 200
+    main_mod._work_queue.drain(timeout=5)
+    assert len(calls) == 2
+    mock_pipeline_tasks["handle"].assert_called_once()
+
+
+def test_async_answers_run_on_the_loop_and_are_bounded(monkeypatch, mock_pipeline_tasks) -> None:
+    import asyncio
+
+    release = asyncio.Event()
+    handled = []
+
+    async def fake_async(**kwargs):
+        await release.wait()
+        handled.append(kwargs["message_id"])
+
+    monkeypatch.setattr(main_mod, "ASYNC_PIPELINE", True)
+    monkeypatch.setattr(main_mod, "WARMUP_ON_STARTUP", False)
+    monkeypatch.setattr(main_mod, "WORK_QUEUE_MAX_SIZE", 2)
+    monkeypatch.setattr(main_mod, "_run_pipeline_async", fake_async)
+    monkeypatch.setattr(main_mod, "_async_counts", {"submitted": 0, "completed": 0, "rejected": 0})
+    submitted = main_mod._work_queue.stats()["priorities"]["answer"]["submitted"]
+    with TestClient(app) as c:
+        assert c.post("/webhook/lark", json=_root_event("ev_a1", "om_a1")).status_code == 200
+        assert c.post("/webhook/lark", json=_root_event("ev_a2", "om_a2")).status_code == 200
+        assert c.post("/webhook/lark", json=_root_event("ev_a3", "om_a3")).status_code == 503
+        stats = c.get("/metrics").json()["async_answers"]
+        assert stats["in_flight"] == 2 and stats["rejected"] == 1
+        c.portal.call(release.set)
+    # Shutdown waited for the in-flight answers; none of them took a work queue slot
+    assert sorted(handled) == ["om_a1", "om_a2"]
+    assert main_mod._work_queue.stats()["priorities"]["answer"]["submitted"] == submitted
+
+
+def test_reply_shed_by_full_coalescer_gets_503_and_redelivery_is_indexed(client: TestClient, mock_pipeline_tasks, monkeypatch) -> None:
+    from src.reply_coalescer import ReplyCoalescer
+
+    coalescer = ReplyCoalescer(main_mod._run_index_replies, 60.0, max_pending_roots=1)
+    monkeypatch.setattr(main_mod, "_reply_coalescer", coalescer)
+    coalescer.submit("oc_chat1", "om_busy", {"reply_message_id": "om_busy1"})
+
+    assert client.post("/webhook/lark", json=_reply_event("om_shed", "r")).status_code == 503
+    coalescer.drain(timeout=5)
+    assert client.post("/webhook/lark", json=_reply_event("om_shed", "r")).status_code == 200  # not a duplicate
+    coalescer.drain(timeout=5)
+    replies = [r for call in mock_pipeline_tasks["index_many"].call_args_list for r in call.kwargs["replies"]]
+    assert [r["reply_message_id"] for r in replies] == ["om_busy1", "om_shed"]
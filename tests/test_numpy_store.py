@@ -0,0 +1,144 @@
+"""Tests for the NumPy brute-force vector index."""
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import src.store as store_mod
+from src.numpy_store import NumpyVectorStore
+
+
+def _unit(*xs: float) -> list[float]:
+    v = np.asarray(xs, dtype=np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _meta(chat_id: str, root: str) -> dict:
+    return {
+        "answer_text": f"answer {root}",
+        "answerer_name": "Alice",
+        "answer_time": "2024-02-13T00:00:00",
+        "chat_id": chat_id,
+        "root_message_id": root,
+        "thread_id": root,
+    }
+
+
+@pytest.fixture
+def index() -> NumpyVectorStore:
+    idx = NumpyVectorStore()
+    idx.add(
+        ["a", "b", "c"],
+        [_unit(1, 0, 0), _unit(1, 1, 0), _unit(0, 0, 1)],
+        ["qa", "qb", "qc"],
+        [_meta("oc_1", "r_a"), _meta("oc_1", "r_b"), _meta("oc_2", "r_c")],
+    )
+    return idx
+
+
+def test_query_returns_top_k_best_first(index: NumpyVectorStore) -> None:
+    hits = index.query(_unit(1, 0.1, 0), top_k=2)
+    assert [doc for doc, _, _ in hits] == ["qa", "qb"]
+    assert hits[0][2] > hits[1][2]
+
+
+def test_query_restricted_to_chat_rows(index: NumpyVectorStore) -> None:
+    hits = index.query(_unit(1, 0, 0), top_k=5, chat_id="oc_2")
+    assert [doc for doc, _, _ in hits] == ["qc"]
+    assert index.query(_unit(1, 0, 0), top_k=5, chat_id="oc_unknown") == []
+
+
+def test_delete_keeps_rows_contiguous(index: NumpyVectorStore) -> None:
+    assert index.delete_by_root("r_a") == 1
+    assert index.count() == 2
+    hits = index.query(_unit(0, 0, 1), top_k=1, chat_id="oc_2")
+    assert hits[0][1]["root_message_id"] == "r_c"
+    assert index.get_by_root("r_a") is None
+
+
+def test_dim_mismatch_raises(index: NumpyVectorStore) -> None:
+    with pytest.raises(ValueError):
+        index.add(["d"], [[1.0, 0.0]], ["qd"], [_meta("oc_1", "r_d")])
+
+
+def test_persists_to_npy_and_sidecar(tmp_path) -> None:
+    path = tmp_path / "idx"
+    idx = NumpyVectorStore(path)
+    idx.add(["a"], [_unit(1, 0)], ["qa"], [_meta("oc_1", "r_a")])
+    idx.save()
+    assert (tmp_path / "idx.npy").exists()
+    assert (tmp_path / "idx.json").exists()
+    assert (tmp_path / "idx.log").stat().st_size == 0
+    reloaded = NumpyVectorStore(path)
+    assert reloaded.count() == 1
+    assert reloaded.query(_unit(1, 0), top_k=1, chat_id="oc_1")[0][0] == "qa"
+
+
+def test_writes_go_to_the_journal_not_the_snapshot(tmp_path) -> None:
+    path = tmp_path / "idx"
+    idx = NumpyVectorStore(path)
+    idx.add(["a", "b"], [_unit(1, 0), _unit(0, 1)], ["qa", "qb"], [_meta("oc_1", "r_a"), _meta("oc_1", "r_b")])
+    idx.upsert(["a"], [_unit(1, 1)], ["qa2"], [_meta("oc_1", "r_a")])
+    idx.delete_by_root("r_b")
+    assert not (tmp_path / "idx.npy").exists()
+    reloaded = NumpyVectorStore(path)
+    assert reloaded.count() == 1
+    doc, _, score = reloaded.query(_unit(1, 1), top_k=1)[0]
+    assert doc == "qa2" and score == pytest.approx(1.0)
+
+
+def test_processes_sharing_a_path_see_each_others_writes(tmp_path) -> None:
+    # Two instances on one path behave like the server and the backfill script
+    server = NumpyVectorStore(tmp_path / "idx")
+    backfill = NumpyVectorStore(tmp_path / "idx")
+    server.add(["a"], [_unit(1, 0)], ["qa"], [_meta("oc_1", "r_a")])
+    backfill.add(["b"], [_unit(0, 1)], ["qb"], [_meta("oc_1", "r_b")])
+    assert server.get_by_root("r_b") is not None
+    backfill.save()  # compaction by one process keeps the other's rows
+    server.add(["c"], [_unit(1, 1)], ["qc"], [_meta("oc_2", "r_c")])
+    assert backfill.count() == 3
+    assert NumpyVectorStore(tmp_path / "idx").count() == 3
+
+
+@pytest.fixture
+def numpy_backend(monkeypatch):
+    vs = NumpyVectorStore()
+    store_mod.set_store(vs)
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: _unit(len(text), 1))
+    return vs
+
+
+def test_store_functions_delegate_to_numpy_backend(numpy_backend) -> None:
+    store_mod.add_qa(
+        question_text="How do I deploy?",
+        answer_text="Use the script",
+        answerer_name="Alice",
+        answer_time=datetime(2024, 2, 13),
+        chat_id="oc_1",
+        root_message_id="om_root",
+        thread_id="om_root",
+        answerer_open_id="ou_alice",
+    )
+    assert store_mod.has_qa_for_root("om_root")
+    rec = store_mod.get_qa_by_root("om_root")
+    assert rec is not None and rec.answerer_open_id == "ou_alice"
+    match = store_mod.find_similar_question(_unit(len("How do I deploy?"), 1), chat_id="oc_other")
+    assert match is not None and match.root_message_id == "om_root"
+    store_mod.append_reply_to_qa("oc_1", "om_root", "How do I deploy?", "Or CI", "Bob", datetime(2024, 2, 14))
+    rec = store_mod.get_qa_by_root("om_root")
+    assert rec.answer_text == "Use the script" + store_mod.THREAD_REPLY_DELIMITER + "Or CI"
+    assert numpy_backend.count() == 1
+    store_mod.delete_by_root("om_root")
+    assert not store_mod.has_qa_for_root("om_root")
+
+
+def test_upsert_replaces_in_place_and_update_metadata_keeps_vector(index: NumpyVectorStore) -> None:
+    index.upsert(["a", "d"], [_unit(0, 1, 0), _unit(0, 0, 1)], ["qa2", "qd"], [_meta("oc_1", "r_a"), _meta("oc_3", "r_d")])
+    assert index.count() == 4
+    assert index.get_by_root("r_a")[1] == "qa2"
+    meta = _meta("oc_1", "r_a")
+    meta["answer_text"] = "updated"
+    index.update_metadata(["a"], [meta])
+    hit = index.query(_unit(0, 1, 0), top_k=1, chat_id="oc_1")[0]
+    assert hit[0] == "qa2"
+    assert hit[1]["answer_text"] == "updated"
@@ -0,0 +1,183 @@
+"""Tests for the per-chat partitioned VectorStore."""
+import time
+
+import numpy as np
+import pytest
+
+from src.numpy_store import NumpyVectorStore
+from src.partitioned_store import PartitionedVectorStore, partition_name
+
+
+def _unit(*xs: float) -> list[float]:
+    v = np.asarray(xs, dtype=np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _meta(chat_id: str, root: str) -> dict:
+    return {
+        "answer_text": f"answer {root}",
+        "answerer_name": "Alice",
+        "answer_time": "2024-02-13T00:00:00",
+        "chat_id": chat_id,
+        "root_message_id": root,
+        "thread_id": root,
+    }
+
+
+def _fill(vs: PartitionedVectorStore) -> None:
+    vs.add(
+        ["a", "b", "c"],
+        [_unit(1, 0, 0), _unit(1, 1, 0), _unit(0, 0, 1)],
+        ["qa", "qb", "qc"],
+        [_meta("oc_1", "r_a"), _meta("oc_1", "r_b"), _meta("oc_2", "r_c")],
+    )
+
+
+@pytest.fixture
+def parts_dir(tmp_path):
+    return tmp_path / "parts"
+
+
+def _partitioned(parts_dir, tmp_path, global_index=True, budget=None) -> PartitionedVectorStore:
+    return PartitionedVectorStore(
+        lambda name: NumpyVectorStore(parts_dir / name),
+        root_map_path=tmp_path / "roots.sqlite3",
+        global_index=NumpyVectorStore(tmp_path / "global") if global_index else None,
+        memory_budget_bytes=budget,
+    )
+
+
+def test_rows_are_routed_to_their_chat_partition(parts_dir, tmp_path) -> None:
+    vs = _partitioned(parts_dir, tmp_path)
+    _fill(vs)
+    assert vs.partition("oc_1").count() == 2
+    assert vs.partition("oc_2").count() == 1
+    assert vs.global_index.count() == 3
+    assert vs.count() == 3
+    assert [doc for doc, _, _ in vs.search(_unit(0, 1, 0), top_k=5, chat_id="oc_1")] == ["qb", "qa"]
+
+
+def test_search_falls_back_to_global_index_for_unknown_chat(parts_dir, tmp_path) -> None:
+    vs = _partitioned(parts_dir, tmp_path)
+    _fill(vs)
+    hits = vs.search(_unit(0, 0, 1), top_k=1, chat_id="oc_new")
+    assert [doc for doc, _, _ in hits] == ["qc"]
+    assert "oc_new" not in vs.loaded_chats()
+
+
+def test_without_global_index_unknown_chat_has_no_candidates(parts_dir, tmp_path) -> None:
+    vs = _partitioned(parts_dir, tmp_path, global_index=False)
+    _fill(vs)
+    assert vs.search(_unit(0, 0, 1), top_k=1, chat_id="oc_new") == []
+    assert vs.query(_unit(0, 0, 1), top_k=1) == []
+
+
+def test_root_lookups_and_deletes_find_the_partition(parts_dir, tmp_path) -> None:
+    vs = _partitioned(parts_dir, tmp_path)
+    _fill(vs)
+    got = vs.get_by_root("r_c")
+    assert got is not None and got[1] == "qc"
+    vs.delete_by_root("r_c")
+    assert vs.get_by_root("r_c") is None
+    assert vs.global_index.get_by_root("r_c") is None
+    assert vs.count() == 2
+    assert vs.search(_unit(0, 0, 1), top_k=5, chat_id="oc_2")[0][0] != "qc"
+
+
+def test_partitions_load_lazily_after_restart(parts_dir, tmp_path) -> None:
+    _fill(_partitioned(parts_dir, tmp_path))
+    assert (parts_dir / f"{partition_name('oc_1')}.log").exists()
+
+    reopened = _partitioned(parts_dir, tmp_path)
+    assert reopened.loaded_chats() == []
+    assert reopened.count() == 3
+    hits = reopened.search(_unit(1, 0, 0), top_k=1, chat_id="oc_1")
+    assert [doc for doc, _, _ in hits] == ["qa"]
+    assert reopened.loaded_chats() == ["oc_1"]
+
+
+def test_chats_written_by_another_process_show_up_once_counts_expire(parts_dir, tmp_path) -> None:
+    server = PartitionedVectorStore(
+        lambda name: NumpyVectorStore(parts_dir / name), root_map_path=tmp_path / "roots.sqlite3", count_ttl=0.05
+    )
+    assert server.search(_unit(0, 0, 1), top_k=1, chat_id="oc_2") == []
+
+    _fill(_partitioned(parts_dir, tmp_path, global_index=False))  # e.g. the backfill script
+    assert server.search(_unit(0, 0, 1), top_k=1, chat_id="oc_2") == []  # cached count
+    time.sleep(0.06)
+    assert [doc for doc, _, _ in server.search(_unit(0, 0, 1), top_k=1, chat_id="oc_2")] == ["qc"]
+    assert server.count() == 3
+
+
+def test_cold_partitions_are_evicted_over_budget_and_reload(parts_dir, tmp_path) -> None:
+    vs = _partitioned(parts_dir, tmp_path, budget=1)
+    _fill(vs)
+    vs.search(_unit(1, 0, 0), top_k=1, chat_id="oc_1")
+    assert vs.loaded_chats() == ["oc_1"]
+    vs.search(_unit(0, 0, 1), top_k=1, chat_id="oc_2")
+    assert vs.loaded_chats() == ["oc_2"]
+    hits = vs.search(_unit(1, 0, 0), top_k=1, chat_id="oc_1")
+    assert [doc for doc, _, _ in hits] == ["qa"]
+
+
+def test_update_metadata_reaches_partition_and_global_index(parts_dir, tmp_path) -> None:
+    vs = _partitioned(parts_dir, tmp_path)
+    _fill(vs)
+    meta = dict(_meta("oc_1", "r_a"), answer_text="updated")
+    vs.update_metadata(["a"], [meta])
+    assert vs.get_by_root("r_a")[2]["answer_text"] == "updated"
+    assert vs.global_index.get_by_root("r_a")[2]["answer_text"] == "updated"
+
+
+def test_module_api_over_partitioned_memory_store(monkeypatch) -> None:
+    import src.store as store_mod
+
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: _unit(1, 0, 0) if "deploy" in text else _unit(0, 1, 0))
+    store_mod.set_store(store_mod.create_partitioned_store("memory", global_index=False))
+    store_mod.upsert_qa(
+        question_text="How do I deploy?",
+        answer_text="Run make deploy",
+        answerer_name="Alice",
+        answer_time="2024-02-13T00:00:00",
+        chat_id="oc_1",
+        root_message_id="r_1",
+        thread_id="r_1",
+    )
+    assert store_mod.has_qa_for_root("r_1")
+    assert store_mod.find_similar_questions(_unit(1, 0, 0), chat_id="oc_1", min_score=-1.0)
+    assert store_mod.find_similar_questions(_unit(1, 0, 0), chat_id="oc_2", min_score=-1.0) == []
+
+
+def test_rows_of_the_unpartitioned_index_are_imported_once(parts_dir, tmp_path) -> None:
+    legacy = NumpyVectorStore(tmp_path / "legacy")
+    legacy.add(
+        ["a", "c"],
+        [_unit(1, 0, 0), _unit(0, 0, 1)],
+        ["qa", "qc"],
+        [_meta("oc_1", "r_a"), _meta("oc_2", "r_c")],
+    )
+    embedded: list[str] = []
+
+    def embed(docs: list[str]) -> list[list[float]]:
+        embedded.extend(docs)
+        return [_unit(1, 0, 0) if d == "qa" else _unit(0, 0, 1) for d in docs]
+
+    vs = _partitioned(parts_dir, tmp_path, global_index=False)
+    assert vs.import_legacy_rows(legacy, embed) == 2
+    assert vs.count() == 2
+    assert vs.get_by_root("r_c")[1] == "qc"
+    assert [doc for doc, _, _ in vs.search(_unit(1, 0, 0), top_k=5, chat_id="oc_1")] == ["qa"]
+
+    reopened = _partitioned(parts_dir, tmp_path, global_index=False)
+    assert not reopened.needs_legacy_import()
+    assert reopened.import_legacy_rows(legacy, embed) == 0
+    assert embedded == ["qa", "qc"]
+
+
+def test_chroma_partitions_are_not_evicted(monkeypatch, tmp_path) -> None:
+    import src.store as store_mod
+
+    monkeypatch.setattr(store_mod, "CHROMA_PERSIST_DIR", tmp_path)
+    vs = store_mod.create_partitioned_store("chroma", global_index=False, memory_mb=1)
+    assert vs._budget is None
+    assert not vs.needs_legacy_import()
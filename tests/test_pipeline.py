@@ -4,6 +4,7 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
+from src.cache import LRUCache
 from src.pipeline import DONT_KNOW_REPLY, handle_message, index_reply
 
 
@@ -23,6 +24,7 @@ def mock_dependencies(monkeypatch):
     monkeypatch.setattr("src.pipeline.lark_client", MagicMock())
     monkeypatch.setattr("src.pipeline.formatter", MagicMock())
     monkeypatch.setattr("src.pipeline.ANSWERED_ONCE_CHAT_IDS", [])  # allow any chat
+    monkeypatch.setattr("src.pipeline._root_cache", LRUCache(100, ttl_seconds=60))
     return mock_store
 
 
@@ -88,6 +90,7 @@ def test_handle_message_with_match_sends_post(mock_dependencies, monkeypatch) ->
         root_message_id="om_root",
         thread_id="om_root",
         answerer_open_id="ou_alice",
+        answer_summary=None,
     )
     mock_store.find_similar_question.return_value = mock_record
     formatter.build_post_content.return_value = {"post": "content"}
@@ -107,6 +110,28 @@ def test_handle_message_with_match_sends_post(mock_dependencies, monkeypatch) ->
     assert call_kwargs["root_id"] == "om_1"
 
 
+def test_handle_message_rerank_widens_retrieval_and_keeps_best(mock_dependencies, monkeypatch) -> None:
+    from src.pipeline import lark_client, question_detector
+
+    monkeypatch.setattr("src.pipeline.ANSWER_MODE", "top_1")
+    monkeypatch.setattr("src.pipeline.RERANK_ENABLED", True)
+    monkeypatch.setattr("src.pipeline.RERANK_CANDIDATES", 20)
+    question_detector.is_question.return_value = True
+    mock_store = mock_dependencies
+    weak, strong = MagicMock(answer_text="weak"), MagicMock(answer_text="strong")
+    mock_store.find_similar_questions.return_value = [(weak, 0.9), (strong, 0.8)]
+    rerank = MagicMock(return_value=[(strong, 0.8)])
+    monkeypatch.setattr("src.reranker.rerank", rerank)
+    lark_client.send_text_message.return_value = "om_reply"
+
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+
+    assert mock_store.find_similar_questions.call_args.kwargs["top_k"] == 20
+    mock_store.find_similar_question.assert_not_called()
+    rerank.assert_called_once_with("How do I deploy?", [(weak, 0.9), (strong, 0.8)], 1)
+    lark_client.send_text_message.assert_called_once()
+
+
 def test_index_reply_skips_no_root_id(mock_dependencies) -> None:
     from src.pipeline import store
 
@@ -161,3 +186,263 @@ def test_index_reply_appends_reply(mock_dependencies) -> None:
     assert call_kwargs["chat_id"] == "oc_1"
     assert call_kwargs["root_id"] == "om_root"
     assert call_kwargs["answerer_open_id"] == "ou_alice"
+
+
+def test_index_replies_fetches_root_once_and_writes_once(mock_dependencies) -> None:
+    from src.pipeline import index_replies, lark_client, question_detector, store
+    from src.store import THREAD_REPLY_DELIMITER
+
+    lark_client.get_message.return_value = {"content": '{"text": "How do I deploy?"}'}
+    question_detector.is_question.return_value = True
+
+    index_replies(
+        "oc_1",
+        "om_root",
+        [
+            {"reply_message_id": "om_3", "reply_content": '{"text": "second"}', "reply_sender_id": "ou_bob", "reply_create_time": "1700000002000"},
+            {"reply_message_id": "om_2", "reply_content": '{"text": "first"}', "reply_sender_id": "ou_alice", "reply_create_time": "1700000001000"},
+        ],
+    )
+
+    lark_client.get_message.assert_called_once_with("om_root")
+    store.append_reply_to_qa.assert_called_once()
+    call_kwargs = store.append_reply_to_qa.call_args.kwargs
+    assert call_kwargs["new_reply_text"] == "first" + THREAD_REPLY_DELIMITER + "second"
+    assert call_kwargs["answerer_open_id"] == "ou_bob"
+
+
+def _reply(n: int) -> dict:
+    return dict(
+        chat_id="oc_1",
+        root_id="om_root",
+        reply_message_id=f"om_{n}",
+        reply_content='{"text": "reply %d"}' % n,
+        reply_sender_id="ou_1",
+        reply_create_time="1700000000000",
+    )
+
+
+def test_index_reply_caches_root_question(mock_dependencies) -> None:
+    from src.pipeline import lark_client, question_detector, store
+
+    lark_client.get_message.return_value = {"content": '{"text": "How do I deploy?"}'}
+    question_detector.is_question.return_value = True
+    for n in range(3):
+        index_reply(**_reply(n))
+    lark_client.get_message.assert_called_once_with("om_root")
+    question_detector.is_question.assert_called_once()
+    assert store.append_reply_to_qa.call_count == 3
+
+
+def test_index_reply_caches_non_question_root(mock_dependencies) -> None:
+    from src.pipeline import lark_client, question_detector, store
+
+    lark_client.get_message.return_value = {"content": '{"text": "Just a statement"}'}
+    question_detector.is_question.return_value = False
+    for n in range(3):
+        index_reply(**_reply(n))
+    lark_client.get_message.assert_called_once()
+    store.append_reply_to_qa.assert_not_called()
+
+
+def test_index_reply_does_not_cache_failed_root_fetch(mock_dependencies) -> None:
+    from src.pipeline import lark_client, question_detector, store
+
+    lark_client.get_message.return_value = None
+    index_reply(**_reply(0))
+    lark_client.get_message.return_value = {"content": '{"text": "How do I deploy?"}'}
+    question_detector.is_question.return_value = True
+    index_reply(**_reply(1))
+    assert lark_client.get_message.call_count == 2
+    store.append_reply_to_qa.assert_called_once()
+
+
+def test_top_1_prefers_precomputed_thread_summary(mock_dependencies, monkeypatch) -> None:
+    from src.pipeline import formatter, question_detector
+
+    monkeypatch.setattr("src.pipeline.ANSWER_MODE", "top_1")
+    question_detector.is_question.return_value = True
+    mock_dependencies.find_similar_question.return_value = MagicMock(
+        answer_text="x" * 5000, answer_summary="Short answer.", answer_time=datetime(2024, 2, 13)
+    )
+
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+
+    assert formatter.build_post_content.call_args.kwargs["answer_summary"] == "Short answer."
+
+
+def test_summarize_thread_stores_summary_for_long_threads(mock_dependencies, monkeypatch) -> None:
+    from src import pipeline
+
+    summarize = MagicMock(return_value="Resolved by restarting.")
+    monkeypatch.setattr("src.answer_summarizer.summarize_thread", summarize)
+    monkeypatch.setattr("src.pipeline.THREAD_SUMMARY_MIN_CHARS", 100)
+    mock_store = mock_dependencies
+
+    mock_store.get_qa_by_root.return_value = MagicMock(question_text="Q?", answer_text="short")
+    pipeline.summarize_thread("om_root")
+    summarize.assert_not_called()
+
+    mock_store.get_qa_by_root.return_value = MagicMock(question_text="Q?", answer_text="y" * 200)
+    pipeline.summarize_thread("om_root")
+    mock_store.set_answer_summary.assert_called_once_with("om_root", "Resolved by restarting.", "y" * 200)
+
+
+def test_summarize_missing_threads_covers_bulk_written_threads(mock_dependencies, monkeypatch) -> None:
+    from src import pipeline
+
+    mock_dependencies.roots_missing_summary.return_value = ["om_1", "om_2", "om_gone"]
+    mock_dependencies.get_qa_by_root.side_effect = lambda root: None if root == "om_gone" else MagicMock(
+        question_text="Q?", answer_text="y" * 200
+    )
+    mock_dependencies.set_answer_summary.return_value = True
+    monkeypatch.setattr("src.answer_summarizer.summarize_thread", MagicMock(return_value="Short."))
+    monkeypatch.setattr("src.pipeline.THREAD_SUMMARY_MIN_CHARS", 100)
+
+    assert pipeline.summarize_missing_threads(workers=2) == 2
+    mock_dependencies.roots_missing_summary.assert_called_once_with(100)
+    assert sorted(c.args[0] for c in mock_dependencies.set_answer_summary.call_args_list) == ["om_1", "om_2"]
+
+
+def test_index_replies_schedules_thread_summary(mock_dependencies, monkeypatch) -> None:
+    from src import pipeline
+
+    scheduler = MagicMock()
+    monkeypatch.setattr("src.pipeline._thread_summaries", scheduler)
+    monkeypatch.setattr("src.pipeline._get_root_question", lambda root_id: ("How do I deploy?", True))
+    pipeline.index_replies(
+        "oc_1",
+        "om_root",
+        [{"reply_message_id": "om_r", "reply_content": '{"text": "Use make"}', "reply_sender_id": "ou_b", "reply_create_time": "1"}],
+    )
+    scheduler.touch.assert_called_once_with("om_root")
+
+
+class StubLark:
+    """Local stand-in for lark_client: records sent messages and applies in-place edits."""
+
+    def __init__(self, fail_send: bool = False) -> None:
+        self.messages: dict[str, str] = {}
+        self.edits: list[tuple[str, str]] = []
+        self.fail_send = fail_send
+
+    def build_thread_link(self, chat_id: str, message_id: str) -> str:
+        return f"https://example.test/{chat_id}/{message_id}"
+
+    def send_text_message(self, chat_id, text, *, root_id=None, post_content=None):
+        if self.fail_send:
+            return None
+        message_id = f"om_bot_{len(self.messages)}"
+        self.messages[message_id] = text
+        return message_id
+
+    def update_message(self, message_id, text, *, post_content=None) -> bool:
+        self.messages[message_id] = text
+        self.edits.append((message_id, text))
+        return True
+
+
+@pytest.fixture
+def streaming_llm(mock_dependencies, monkeypatch):
+    from src import formatter as real_formatter
+
+    lark = StubLark()
+    monkeypatch.setattr("src.pipeline.lark_client", lark)
+    monkeypatch.setattr("src.pipeline.formatter", real_formatter)
+    monkeypatch.setattr("src.pipeline.ANSWER_MODE", "llm_summarize")
+    monkeypatch.setattr("src.pipeline.LLM_STREAMING", True)
+    monkeypatch.setattr("src.pipeline.LLM_STREAM_UPDATE_MS", 0.0)
+    from src.pipeline import question_detector
+
+    question_detector.is_question.return_value = True
+    rec = MagicMock(chat_id="oc_1", root_message_id="om_root")
+    mock_dependencies.find_similar_questions.return_value = [(rec, 0.9)]
+    return lark
+
+
+def test_streaming_posts_placeholder_then_edits_in_place(streaming_llm, monkeypatch) -> None:
+    from src.pipeline import STREAM_PLACEHOLDER
+
+    seen_at_first_chunk = {}
+
+    def fake_stream(question, candidates, query_embedding=None):
+        def gen():
+            seen_at_first_chunk.update(streaming_llm.messages)
+            yield "Restart "
+            yield "the runner."
+        return gen()
+
+    monkeypatch.setattr("src.answer_summarizer.summarize_answer_stream", fake_stream)
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+
+    assert list(streaming_llm.messages) == ["om_bot_0"]
+    assert STREAM_PLACEHOLDER in seen_at_first_chunk["om_bot_0"]
+    assert "Restart  …" in streaming_llm.edits[0][1]
+    assert "Restart the runner." in streaming_llm.messages["om_bot_0"]
+    assert "…" not in streaming_llm.messages["om_bot_0"].split("Here's the summary:")[1].splitlines()[1]
+
+
+def test_streaming_edits_are_capped(streaming_llm, monkeypatch) -> None:
+    monkeypatch.setattr("src.pipeline.LLM_STREAM_MAX_EDITS", 3)
+    monkeypatch.setattr(
+        "src.answer_summarizer.summarize_answer_stream",
+        lambda q, c, query_embedding=None: iter([f"w{i} " for i in range(50)]),
+    )
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+    assert len(streaming_llm.edits) == 3
+    assert "w49" in streaming_llm.edits[-1][1]
+
+
+def test_streaming_stops_editing_once_the_truncated_reply_stops_changing(streaming_llm, monkeypatch) -> None:
+    monkeypatch.setattr("src.pipeline.LLM_STREAM_MAX_EDITS", 1000)
+    monkeypatch.setattr(
+        "src.answer_summarizer.summarize_answer_stream",
+        lambda q, c, query_embedding=None: iter([f"word{i:03d} " for i in range(200)]),  # ~1600 chars
+    )
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+    texts = [text for _, text in streaming_llm.edits]
+    # Every edit shows something new; past the 500-char cut no chunk does, so no more edits are sent
+    assert len(texts) == len(set(texts))
+    assert len(texts) < 70  # one per word up to the cut, not one per chunk
+    assert "word061..." in texts[-1]
+
+
+def test_streaming_error_before_text_edits_placeholder_to_dont_know(streaming_llm, monkeypatch) -> None:
+    def broken(q, c, query_embedding=None):
+        def gen():
+            raise RuntimeError("api down")
+            yield ""
+        return gen()
+
+    monkeypatch.setattr("src.answer_summarizer.summarize_answer_stream", broken)
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+    assert streaming_llm.messages == {"om_bot_0": DONT_KNOW_REPLY}
+
+
+def test_streaming_error_midway_replaces_partial_summary(streaming_llm, monkeypatch) -> None:
+    def dies_midway(q, c, query_embedding=None):
+        def gen():
+            yield "Restart "
+            raise RuntimeError("connection reset")
+        return gen()
+
+    monkeypatch.setattr("src.answer_summarizer.summarize_answer_stream", dies_midway)
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+    assert "Restart" in streaming_llm.edits[0][1]
+    assert streaming_llm.messages == {"om_bot_0": DONT_KNOW_REPLY}
+
+
+def test_streaming_without_llm_key_falls_back_to_best_candidate(streaming_llm, monkeypatch) -> None:
+    def no_key(q, c, query_embedding=None):
+        raise ValueError("OPENAI_API_KEY is required")
+
+    monkeypatch.setattr("src.answer_summarizer.summarize_answer_stream", no_key)
+    best = MagicMock(
+        chat_id="oc_1", root_message_id="om_root", answer_summary="Use make deploy.", answer_time="Feb 13",
+        answerer_name="Alice", answerer_open_id=None,
+    )
+    mock_store = __import__("src.pipeline", fromlist=["store"]).store
+    mock_store.pick_best_candidate.return_value = best
+    handle_message(chat_id="oc_1", message_id="om_1", message_text="How do I deploy?", sender_id="ou_1")
+    assert streaming_llm.edits == []
+    assert "Use make deploy." in streaming_llm.messages["om_bot_0"]
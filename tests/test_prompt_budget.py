@@ -0,0 +1,71 @@
+"""Tests for the token-budgeted prompt builder."""
+import pytest
+
+from src import prompt_budget
+from src.prompt_budget import GAP_MARKER, allocate, count_tokens, drop_near_duplicates, fit_candidates, trim_thread
+from src.store import THREAD_REPLY_DELIMITER, QARecord
+
+
+@pytest.fixture(autouse=True)
+def approx_counter(monkeypatch):
+    """Use the built-in estimate so results do not depend on tiktoken being installed."""
+    monkeypatch.setattr(prompt_budget, "_counter", prompt_budget._approx_tokens)
+
+
+def _rec(root: str, question: str, answer: str, summary: str | None = None) -> QARecord:
+    return QARecord(question, answer, "Alice", "2024-02-13T00:00:00", "oc_1", root, root, answer_summary=summary)
+
+
+def test_count_tokens_estimates_latin_and_cjk() -> None:
+    assert count_tokens("") == 0
+    assert count_tokens("abcdefgh") == 2
+    assert count_tokens("部署失败") == 4
+
+
+def test_allocate_is_weighted_and_redistributes_unused_share() -> None:
+    assert allocate([1000, 1000], [3.0, 1.0], 400) == [300, 100]
+    assert allocate([50, 1000], [1.0, 1.0], 400) == [50, 350]
+    assert allocate([50, 60], [1.0, 1.0], 400) == [50, 60]
+
+
+def test_drop_near_duplicates_keeps_best_scored() -> None:
+    a = _rec("r1", "How to reset VPN password?", "Use the portal at vpn.example.com")
+    b = _rec("r2", "How to reset VPN password", "Use the portal at vpn.example.com")
+    c = _rec("r3", "Where is the office?", "Building 4")
+    kept, dropped = drop_near_duplicates([(a, 0.8), (b, 0.9), (c, 0.7)], threshold=0.8)
+    assert [rec.root_message_id for rec, _ in kept] == ["r2", "r3"]
+    assert dropped == 1
+
+
+def test_trim_thread_keeps_relevant_and_last_replies_in_order() -> None:
+    replies = ["thanks, looking", "noise " * 40, "the vpn certificate expired", "noise " * 40, "fixed: renewed cert"]
+    thread = THREAD_REPLY_DELIMITER.join(replies)
+    trimmed = trim_thread(thread, "vpn certificate problem", tokens=30)
+    parts = trimmed.split(THREAD_REPLY_DELIMITER)
+    assert "the vpn certificate expired" in parts and "fixed: renewed cert" in parts
+    assert parts.index("the vpn certificate expired") < parts.index("fixed: renewed cert")
+    assert GAP_MARKER in parts
+    assert count_tokens(trimmed) <= 30
+    assert trim_thread("short", "q", tokens=30) == "short"
+
+
+def test_fit_candidates_stays_within_budget_and_prefers_summary() -> None:
+    long_thread = THREAD_REPLY_DELIMITER.join(f"reply {i} " + "words " * 30 for i in range(30))
+    candidates = [
+        (_rec("r1", "Deploy fails?", long_thread), 0.9),
+        (_rec("r2", "Deploy broken?", long_thread, summary="Restart the runner."), 0.8),
+    ]
+    fitted, dropped = fit_candidates("deploy fails", candidates, token_budget=200, duplicate_threshold=0.95)
+    assert dropped == 0
+    assert fitted[1] == ("Deploy broken?", "Restart the runner.")
+    assert sum(count_tokens(q) + count_tokens(a) for q, a in fitted) <= 200 + 5
+
+
+def test_build_user_prompt_is_bounded(monkeypatch) -> None:
+    from src.answer_summarizer import _build_user_prompt
+
+    huge = THREAD_REPLY_DELIMITER.join("reply " + "x" * 2000 for _ in range(5))
+    candidates = [(_rec(f"r{i}", f"Question {i}?", huge + str(i)), 0.9 - i / 100) for i in range(5)]
+    prompt = _build_user_prompt("question", candidates, token_budget=500)
+    assert count_tokens(prompt) < 700
+    assert prompt.count("Question:") == 5
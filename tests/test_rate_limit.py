@@ -0,0 +1,75 @@
+"""Tests for the Lark client-side rate limiter."""
+import threading
+import time
+
+import pytest
+
+from src.rate_limit import PRIORITY_BACKFILL, PRIORITY_LIVE, RateLimiter, TokenBucket, parse_limits
+
+
+def test_burst_then_rate() -> None:
+    bucket = TokenBucket(rate=20, burst=5, reserve_share=0)
+    assert all(bucket.try_take(PRIORITY_LIVE) == 0.0 for _ in range(5))
+    assert bucket.try_take(PRIORITY_LIVE) > 0
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.15  # 4 tokens at 20/s once the burst is spent
+    assert bucket.throttled_seconds > 0
+
+
+def test_backfill_leaves_reserve_for_live() -> None:
+    bucket = TokenBucket(rate=0.1, burst=10, reserve_share=0.2)
+    taken = 0
+    while bucket.try_take(PRIORITY_BACKFILL) == 0.0:
+        taken += 1
+    assert taken == 8
+    assert bucket.try_take(PRIORITY_LIVE) == 0.0
+    assert bucket.try_take(PRIORITY_LIVE) == 0.0
+
+
+def test_backfill_yields_to_waiting_live_callers() -> None:
+    bucket = TokenBucket(rate=20, burst=1, reserve_share=0)
+    bucket.try_take(PRIORITY_LIVE)
+    order: list[str] = []
+    live = threading.Thread(target=lambda: (bucket.acquire(PRIORITY_LIVE), order.append("live")))
+    live.start()
+    while not bucket._live_waiting:
+        time.sleep(0.001)
+    bucket.acquire(PRIORITY_BACKFILL)
+    order.append("backfill")
+    live.join()
+    assert order == ["live", "backfill"]
+
+
+def test_pause_holds_every_caller() -> None:
+    bucket = TokenBucket(rate=1000, burst=10)
+    bucket.pause(0.1)
+    assert bucket.try_take(PRIORITY_LIVE) == pytest.approx(0.1, abs=0.02)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+async def test_async_acquire_waits_for_tokens() -> None:
+    bucket = TokenBucket(rate=20, burst=1)
+    await bucket.aacquire()
+    assert await bucket.aacquire() > 0
+
+
+def test_limiter_per_endpoint_buckets_and_stats() -> None:
+    limiter = RateLimiter({"PUT /open-apis/im/v1/messages/:id": (5, 10)}, default=(16, 50))
+    assert limiter.bucket("PUT /open-apis/im/v1/messages/:id").rate == 5
+    assert limiter.bucket("GET /open-apis/im/v1/messages").burst == 50
+    assert RateLimiter().bucket("GET /x") is None
+    assert RateLimiter().acquire("GET /x") == 0.0
+    assert set(limiter.stats()) == {"PUT /open-apis/im/v1/messages/:id", "GET /open-apis/im/v1/messages"}
+
+
+def test_parse_limits() -> None:
+    spec = "PUT  /open-apis/im/v1/messages/:id=5/10, GET /open-apis/im/v1/messages=20,bogus,x=y"
+    assert parse_limits(spec) == {
+        "PUT /open-apis/im/v1/messages/:id": (5.0, 10.0),
+        "GET /open-apis/im/v1/messages": (20.0, 20.0),
+    }
+    assert parse_limits(None) == {}
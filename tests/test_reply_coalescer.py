@@ -0,0 +1,114 @@
+"""Tests for the per-root reply coalescer."""
+import threading
+import time
+
+from src.reply_coalescer import ReplyCoalescer
+
+
+def test_burst_within_window_is_one_handler_call() -> None:
+    calls: list[tuple[str, str, list[dict]]] = []
+    c = ReplyCoalescer(lambda chat, root, replies: calls.append((chat, root, replies)), 0.05)
+    for i in range(4):
+        c.submit("oc_1", "om_root", {"n": i})
+    c.submit("oc_1", "om_other", {"n": 9})
+    c.drain(timeout=5)
+    assert sorted((root, [r["n"] for r in replies]) for _, root, replies in calls) == [
+        ("om_other", [9]),
+        ("om_root", [0, 1, 2, 3]),
+    ]
+    assert c.pending() == 0
+
+
+def test_same_root_handlers_never_overlap() -> None:
+    active = {"n": 0, "max": 0}
+    seen: list[int] = []
+    lock = threading.Lock()
+
+    def handler(chat: str, root: str, replies: list[dict]) -> None:
+        with lock:
+            active["n"] += 1
+            active["max"] = max(active["max"], active["n"])
+        time.sleep(0.02)
+        seen.extend(r["n"] for r in replies)
+        with lock:
+            active["n"] -= 1
+
+    c = ReplyCoalescer(handler, 0.0)
+    for i in range(10):
+        c.submit("oc_1", "om_root", {"n": i})
+        time.sleep(0.005)
+    c.drain(timeout=5)
+    assert active["max"] == 1
+    assert seen == list(range(10))
+
+
+def test_handler_errors_do_not_block_later_replies() -> None:
+    calls: list[int] = []
+
+    def handler(chat: str, root: str, replies: list[dict]) -> None:
+        calls.append(len(replies))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    c = ReplyCoalescer(handler, 0.0)
+    c.submit("oc_1", "om_root", {})
+    c.drain(timeout=5)
+    c.submit("oc_1", "om_root", {})
+    c.drain(timeout=5)
+    assert calls == [1, 1]
+
+
+def test_one_scheduler_thread_serves_many_roots_and_new_roots_are_shed_when_full() -> None:
+    calls: list[str] = []
+    c = ReplyCoalescer(lambda chat, root, replies: calls.append(root), 0.05, max_pending_roots=50, max_concurrency=2)
+    before = threading.active_count()
+    accepted = [c.submit("oc_1", f"om_{i}", {}) for i in range(100)]
+    assert threading.active_count() <= before + 1  # the scheduler; handler threads start on the first flush
+    assert accepted == [True] * 50 + [False] * 50
+    assert c.submit("oc_1", "om_0", {})  # a root already queued still takes replies
+    assert c.stats()["pending_roots"] == 50 and c.stats()["shed"] == 50
+    assert c.drain(timeout=5)
+    assert sorted(calls) == sorted(f"om_{i}" for i in range(50))
+    assert threading.active_count() <= before + 3
+
+
+def test_future_returned_by_handler_keeps_the_root_busy() -> None:
+    from concurrent.futures import Future
+
+    futures: list[Future] = []
+    batches: list[list[int]] = []
+
+    def handler(chat: str, root: str, replies: list[dict]) -> Future:
+        batches.append([r["n"] for r in replies])
+        futures.append(Future())
+        return futures[-1]
+
+    c = ReplyCoalescer(handler, 0.0)
+    c.submit("oc_1", "om_root", {"n": 0})
+    deadline = time.monotonic() + 2
+    while not futures and time.monotonic() < deadline:
+        time.sleep(0.005)
+    c.submit("oc_1", "om_root", {"n": 1})
+    time.sleep(0.05)
+    assert batches == [[0]]  # the first batch is still in flight
+    futures[0].set_result(None)
+    assert not c.drain(timeout=0.2)  # second batch handed over, its future unresolved
+    futures[1].set_result(None)
+    assert c.drain(timeout=5)
+    assert batches == [[0], [1]]
+
+
+def test_retryable_failure_requeues_the_batch_ahead_of_newer_replies() -> None:
+    batches: list[list[int]] = []
+
+    def handler(chat: str, root: str, replies: list[dict]) -> None:
+        batches.append([r["n"] for r in replies])
+        if len(batches) == 1:
+            c.submit("oc_1", "om_root", {"n": 1})
+            raise TimeoutError("busy")
+
+    c = ReplyCoalescer(handler, 0.0, retry_on=(TimeoutError,), retry_delay=0.01, max_retries=1)
+    c.submit("oc_1", "om_root", {"n": 0})
+    assert c.drain(timeout=5)
+    assert batches == [[0], [0, 1]]
+    assert c.stats()["retried"] == 1 and c.stats()["dropped"] == 0
@@ -0,0 +1,113 @@
+"""Tests for the cross-encoder rerank stage (fake model; no download)."""
+import threading
+
+import pytest
+
+import src.reranker as reranker
+from src.store import QARecord
+
+
+class FakeCrossEncoder:
+    """Scores a pair by how many query words the passage contains; counts predict calls."""
+
+    def __init__(self, block: threading.Event | None = None) -> None:
+        self.calls: list[int] = []
+        self.block = block
+
+    def predict(self, pairs):
+        if self.block is not None:
+            self.block.wait(5)
+        self.calls.append(len(pairs))
+        return [float(sum(w in p.lower() for w in q.lower().split())) for q, p in pairs]
+
+
+def _rec(root: str, question: str) -> QARecord:
+    return QARecord(question, "answer", "Alice", "2024-02-13T00:00:00", "oc_1", root, root)
+
+
+@pytest.fixture
+def candidates() -> list[tuple[QARecord, float]]:
+    return [
+        (_rec("r1", "How do I request a laptop?"), 0.9),
+        (_rec("r2", "VPN drops on macOS sonoma"), 0.8),
+        (_rec("r3", "VPN setup"), 0.7),
+    ]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(reranker, "_scores", reranker.LRUCache(100))
+
+
+def test_rerank_orders_by_cross_encoder_and_keeps_vector_scores(monkeypatch, candidates) -> None:
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(reranker, "_model", model)
+    ranked = reranker.rerank("vpn drops on macos", candidates, top_k=2)
+    assert [rec.root_message_id for rec, _ in ranked] == ["r2", "r3"]
+    assert [score for _, score in ranked] == [0.8, 0.7]
+    assert model.calls == [3]
+
+
+def test_rerank_scores_are_cached_per_query_and_record(monkeypatch, candidates) -> None:
+    model = FakeCrossEncoder()
+    monkeypatch.setattr(reranker, "_model", model)
+    reranker.rerank("vpn drops on macos", candidates, top_k=2)
+    reranker.rerank("vpn  drops on macos ", candidates, top_k=2)
+    assert model.calls == [3]
+    extra = candidates + [(_rec("r4", "VPN drops"), 0.6)]
+    reranker.rerank("vpn drops on macos", extra, top_k=2)
+    assert model.calls == [3, 1]
+
+
+def test_rerank_over_budget_falls_back_to_vector_order(monkeypatch, candidates) -> None:
+    release = threading.Event()
+    model = FakeCrossEncoder(block=release)
+    monkeypatch.setattr(reranker, "_model", model)
+    ranked = reranker.rerank("vpn drops on macos", candidates, top_k=2, budget_ms=20)
+    assert [rec.root_message_id for rec, _ in ranked] == ["r1", "r2"]
+    release.set()
+    reranker._executor.submit(lambda: None).result(5)
+    # The late batch still filled the cache, so the next call is reranked without the model.
+    model.block = None
+    ranked = reranker.rerank("vpn drops on macos", candidates, top_k=2, budget_ms=20)
+    assert [rec.root_message_id for rec, _ in ranked] == ["r2", "r3"]
+    assert model.calls == [3]
+
+
+def test_rerank_model_error_falls_back(monkeypatch, candidates) -> None:
+    class Broken:
+        def predict(self, pairs):
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(reranker, "_model", Broken())
+    assert reranker.rerank("vpn", candidates, top_k=1) == candidates[:1]
+
+
+def test_rerank_runs_next_to_a_slow_batch_and_falls_back_only_past_the_budget(monkeypatch, candidates) -> None:
+    release = threading.Event()
+    scored: list[str] = []
+
+    class SlowOnOneQuestion:
+        def predict(self, pairs):
+            if pairs[0][0] == "slow question":
+                release.wait(5)
+            scored.append(pairs[0][0])
+            return FakeCrossEncoder().predict(pairs)
+
+    monkeypatch.setattr(reranker, "_model", SlowOnOneQuestion())
+    two_threads = reranker.ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(reranker, "_executor", two_threads)
+    assert reranker.rerank("slow question", candidates, top_k=2, budget_ms=20) == candidates[:2]
+    # The second thread scores the next question within its budget instead of skipping the rerank
+    ranked = reranker.rerank("laptop request", candidates, top_k=1, budget_ms=2000)
+    assert ranked[0][0].root_message_id == "r1"
+
+    # With every scoring thread busy, a batch waits for one until its budget runs out, then is dropped
+    one_thread = reranker.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(reranker, "_executor", one_thread)
+    reranker.rerank("slow question", candidates[1:], top_k=2, budget_ms=20)
+    assert reranker.rerank("vpn drops on macos", candidates, top_k=2, budget_ms=50) == candidates[:2]
+    release.set()
+    two_threads.shutdown(wait=True)
+    one_thread.shutdown(wait=True)
+    assert sorted(scored) == ["laptop request", "slow question", "slow question"]  # the dropped batch never ran
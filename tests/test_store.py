@@ -1,4 +1,5 @@
 """Tests for store."""
+import time
 from datetime import datetime
 from unittest.mock import patch
 
@@ -81,3 +82,402 @@ def test_find_similar_question_min_score_too_high(
     # With identical embeddings score=1.0; min_score > 1 => no match
     match = find_similar_question(FAKE_EMBEDDING, chat_id="oc_chat1", min_score=1.001)
     assert match is None
+
+
+def test_warmup_queries_populated_store(
+    mock_embeddings, store_with_qa, temp_chroma_dir, reset_store_collection, monkeypatch
+) -> None:
+    import src.store as store_mod
+
+    monkeypatch.setattr(store_mod, "HYBRID_SEARCH", True)
+    store_mod.warmup(FAKE_EMBEDDING)
+    assert isinstance(store_mod._store, store_mod.ChromaVectorStore)
+    assert store_mod._lexical is not None and len(store_mod._lexical) == store_mod._store.count()
+
+
+def test_create_store_backends(temp_chroma_dir) -> None:
+    import src.store as store_mod
+    from src.numpy_store import NumpyVectorStore
+
+    assert isinstance(store_mod.create_store("memory"), NumpyVectorStore)
+    assert store_mod.create_store("memory").path is None
+    with pytest.raises(ValueError):
+        store_mod.create_store("faiss")
+
+
+def test_set_store_injects_engine(mock_embeddings) -> None:
+    import src.store as store_mod
+    from src.numpy_store import NumpyVectorStore
+
+    vs = NumpyVectorStore()
+    store_mod.set_store(vs)
+    add_qa(
+        question_text="Q?",
+        answer_text="A",
+        answerer_name="X",
+        answer_time=datetime.now(),
+        chat_id="oc_1",
+        root_message_id="om_root1",
+        thread_id="om_root1",
+    )
+    assert vs.count() == 1
+    assert has_qa_for_root("om_root1") is True
+
+
+@pytest.fixture
+def counting_embed(monkeypatch):
+    import src.store as store_mod
+
+    calls: list[str] = []
+
+    def fake_embed(text: str):
+        calls.append(text)
+        return FAKE_EMBEDDING.copy()
+
+    monkeypatch.setattr(store_mod.embeddings, "embed", fake_embed)
+    return calls
+
+
+def test_append_reply_uses_stable_id_and_skips_reembed(counting_embed, temp_chroma_dir) -> None:
+    import src.store as store_mod
+
+    for i, reply in enumerate(["first", "second", "third"]):
+        store_mod.append_reply_to_qa("oc_1", "om_root", "How do I deploy?", reply, "Bob", datetime(2024, 2, 13 + i))
+    vs = store_mod.get_store()
+    assert vs.count() == 1
+    id_, doc, meta = vs.get_by_root("om_root")
+    assert id_ == store_mod.record_id_for_root("om_root")
+    assert meta["answer_text"] == store_mod.THREAD_REPLY_DELIMITER.join(["first", "second", "third"])
+    assert counting_embed == ["How do I deploy?"]
+
+
+def test_append_reply_migrates_legacy_record(counting_embed, temp_chroma_dir) -> None:
+    import src.store as store_mod
+
+    add_qa(
+        question_text="How do I deploy?",
+        answer_text="first",
+        answerer_name="Alice",
+        answer_time=datetime(2024, 2, 13),
+        chat_id="oc_1",
+        root_message_id="om_root",
+        thread_id="om_root",
+    )
+    store_mod.append_reply_to_qa("oc_1", "om_root", "How do I deploy?", "second", "Bob", datetime(2024, 2, 14))
+    vs = store_mod.get_store()
+    assert vs.count() == 1
+    assert vs.get_by_root("om_root")[0] == store_mod.record_id_for_root("om_root")
+    assert store_mod.get_qa_by_root("om_root").answer_text == "first" + store_mod.THREAD_REPLY_DELIMITER + "second"
+
+
+def test_concurrent_appends_keep_every_reply_once(counting_embed) -> None:
+    import threading
+
+    import src.store as store_mod
+    from src.numpy_store import NumpyVectorStore
+
+    store_mod.set_store(NumpyVectorStore())
+    replies = [f"reply {i}" for i in range(20)]
+    threads = [
+        threading.Thread(
+            target=store_mod.append_reply_to_qa,
+            args=("oc_1", "om_root", "How do I deploy?", r, "Bob", datetime(2024, 2, 13)),
+        )
+        for r in replies
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store_mod.get_store().count() == 1
+    parts = store_mod.get_qa_by_root("om_root").answer_text.split(store_mod.THREAD_REPLY_DELIMITER)
+    assert sorted(parts) == sorted(replies)
+
+
+def test_append_reply_replaces_optional_metadata(counting_embed, temp_chroma_dir) -> None:
+    import src.store as store_mod
+
+    store_mod.append_reply_to_qa("oc_1", "om_root", "Q?", "first", "Alice", datetime(2024, 2, 13), "ou_alice")
+    store_mod.append_reply_to_qa("oc_1", "om_root", "Q?", "second", "Bob", datetime(2024, 2, 14), None)
+    assert store_mod.get_qa_by_root("om_root").answerer_open_id is None
+
+
+@pytest.mark.parametrize("backend", ["chroma", "memory"])
+def test_answer_summary_is_stored_and_cleared_by_new_replies(counting_embed, temp_chroma_dir, backend) -> None:
+    import src.store as store_mod
+
+    store_mod.set_store(store_mod.create_store(backend))
+    store_mod.append_reply_to_qa("oc_1", "om_root", "Q?", "first", "Alice", datetime(2024, 2, 13))
+    answer = store_mod.get_qa_by_root("om_root").answer_text
+    assert store_mod.set_answer_summary("om_root", "Summary.", answer) is True
+    assert store_mod.get_qa_by_root("om_root").answer_summary == "Summary."
+
+    store_mod.append_reply_to_qa("oc_1", "om_root", "Q?", "second", "Bob", datetime(2024, 2, 14))
+    assert store_mod.get_qa_by_root("om_root").answer_summary is None
+    # A summary of the old answer is refused once the thread has moved on.
+    assert store_mod.set_answer_summary("om_root", "Stale.", answer) is False
+    assert store_mod.set_answer_summary("om_missing", "Summary.", answer) is False
+
+
+def _unit2(x: float, y: float) -> list[float]:
+    import math
+
+    n = math.hypot(x, y)
+    return [x / n, y / n]
+
+
+@pytest.fixture(params=["chroma", "memory"])
+def scoped_store(request, temp_chroma_dir):
+    """Store with two chats: oc_a has one weak match, oc_b one exact match for query (1, 0)."""
+    import src.store as store_mod
+
+    vs = store_mod.create_store(request.param)
+    store_mod.set_store(vs)
+    for chat, root, vec in [("oc_a", "om_a", _unit2(1, 1)), ("oc_b", "om_b", _unit2(1, 0))]:
+        vs.add(
+            [store_mod.record_id_for_root(root)],
+            [vec],
+            [f"question {root}"],
+            [store_mod._record_metadata("answer", "X", "2024-02-13T00:00:00", chat, root, root)],
+        )
+    return vs
+
+
+def test_search_prefers_chat_records_over_better_global_match(scoped_store) -> None:
+    import src.store as store_mod
+
+    hits = store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_a", top_k=5, min_score=0.0)
+    assert [rec.root_message_id for rec, _ in hits] == ["om_a"]
+
+
+def test_search_falls_back_to_all_chats_when_chat_is_empty(scoped_store) -> None:
+    import src.store as store_mod
+
+    hits = store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_new", top_k=5, min_score=0.0)
+    assert [rec.root_message_id for rec, _ in hits] == ["om_b", "om_a"]
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-4)
+
+
+def test_search_does_not_fall_back_when_chat_matches_are_below_threshold(scoped_store) -> None:
+    import src.store as store_mod
+
+    assert store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_a", top_k=5, min_score=0.9) == []
+
+
+def test_chroma_search_is_one_query_without_count(scoped_store) -> None:
+    import src.store as store_mod
+
+    if not isinstance(scoped_store, store_mod.ChromaVectorStore):
+        pytest.skip("Chroma-specific")
+    # Warm the cached counts; after that a search is just the query.
+    store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_a", min_score=0.0)
+    store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_new", min_score=0.0)
+    with patch.object(scoped_store.collection, "query", wraps=scoped_store.collection.query) as q, patch.object(
+        scoped_store.collection, "count", wraps=scoped_store.collection.count
+    ) as c:
+        store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_a", min_score=0.0)
+        store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_new", min_score=0.0)
+    assert q.call_count == 2
+    assert c.call_count == 0
+
+
+def test_chroma_chat_counts_track_writes(scoped_store) -> None:
+    import src.store as store_mod
+
+    if not isinstance(scoped_store, store_mod.ChromaVectorStore):
+        pytest.skip("Chroma-specific")
+    assert (scoped_store._chat_count("oc_a"), scoped_store._chat_count("oc_b")) == (1, 1)
+    store_mod.delete_by_root("om_a")
+    scoped_store.upsert(
+        [store_mod.record_id_for_root("om_c")],
+        [_unit2(0, 1)],
+        ["question om_c"],
+        [store_mod._record_metadata("answer", "X", "2024-02-13T00:00:00", "oc_b", "om_c", "om_c")],
+    )
+    assert (scoped_store._chat_count("oc_a"), scoped_store._chat_count("oc_b")) == (0, 2)
+    hits = store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_a", top_k=5, min_score=-1.0)
+    assert {rec.root_message_id for rec, _ in hits} == {"om_b", "om_c"}
+
+
+def test_chroma_chat_counts_expire_to_see_other_writers(scoped_store) -> None:
+    import src.store as store_mod
+
+    if not isinstance(scoped_store, store_mod.ChromaVectorStore):
+        pytest.skip("Chroma-specific")
+    scoped_store._count_cache = store_mod.LRUCache(100, ttl_seconds=0.05)
+    assert scoped_store._chat_count("oc_c") == 0
+    # Written straight to the collection, as another process would
+    scoped_store.collection.add(
+        ids=[store_mod.record_id_for_root("om_d")],
+        embeddings=[_unit2(1, 0)],
+        documents=["question om_d"],
+        metadatas=[store_mod._record_metadata("answer", "X", "2024-02-13T00:00:00", "oc_c", "om_d", "om_d")],
+    )
+    assert scoped_store._chat_count("oc_c") == 0
+    time.sleep(0.06)
+    assert scoped_store._chat_count("oc_c") == 1
+
+
+def test_hybrid_search_surfaces_lexical_match_below_vector_threshold(monkeypatch) -> None:
+    """An error-code question whose embedding misses the threshold is still found through BM25."""
+    import src.store as store_mod
+
+    monkeypatch.setattr(store_mod, "HYBRID_SEARCH", True)
+
+    vectors = {
+        "Deploy fails with E1234 on db-01.prod": _unit2(1, 1.2),  # cosine ~0.64 to the query
+        "How do I reset my password?": _unit2(1, 0.3),
+    }
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: vectors[text])
+    monkeypatch.setattr(store_mod.embeddings, "embed_many", lambda texts: [vectors[t] for t in texts])
+    store_mod.set_store(store_mod.create_store("memory"))
+    for root, question in [("om_err", "Deploy fails with E1234 on db-01.prod"), ("om_pw", "How do I reset my password?")]:
+        store_mod.upsert_qa(question, "answer", "X", "2024-02-13T00:00:00", "oc_a", root, root)
+
+    query = _unit2(1, 0)
+    vector_only = store_mod.find_similar_questions(query, chat_id="oc_a", min_score=0.8)
+    assert [rec.root_message_id for rec, _ in vector_only] == ["om_pw"]
+
+    hybrid = store_mod.find_similar_questions(query, chat_id="oc_a", min_score=0.8, query_text="E1234 on db-01.prod?")
+    assert {rec.root_message_id for rec, _ in hybrid} == {"om_err", "om_pw"}
+    scores = {rec.root_message_id: score for rec, score in hybrid}
+    assert scores["om_err"] == pytest.approx(1 / (1 + 1.2**2) ** 0.5, abs=1e-6)
+
+    store_mod.delete_by_root("om_err")
+    hybrid = store_mod.find_similar_questions(query, chat_id="oc_a", min_score=0.8, query_text="E1234 on db-01.prod?")
+    assert [rec.root_message_id for rec, _ in hybrid] == ["om_pw"]
+
+
+def test_hybrid_search_rejects_unrelated_question_sharing_tokens(monkeypatch) -> None:
+    """Shared jargon does not make an unrelated thread a match: lexical hits keep a cosine floor."""
+    import src.store as store_mod
+
+    vectors = {"Why does kube-proxy crash on db-01.prod?": _unit2(-0.25, 1)}
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: vectors[text])
+    monkeypatch.setattr(store_mod.embeddings, "embed_many", lambda texts: [vectors[t] for t in texts])
+    store_mod.set_store(store_mod.create_store("memory"))
+    store_mod.upsert_qa(
+        "Why does kube-proxy crash on db-01.prod?", "answer", "X", "2024-02-13T00:00:00", "oc_a", "om_crash", "om_crash"
+    )
+
+    hits = store_mod.find_similar_questions(
+        _unit2(1, 0), chat_id="oc_a", min_score=0.78, query_text="How to upgrade kube-proxy on db-01.prod"
+    )
+    assert hits == []
+
+
+def test_lexical_index_is_built_from_existing_rows(monkeypatch, tmp_path) -> None:
+    import src.store as store_mod
+    from src.numpy_store import NumpyVectorStore
+
+    monkeypatch.setattr(store_mod, "HYBRID_SEARCH", True)
+
+    vs = NumpyVectorStore()
+    vs.add(["root:om_1"], [_unit2(1, 0)], ["Deploy fails with E1234"], [
+        store_mod._record_metadata("answer", "X", "2024-02-13T00:00:00", "oc_a", "om_1", "om_1")
+    ])
+    store_mod.set_store(vs)
+    assert [root for _, root, _ in store_mod.get_lexical_index().search("E1234", 5)] == ["om_1"]
+
+    # A persisted store with no BM25 log yet (deployments from before hybrid search)
+    monkeypatch.setattr(store_mod, "_store", vs)
+    monkeypatch.setattr(store_mod, "_lexical", None)
+    monkeypatch.setattr(store_mod, "STORE_BACKEND", "numpy")
+    index = store_mod.get_lexical_index()
+    assert index.path == tmp_path / "bm25.jsonl" and index.log_exists
+    assert [root for _, root, _ in index.search("E1234", 5)] == ["om_1"]
+
+
+def test_hybrid_search_ranks_agreeing_hit_first(monkeypatch) -> None:
+    import src.store as store_mod
+
+    monkeypatch.setattr(store_mod, "HYBRID_SEARCH", True)
+
+    vectors = {"VPN drops on macOS": _unit2(1, 0.2), "VPN setup guide": _unit2(1, 0.1)}
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: vectors[text])
+    store_mod.set_store(store_mod.create_store("memory"))
+    for root, question in [("om_drop", "VPN drops on macOS"), ("om_setup", "VPN setup guide")]:
+        store_mod.upsert_qa(question, "answer", "X", "2024-02-13T00:00:00", "oc_a", root, root)
+
+    hits = store_mod.find_similar_questions(_unit2(1, 0), chat_id="oc_a", min_score=0.0, query_text="vpn macos")
+    assert [rec.root_message_id for rec, _ in hits] == ["om_drop", "om_setup"]
+
+
+def _qa(root: str, question: str, chat_id: str = "oc_1") -> QARecord:
+    return QARecord(question, "answer", "X", "2024-02-13T00:00:00", chat_id, root, root)
+
+
+def test_add_qa_many_rewrites_changed_answers_with_one_lookup_per_chunk(monkeypatch) -> None:
+    import src.store as store_mod
+
+    embedded: list[str] = []
+
+    def fake_embed_many(texts):
+        embedded.extend(texts)
+        return [FAKE_EMBEDDING.copy() for _ in texts]
+
+    monkeypatch.setattr(store_mod.embeddings, "embed_many", fake_embed_many)
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: FAKE_EMBEDDING.copy())
+    store_mod.set_store(store_mod.create_store("memory"))
+    store_mod.add_qa_many([_qa("om_1", "Same?"), _qa("om_2", "Grown?")])
+    store_mod.add_qa("Legacy?", "old", "X", "2024-02-13T00:00:00", "oc_1", "om_3", "om_3")  # random id
+    embedded.clear()
+
+    grown = QARecord("Grown?", "answer\n\nmore", "X", "2024-02-14T00:00:00", "oc_1", "om_2", "om_2")
+    legacy = QARecord("Legacy?", "new", "X", "2024-02-14T00:00:00", "oc_1", "om_3", "om_3")
+    vs = store_mod.get_store()
+    with patch.object(vs, "get_by_roots", wraps=vs.get_by_roots) as lookups:
+        added = store_mod.add_qa_many([_qa("om_1", "Same?"), grown, legacy], write_chunk_size=10)
+
+    assert lookups.call_count == 1
+    assert [r.root_message_id for r in added] == ["om_2", "om_3"]
+    assert embedded == ["Legacy?"]  # om_2 kept its question: metadata-only rewrite
+    assert store_mod.get_qa_by_root("om_2").answer_text == "answer\n\nmore"
+    assert vs.get_by_root("om_3")[0] == store_mod.record_id_for_root("om_3")
+    assert vs.count() == 3
+
+
+def test_add_qa_many_batches_dedupes_and_reports_progress(monkeypatch) -> None:
+    import src.store as store_mod
+
+    batches: list[list[str]] = []
+
+    def fake_embed_many(texts):
+        batches.append(list(texts))
+        return [FAKE_EMBEDDING.copy() for _ in texts]
+
+    monkeypatch.setattr(store_mod.embeddings, "embed_many", fake_embed_many)
+    monkeypatch.setattr(store_mod.embeddings, "embed", lambda text: FAKE_EMBEDDING.copy())
+    store_mod.set_store(store_mod.create_store("memory"))
+    store_mod.upsert_qa("Existing?", "answer", "X", "2024-02-13T00:00:00", "oc_1", "om_0", "om_0")
+
+    records = [_qa(f"om_{i}", f"Question {i}?") for i in range(7)]
+    records += [_qa("om_3", "Duplicate of 3?"), _qa("", "No root?")]
+    progress: list[tuple[int, int]] = []
+    added = store_mod.add_qa_many(
+        records, embed_batch_size=2, write_chunk_size=4, progress=lambda done, total: progress.append((done, total))
+    )
+
+    assert [r.root_message_id for r in added] == [f"om_{i}" for i in range(1, 7)]
+    assert [len(b) for b in batches] == [2, 1, 2, 1]  # om_0 is already indexed unchanged
+    assert progress == [(4, 7), (7, 7)]
+    assert store_mod.get_store().count() == 7
+    assert store_mod.get_qa_by_root("om_3").question_text == "Question 3?"
+    assert store_mod.get_store().get_by_root("om_5")[0] == store_mod.record_id_for_root("om_5")
+    assert store_mod.add_qa_many(records) == []
+    assert store_mod.get_store().count() == 7
+
+
+def test_roots_missing_summary_lists_long_unsummarized_threads(monkeypatch) -> None:
+    import src.store as store_mod
+
+    monkeypatch.setattr(store_mod.embeddings, "embed_many", lambda texts: [FAKE_EMBEDDING.copy() for _ in texts])
+    store_mod.set_store(store_mod.create_store("memory"))
+    long_answer = "y" * 200
+    store_mod.add_qa_many([
+        QARecord("Long?", long_answer, "X", "2024-02-13T00:00:00", "oc_1", "om_long", "om_long"),
+        QARecord("Done?", long_answer, "X", "2024-02-13T00:00:00", "oc_1", "om_done", "om_done"),
+        _qa("om_short", "Short?"),
+    ])
+    assert store_mod.set_answer_summary("om_done", "Summary.", long_answer)
+    assert store_mod.roots_missing_summary(100) == ["om_long"]
@@ -0,0 +1,81 @@
+"""Tests for the LLM summary cache."""
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from src.store import QARecord
+from src.summary_cache import SummaryCache, candidate_set_key
+
+
+def _unit(*xs: float) -> list[float]:
+    v = np.asarray(xs, dtype=np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _rec(root: str, answer: str = "answer") -> QARecord:
+    return QARecord(f"question {root}", answer, "Alice", "2024-02-13T00:00:00", "oc_1", root, root)
+
+
+@pytest.fixture
+def cache(tmp_path) -> SummaryCache:
+    return SummaryCache(tmp_path / "summaries.sqlite3", ttl_seconds=3600, max_items=3, similarity=0.9)
+
+
+def test_key_ignores_order_and_scores_but_tracks_content() -> None:
+    a, b = _rec("r1"), _rec("r2")
+    assert candidate_set_key([(a, 0.9), (b, 0.8)]) == candidate_set_key([(b, 0.1), (a, 0.2)])
+    assert candidate_set_key([(a, 0.9), (b, 0.8)]) != candidate_set_key([(a, 0.9), (_rec("r2", "new reply"), 0.8)])
+
+
+def test_near_duplicate_question_hits_and_distant_one_misses(cache) -> None:
+    candidates = [(_rec("r1"), 0.9), (_rec("r2"), 0.8)]
+    cache.put(_unit(1, 0), candidates, "summary")
+    assert cache.get(_unit(1, 0.1), list(reversed(candidates))) == "summary"
+    assert cache.get(_unit(1, 1), candidates) is None
+    assert cache.get(_unit(1, 0), candidates[:1]) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_new_reply_changes_key_and_invalidate_root_drops_entries(cache) -> None:
+    cache.put(_unit(1, 0), [(_rec("r1"), 0.9)], "one")
+    cache.put(_unit(1, 0), [(_rec("r1"), 0.9), (_rec("r2"), 0.8)], "two")
+    cache.put(_unit(1, 0), [(_rec("r3"), 0.9)], "three")
+    assert cache.get(_unit(1, 0), [(_rec("r1", "answer\n---\nupdate"), 0.9)]) is None
+    assert cache.invalidate_root("r1") == 2
+    assert len(cache) == 1
+    assert cache.get(_unit(1, 0), [(_rec("r3"), 0.9)]) == "three"
+
+
+def test_ttl_and_size_eviction(tmp_path) -> None:
+    cache = SummaryCache(tmp_path / "s.sqlite3", ttl_seconds=0.05, max_items=2)
+    cache.put(_unit(1, 0), [(_rec("r1"), 0.9)], "old")
+    time.sleep(0.1)
+    assert cache.get(_unit(1, 0), [(_rec("r1"), 0.9)]) is None
+    for root in ("r2", "r3", "r4"):
+        cache.put(_unit(1, 0), [(_rec(root), 0.9)], root)
+    assert len(cache) == 2
+
+
+def test_persists_across_reopen(tmp_path) -> None:
+    path = tmp_path / "s.sqlite3"
+    SummaryCache(path).put(_unit(1, 0), [(_rec("r1"), 0.9)], "kept")
+    assert SummaryCache(path).get(_unit(1, 0), [(_rec("r1"), 0.9)]) == "kept"
+
+
+def test_summarize_answer_uses_cache_for_repeat_question(monkeypatch) -> None:
+    import src.answer_summarizer as summarizer
+    import src.summary_cache as summary_cache_mod
+
+    monkeypatch.setattr(summary_cache_mod, "SUMMARY_CACHE_ENABLED", True)
+
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content=" Use VPN. "))]
+    monkeypatch.setattr(summarizer, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(summarizer, "OpenAI", MagicMock(return_value=client))
+    candidates = [(_rec("r1"), 0.9)]
+
+    assert summarizer.summarize_answer("How to connect?", candidates, query_embedding=_unit(1, 0)) == "Use VPN."
+    assert summarizer.summarize_answer("How do I connect?", candidates, query_embedding=_unit(1, 0.05)) == "Use VPN."
+    assert client.chat.completions.create.call_count == 1
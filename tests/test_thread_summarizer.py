@@ -0,0 +1,85 @@
+"""Tests for the quiet-thread scheduler behind per-thread summaries."""
+import threading
+import time
+
+from src.thread_summarizer import QuietThreadScheduler
+
+
+def _wait_for(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_busy_thread_is_handled_once_after_it_goes_quiet() -> None:
+    calls: list[str] = []
+    scheduler = QuietThreadScheduler(calls.append, quiet_seconds=0.05)
+    for _ in range(5):
+        scheduler.touch("om_root")
+        time.sleep(0.01)
+    assert calls == []
+    assert _wait_for(lambda: calls == ["om_root"])
+    assert scheduler.pending() == 0
+
+
+def test_roots_are_independent_and_handler_errors_are_contained() -> None:
+    calls: list[str] = []
+
+    def handler(root_id: str) -> None:
+        calls.append(root_id)
+        if root_id == "om_bad":
+            raise RuntimeError("boom")
+
+    scheduler = QuietThreadScheduler(handler, quiet_seconds=0.01)
+    scheduler.touch("om_bad")
+    scheduler.touch("om_good")
+    assert _wait_for(lambda: sorted(calls) == ["om_bad", "om_good"])
+
+
+def test_concurrency_is_bounded() -> None:
+    running, peak = 0, 0
+    lock = threading.Lock()
+    done = threading.Event()
+    finished: list[str] = []
+
+    def handler(root_id: str) -> None:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.03)
+        with lock:
+            running -= 1
+            finished.append(root_id)
+            if len(finished) == 4:
+                done.set()
+
+    scheduler = QuietThreadScheduler(handler, quiet_seconds=0.0, max_concurrency=2)
+    for i in range(4):
+        scheduler.touch(f"om_{i}")
+    assert done.wait(2)
+    assert peak <= 2
+
+
+def test_cancel_all_drops_pending_roots() -> None:
+    calls: list[str] = []
+    scheduler = QuietThreadScheduler(calls.append, quiet_seconds=0.05)
+    scheduler.touch("om_root")
+    scheduler.cancel_all()
+    time.sleep(0.1)
+    assert calls == [] and scheduler.pending() == 0
+
+
+def test_one_scheduler_thread_serves_many_roots_and_pending_is_bounded() -> None:
+    calls: list[str] = []
+    scheduler = QuietThreadScheduler(calls.append, quiet_seconds=0.05, max_pending=50)
+    before = threading.active_count()
+    for i in range(100):
+        scheduler.touch(f"om_{i}")
+    assert threading.active_count() <= before + 1
+    assert scheduler.pending() == 50
+    assert _wait_for(lambda: len(calls) == 50)
+    assert sorted(calls) == sorted(f"om_{i}" for i in range(50))
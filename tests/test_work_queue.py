@@ -0,0 +1,91 @@
+"""Tests for the bounded priority work queue."""
+import threading
+import time
+
+import pytest
+
+from src.work_queue import PRIORITY_ANSWER, PRIORITY_INDEX, WorkQueue, WorkShed
+
+
+@pytest.fixture
+def blocked_queue():
+    """One-worker queue whose worker is held busy until the test sets the event."""
+    release = threading.Event()
+    q = WorkQueue(1, 4, low_priority_share=0.5)
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    q.submit(PRIORITY_ANSWER, block)
+    started.wait(5)
+    yield q, release
+    release.set()
+    q.drain(5)
+
+
+def test_runs_jobs_and_returns_results() -> None:
+    q = WorkQueue(2, 10)
+    futures = [q.submit(PRIORITY_INDEX, lambda x: x * 2, i) for i in range(5)]
+    assert [f.result(5) for f in futures] == [0, 2, 4, 6, 8]
+    assert q.drain(5)
+    stats = q.stats()
+    assert stats["depth"] == 0
+    assert stats["priorities"]["index"]["completed"] == 5
+
+
+def test_answers_run_before_queued_indexing(blocked_queue) -> None:
+    q, release = blocked_queue
+    order = []
+    q.submit(PRIORITY_INDEX, order.append, "index")
+    q.submit(PRIORITY_ANSWER, order.append, "answer")
+    release.set()
+    q.drain(5)
+    assert order == ["answer", "index"]
+
+
+def test_indexing_is_refused_beyond_its_share(blocked_queue) -> None:
+    q, _ = blocked_queue
+    assert q.submit(PRIORITY_INDEX, lambda: None) is not None
+    assert q.submit(PRIORITY_INDEX, lambda: None) is not None
+    assert q.submit(PRIORITY_INDEX, lambda: None) is None
+    assert q.submit(PRIORITY_ANSWER, lambda: None) is not None
+    assert q.stats()["priorities"]["index"]["rejected"] == 1
+
+
+def test_full_queue_sheds_newest_index_job_for_an_answer(blocked_queue) -> None:
+    q, release = blocked_queue
+    first = q.submit(PRIORITY_INDEX, lambda: "first")
+    newest = q.submit(PRIORITY_INDEX, lambda: "newest")
+    q.submit(PRIORITY_ANSWER, lambda: None)
+    q.submit(PRIORITY_ANSWER, lambda: None)
+    assert q.depth() == 4
+
+    answer = q.submit(PRIORITY_ANSWER, lambda: "answer")
+    assert answer is not None
+    with pytest.raises(WorkShed):
+        newest.result(1)
+    release.set()
+    assert first.result(5) == "first"
+    assert answer.result(5) == "answer"
+    assert q.stats()["priorities"]["index"]["shed"] == 1
+
+
+def test_answer_rejected_when_queue_is_full_of_answers(blocked_queue) -> None:
+    q, _ = blocked_queue
+    for _ in range(4):
+        assert q.submit(PRIORITY_ANSWER, lambda: None) is not None
+    assert q.submit(PRIORITY_ANSWER, lambda: None) is None
+    assert q.stats()["priorities"]["answer"]["rejected"] == 1
+
+
+def test_stats_report_wait_times(blocked_queue) -> None:
+    q, release = blocked_queue
+    q.submit(PRIORITY_INDEX, lambda: None)
+    time.sleep(0.05)
+    release.set()
+    q.drain(5)
+    index = q.stats()["priorities"]["index"]
+    assert index["wait_max"] >= 0.05
+    assert index["wait_p50"] <= index["wait_p95"] <= index["wait_max"]